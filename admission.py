@@ -0,0 +1,263 @@
+"""
+手串饰品预测软件 - 准入控制模块
+按客户端令牌桶限流，限制同时进行的DeepSeek API调用数，并按延迟目标自适应调整上限；
+超出上限的交互请求不等待DeepSeek API，直接使用基本预测结果；批量预测和后台任务排队等待同一上限中的名额
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+# 每个客户端每秒补充的令牌数和令牌桶容量，速率为0时不限流(默认)。
+# 客户端按连接的对端地址区分，部署在反向代理后面时必须同时设置TRUSTED_PROXY_HOPS，
+# 否则所有用户共用代理地址的一个令牌桶
+ADMISSION_RATE = float(os.environ.get("ADMISSION_RATE", 0))
+ADMISSION_BURST = float(os.environ.get("ADMISSION_BURST", 10))
+
+# 记录令牌桶的客户端数上限，超过时淘汰最久未访问的客户端
+ADMISSION_MAX_CLIENTS = int(os.environ.get("ADMISSION_MAX_CLIENTS", 10000))
+
+# 每个进程同时进行的增强预测数上限和自适应调整的下限
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 32))
+ADMISSION_MIN_IN_FLIGHT = int(os.environ.get("ADMISSION_MIN_IN_FLIGHT", 2))
+
+# 增强预测的延迟目标(秒)，超过时降低同时进行的上限
+ADMISSION_LATENCY_SLO = float(os.environ.get("ADMISSION_LATENCY_SLO", 8))
+
+# 超过延迟目标时上限乘以的系数
+ADMISSION_BACKOFF = 0.8
+
+# 批量预测和后台任务最多占用上限中的比例(至少1个)，其余名额留给交互请求
+ADMISSION_BACKGROUND_SHARE = float(os.environ.get("ADMISSION_BACKGROUND_SHARE", 0.5))
+
+# 批量预测和后台任务等待名额的最长时间(秒)，超时后使用基本预测结果
+ADMISSION_BACKGROUND_WAIT = float(os.environ.get("ADMISSION_BACKGROUND_WAIT", 60))
+
+# 准入控制指标
+ADMISSION_THROTTLED = metrics.Counter('admission_throttled_total', '超过客户端速率限制被拒绝的请求数', labels=('endpoint',))
+ADMISSION_SHED = metrics.Counter(
+    'admission_shed_total', '未调用DeepSeek API、直接使用基本预测结果的请求数', labels=('endpoint', 'reason'))
+
+# 不调用DeepSeek API的原因：in_flight_budget同时进行数已满，latency_slo延迟超标后上限已降低
+SHED_IN_FLIGHT_BUDGET = 'in_flight_budget'
+SHED_LATENCY_SLO = 'latency_slo'
+
+class RateLimiter:
+    """
+    按客户端的令牌桶限流
+
+    每个客户端的令牌桶按时间惰性补充，只记录(令牌数, 上次补充时间)；
+    客户端数有上限，按最久未访问淘汰
+    """
+
+    def __init__(self, rate=ADMISSION_RATE, burst=ADMISSION_BURST, max_clients=ADMISSION_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, client):
+        """
+        消耗客户端的一个令牌
+
+        参数:
+            client: 客户端标识
+
+        返回:
+            (是否允许, 令牌不足时需要等待的秒数)
+        """
+        if self.rate <= 0:
+            return True, 0.0
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+    def clients(self):
+        """当前记录的客户端数"""
+        return len(self._buckets)
+
+class AdaptiveConcurrencyLimit:
+    """
+    自适应的同时调用数上限
+
+    延迟超过目标时上限乘以ADMISSION_BACKOFF，延迟达标时每次加1/上限(约每轮加1)，
+    在[min_limit, max_limit]之间调整。降低上限时已在进行中的调用超标不再重复降低，
+    同一轮同时超标的调用只降低一次。达到上限时交互请求不等待，直接降级；
+    批量和后台调用排队等待名额，且最多占用上限的background_share
+    """
+
+    def __init__(self, max_limit=ADMISSION_MAX_IN_FLIGHT, min_limit=ADMISSION_MIN_IN_FLIGHT,
+                 latency_slo=ADMISSION_LATENCY_SLO, background_share=ADMISSION_BACKGROUND_SHARE):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.latency_slo = latency_slo
+        self.background_share = background_share
+        self._limit = float(max_limit)
+        self._in_flight = 0
+        self._background = 0
+        # 上次降低上限的时间(time.monotonic())，在此之前开始的调用超标时不再降低
+        self._decreased_at = float('-inf')
+        self._lock = threading.Condition()
+
+    def try_acquire(self):
+        """
+        尝试占用一个调用名额
+
+        返回:
+            None表示已占用，否则为不能调用的原因
+        """
+        with self._lock:
+            if self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return None
+            return self._shed_reason()
+
+    def acquire_background(self, timeout):
+        """
+        批量或后台调用等待一个调用名额
+
+        参数:
+            timeout: 最长等待时间(秒)
+
+        返回:
+            None表示已占用，release时需传入background=True；否则为超时未取得名额的原因
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while (self._in_flight >= int(self._limit)
+                   or self._background >= max(1, int(self._limit * self.background_share))):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self._shed_reason()
+                self._lock.wait(remaining)
+            self._in_flight += 1
+            self._background += 1
+            return None
+
+    def release(self, latency, background=False):
+        """
+        释放调用名额并按本次延迟调整上限
+
+        参数:
+            latency: 本次调用的耗时(秒)
+            background: 是否为acquire_background占用的名额
+        """
+        with self._lock:
+            self._in_flight -= 1
+            if background:
+                self._background -= 1
+            if latency > self.latency_slo:
+                now = time.monotonic()
+                if now - latency >= self._decreased_at:
+                    self._limit = max(self.min_limit, self._limit * ADMISSION_BACKOFF)
+                    self._decreased_at = now
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._lock.notify_all()
+
+    def _shed_reason(self):
+        return SHED_LATENCY_SLO if int(self._limit) < self.max_limit else SHED_IN_FLIGHT_BUDGET
+
+    def stats(self):
+        """获取当前的上限和同时进行的调用数"""
+        return {
+            'limit': int(self._limit),
+            'in_flight': self._in_flight,
+            'background_in_flight': self._background,
+            'max_limit': self.max_limit,
+            'min_limit': self.min_limit,
+            'latency_slo': self.latency_slo
+        }
+
+class AdmissionController:
+    """增强预测的准入控制：先按客户端限流，再占用同时调用名额"""
+
+    def __init__(self, rate_limiter=None, concurrency_limit=None):
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.concurrency_limit = concurrency_limit or AdaptiveConcurrencyLimit()
+        self._lock = threading.Lock()
+        self._stats = {
+            'throttled': 0,
+            'shed': {SHED_IN_FLIGHT_BUDGET: 0, SHED_LATENCY_SLO: 0}
+        }
+
+    def check_rate(self, client, endpoint):
+        """
+        检查客户端速率限制
+
+        返回:
+            (是否允许, 需要等待的秒数)
+        """
+        allowed, retry_after = self.rate_limiter.allow(client)
+        if not allowed:
+            ADMISSION_THROTTLED.inc(endpoint)
+            with self._lock:
+                self._stats['throttled'] += 1
+        return allowed, retry_after
+
+    def try_acquire(self, endpoint):
+        """
+        尝试占用一个增强预测名额
+
+        返回:
+            None表示已占用，调用结束后必须release；否则为直接使用基本预测结果的原因
+        """
+        return self._record_shed(endpoint, self.concurrency_limit.try_acquire())
+
+    def acquire_background(self, endpoint, timeout=ADMISSION_BACKGROUND_WAIT):
+        """
+        批量预测或后台任务等待一个增强预测名额
+
+        返回:
+            None表示已占用，调用结束后必须release(latency, background=True)；否则为直接使用基本预测结果的原因
+        """
+        return self._record_shed(endpoint, self.concurrency_limit.acquire_background(timeout))
+
+    def release(self, latency, background=False):
+        """释放增强预测名额"""
+        self.concurrency_limit.release(latency, background)
+
+    def _record_shed(self, endpoint, reason):
+        if reason is not None:
+            ADMISSION_SHED.inc(endpoint, reason)
+            with self._lock:
+                self._stats['shed'][reason] += 1
+        return reason
+
+    def stats(self):
+        """获取准入控制统计信息"""
+        stats = self.concurrency_limit.stats()
+        with self._lock:
+            stats['throttled'] = self._stats['throttled']
+            stats['shed'] = dict(self._stats['shed'])
+        stats['rate'] = self.rate_limiter.rate
+        stats['burst'] = self.rate_limiter.burst
+        stats['clients'] = self.rate_limiter.clients()
+        return stats
+
+def shed_prediction(reason):
+    """
+    不调用DeepSeek API时的增强预测结果，手串推荐使用基本推荐
+
+    参数:
+        reason: 原因
+
+    返回:
+        标记为未增强的预测结果
+    """
+    return {
+        'enhanced': False,
+        'shed': reason,
+        'message': '服务繁忙，使用基本预测结果'
+    }
@@ -2,17 +2,30 @@
 手串饰品预测软件服务器端应用 - Vercel版本
 提供阴阳历转换、命理预测和手串推荐功能的API
 """
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, send_file
+from werkzeug.middleware.proxy_fix import ProxyFix
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
 import json
+import math
 import os
-import requests
+import sys
+import time
 from lunar_solar_converter import (
-    solar_to_lunar, lunar_to_solar, get_eight_characters,
-    get_zodiac_sign, get_hour_ganzhi, is_valid_lunar_date, is_valid_solar_date
+    solar_to_lunar, lunar_to_solar, get_eight_characters, get_eight_characters_batch,
+    get_birth_chart, is_valid_lunar_date, is_valid_solar_date
+)
+from catalog import get_catalog, catalog_loader
+from circuit_breaker import CircuitBreaker
+from admission import AdmissionController, shed_prediction
+import metrics
+from jobs import JobQueue, QueueFullError, JOB_PRIORITIES, DEFAULT_JOB_PRIORITY
+from metrics import stage
+from profiling import ProfilingMiddleware, PROFILE_HEADER, to_speedscope
+from storage import (
+    save_prediction, get_prediction, save_share, get_prediction_by_share, cleanup_expired_shares,
+    start_expiry_sweeper, get_sweeper_stats, get_storage_cache_stats, start_layout_migrator, get_migrator_stats
 )
-from deepseek_api import get_enhanced_prediction, test_deepseek_api
-from storage import save_prediction, get_prediction, save_share, get_prediction_by_share, cleanup_expired_shares
 
 app = Flask(__name__)
 
@@ -20,147 +33,85 @@ app = Flask(__name__)
 DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "sk-b21ed31cf5f34cf483602422613aac4c")
 DEEPSEEK_API_ENDPOINT = "https://api.deepseek.com/v1/chat/completions"
 
-# 五行属性
-FIVE_ELEMENTS = {
-    "甲": "木", "乙": "木",
-    "丙": "火", "丁": "火",
-    "戊": "土", "己": "土",
-    "庚": "金", "辛": "金",
-    "壬": "水", "癸": "水",
-    "子": "水", "亥": "水",
-    "寅": "木", "卯": "木",
-    "巳": "火", "午": "火",
-    "申": "金", "酉": "金",
-    "丑": "土", "辰": "土", "未": "土", "戌": "土"
-}
-
-# 手串材质数据
-BRACELET_MATERIALS = {
-    "水晶": {
-        "五行": "水",
-        "颜色": ["透明", "白色", "紫色", "粉色", "黄色", "绿色", "蓝色"],
-        "功效": ["净化能量", "增强直觉", "提升精神力"],
-        "适合人群": ["需要净化负能量的人", "追求心灵平静的人"]
-    },
-    "琉璃": {
-        "五行": "火",
-        "颜色": ["蓝色", "绿色", "红色", "黄色", "紫色"],
-        "功效": ["辟邪", "招财", "增强运势"],
-        "适合人群": ["追求美好事物的人", "需要提升运势的人"]
-    },
-    "和田玉": {
-        "五行": "土",
-        "颜色": ["白色", "青白色", "青色", "黄色"],
-        "功效": ["养生", "平衡情绪", "增强体质"],
-        "适合人群": ["注重健康的人", "需要情绪稳定的人"]
-    },
-    "翡翠": {
-        "五行": "木",
-        "颜色": ["绿色", "紫色", "红色", "白色"],
-        "功效": ["招财", "辟邪", "保平安"],
-        "适合人群": ["追求财富的人", "需要保平安的人"]
-    },
-    "星月菩提": {
-        "五行": "木",
-        "颜色": ["棕色", "红棕色"],
-        "功效": ["静心", "开智慧", "增强记忆力"],
-        "适合人群": ["修行者", "学生", "需要静心的人"]
-    },
-    "金刚菩提": {
-        "五行": "木",
-        "颜色": ["棕色", "红棕色"],
-        "功效": ["辟邪", "增强意志力", "提升自信"],
-        "适合人群": ["需要增强意志力的人", "需要提升自信的人"]
-    },
-    "小叶紫檀": {
-        "五行": "木",
-        "颜色": ["紫红色", "深棕色"],
-        "功效": ["安神", "辟邪", "增强气场"],
-        "适合人群": ["睡眠质量差的人", "需要提升气场的人"]
-    },
-    "沉香": {
-        "五行": "木",
-        "颜色": ["棕色", "黄棕色"],
-        "功效": ["静心", "提升灵性", "改善呼吸系统"],
-        "适合人群": ["修行者", "呼吸系统不佳的人"]
-    },
-    "檀香": {
-        "五行": "木",
-        "颜色": ["黄色", "棕黄色"],
-        "功效": ["安神", "净化空间", "提升专注力"],
-        "适合人群": ["需要提升专注力的人", "睡眠质量差的人"]
-    },
-    "蜜蜡": {
-        "五行": "土",
-        "颜色": ["黄色", "棕黄色", "红黄色"],
-        "功效": ["招财", "保平安", "增强健康"],
-        "适合人群": ["追求财富的人", "注重健康的人"]
-    },
-    "砗磲": {
-        "五行": "水",
-        "颜色": ["白色", "米白色"],
-        "功效": ["增强智慧", "提升运势", "改善人际关系"],
-        "适合人群": ["需要提升智慧的人", "人际关系不佳的人"]
-    },
-    "玛瑙": {
-        "五行": "火",
-        "颜色": ["红色", "橙色", "蓝色", "绿色", "紫色"],
-        "功效": ["增强勇气", "提升自信", "保平安"],
-        "适合人群": ["需要增强勇气的人", "需要提升自信的人"]
-    },
-    "青金石": {
-        "五行": "水",
-        "颜色": ["蓝色", "深蓝色"],
-        "功效": ["增强直觉", "提升智慧", "改善沟通能力"],
-        "适合人群": ["需要提升智慧的人", "沟通能力不佳的人"]
-    },
-    "珊瑚": {
-        "五行": "火",
-        "颜色": ["红色", "粉红色", "白色"],
-        "功效": ["招财", "辟邪", "增强血液循环"],
-        "适合人群": ["追求财富的人", "血液循环不佳的人"]
-    },
-    "松石": {
-        "五行": "水",
-        "颜色": ["蓝绿色", "绿色"],
-        "功效": ["保平安", "增强运势", "改善呼吸系统"],
-        "适合人群": ["需要保平安的人", "呼吸系统不佳的人"]
-    },
-    "南红玛瑙": {
-        "五行": "火",
-        "颜色": ["红色", "橙红色"],
-        "功效": ["招财", "增强运势", "提升活力"],
-        "适合人群": ["追求财富的人", "需要提升活力的人"]
-    },
-    "黄龙玉": {
-        "五行": "土",
-        "颜色": ["黄色", "绿色", "白色"],
-        "功效": ["招财", "增强健康", "提升运势"],
-        "适合人群": ["追求财富的人", "注重健康的人"]
-    },
-    "佛珠": {
-        "五行": "木",
-        "颜色": ["棕色", "黑色", "红色"],
-        "功效": ["静心", "开智慧", "增强灵性"],
-        "适合人群": ["修行者", "需要静心的人"]
-    }
-}
-
-# 宗教信仰对应的吉祥物和符号
-RELIGIOUS_SYMBOLS = {
-    '佛教': ['佛珠', '莲花', '法轮', '卍字符', '佛像', '六字真言'],
-    '道教': ['太极', '八卦', '五行', '道符', '如意', '灵芝'],
-    '基督教': ['十字架', '鱼形符号', '圣经', '天使', '橄榄枝', '鸽子'],
-    '无': ['如意', '福字', '寿字', '平安结', '铜钱', '龙凤']
-}
-
-# 宗教特色手串材质
-RELIGIOUS_MATERIALS = {
-    '佛教': ['菩提子', '檀香木', '金刚菩提', '凤眼菩提', '星月菩提', '砗磲', '绿松石'],
-    '道教': ['黄杨木', '桃木', '檀木', '紫檀', '黑檀', '玉石', '水晶'],
-    '基督教': ['橄榄木', '黑檀木', '紫檀木', '水晶', '玛瑙', '橄榄石'],
-    '无': ['黄花梨', '小叶紫檀', '沉香', '金丝楠', '鸡翅木', '红木', '乌木']
-}
+# 批量接口每次流式输出的记录数
+BATCH_STREAM_CHUNK_SIZE = 1000
+
+# 批量计算八字的最大条数
+BATCH_CALCULATE_MAX_SIZE = int(os.environ.get("BATCH_CALCULATE_MAX_SIZE", 100000))
+
+# 批量预测的最大人数和并发调用DeepSeek API的上限
+BATCH_PREDICT_MAX_SIZE = int(os.environ.get("BATCH_PREDICT_MAX_SIZE", 1000))
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", 8))
+
+# 预测请求的截止时间(秒)，从收到请求开始计算；客户端可通过请求头设置更短的等待时间(毫秒)。
+# 超过截止时间仍未拿到增强预测时直接返回基本预测结果
+PREDICT_DEADLINE = float(os.environ.get("PREDICT_DEADLINE", 30))
+DEADLINE_HEADER = 'X-Deadline-Ms'
+
+# 是否在每个进程处理第一个请求时启动后台线程(过期清理等)。导入应用的工具不启动；
+# Vercel上(设置了VERCEL环境变量)后台线程不可靠且拖慢冷启动，默认为0，其他部署默认为1
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", 0 if os.environ.get("VERCEL") else 1))
+
+# 部署在反向代理后面时代理的层数，为0时不信任X-Forwarded-For，限流按连接的对端地址；
+# 设置后只取最后N个代理添加的地址，客户端伪造的地址不会被采用
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+# 按签名请求头或采样率剖析请求，app.run和gunicorn都经过wsgi_app
+profiler = ProfilingMiddleware(app.wsgi_app)
+app.wsgi_app = profiler
+
+# DeepSeek API客户端(requests、aiohttp)和商品库存(NumPy)导入较慢，在首次使用的路由中才导入，
+# 只渲染页面的请求冷启动时不承担这些耗时
+
+# 熔断器状态对应的仪表值
+BREAKER_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+def when_loaded(module_name, callback):
+    """模块已导入时才取值，指标接口不为取值而导入模块"""
+    return lambda: callback(sys.modules[module_name]) if module_name in sys.modules else {}
+
+# 从已有的统计信息取值的仪表
+metrics.Gauge('deepseek_breaker_state', 'DeepSeek API熔断器状态(0关闭 1半开 2打开)', when_loaded(
+    'deepseek_api', lambda module: {(): BREAKER_STATE_VALUES[module.deepseek_breaker.state]}))
+metrics.Gauge('llm_in_flight', '进行中的DeepSeek API增强预测请求数', when_loaded(
+    'deepseek_async', lambda module: {(): module.get_async_stats()['in_flight']}))
+metrics.Gauge('llm_cache_entries', '增强预测缓存的条目数', when_loaded('deepseek_api', lambda module: {
+    ('memory',): module.get_cache_stats()['memory_entries'],
+    ('disk',): module.get_cache_stats()['disk_entries']
+}), labels=('tier',))
+metrics.Gauge('admission_in_flight', '同时进行的增强预测数', lambda: {(): admission.stats()['in_flight']})
+metrics.Gauge('admission_limit', '自适应调整后的同时增强预测数上限', lambda: {(): admission.stats()['limit']})
+metrics.Gauge('job_queue_depth', '排队和执行中的预测任务数', lambda: {
+    (status, priority): count for status, counts in job_queue.depth().items() for priority, count in counts.items()
+}, labels=('status', 'priority'))
+metrics.Gauge('storage_cache_entries', '分享和预测结果读缓存的条目数', lambda: {
+    (name,): stats['entries'] for name, stats in get_storage_cache_stats().items()
+}, labels=('cache',))
+metrics.Gauge('storage_cache_bytes', '分享和预测结果读缓存估算的内存占用(字节)', lambda: {
+    (name,): stats['bytes'] for name, stats in get_storage_cache_stats().items()
+}, labels=('cache',))
+
+@app.before_request
+def start_request_timing():
+    """开始记录请求各阶段的耗时"""
+    metrics.start_request()
+
+@app.before_request
+def start_background_on_first_request():
+    """每个工作进程处理第一个请求时启动后台线程"""
+    if BACKGROUND_WORKERS and _background_pid != os.getpid():
+        start_background_workers()
+
+@app.after_request
+def add_server_timing(response):
+    """请求耗时计入直方图，并通过Server-Timing响应头返回各阶段耗时"""
+    timings, total = metrics.finish_request()
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(total, endpoint, request.method, str(response.status_code))
+    response.headers['Server-Timing'] = metrics.format_server_timing(timings, total)
+    return response
 
 @app.route('/')
 def index():
@@ -239,113 +190,321 @@ def api_calculate_eight_characters():
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/api/calculate/eight-characters/batch', methods=['POST'])
+def api_calculate_eight_characters_batch():
+    """批量计算八字API，以流式JSON数组逐条返回结果"""
+    data = request.get_json()
+    
+    try:
+        fields = [data.get(name) for name in ('year', 'month', 'day', 'hour', 'is_lunar')]
+        if any(isinstance(field, list) and len(field) > BATCH_CALCULATE_MAX_SIZE for field in fields):
+            return jsonify({'error': f'单次最多计算{BATCH_CALCULATE_MAX_SIZE}条'}), 400
+        
+        # 批量计算八字
+        result = get_eight_characters_batch(
+            data.get('year'), data.get('month'), data.get('day'),
+            data.get('hour'), data.get('is_lunar')
+        )
+        count = len(result['valid'])
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def generate():
+        yield '['
+        for start in range(0, count, BATCH_STREAM_CHUNK_SIZE):
+            end = min(start + BATCH_STREAM_CHUNK_SIZE, count)
+            chunk = zip(
+                result['valid'][start:end].tolist(), result['year'][start:end].tolist(),
+                result['month'][start:end].tolist(), result['day'][start:end].tolist(),
+                result['hour'][start:end].tolist()
+            )
+            items = []
+            for valid, year, month, day, hour in chunk:
+                if valid:
+                    item = {'year': year, 'month': month, 'day': day, 'hour': hour}
+                else:
+                    item = {'error': '无效的日期'}
+                items.append(json.dumps(item, ensure_ascii=False))
+            yield (',' if start else '') + ','.join(items)
+        yield ']'
+    
+    return Response(generate(), mimetype='application/json')
+
 @app.route('/api/predict/fortune', methods=['POST'])
 def api_predict_fortune():
     """命运预测API"""
+    allowed, retry_after = admission.check_rate(client_id(), 'predict')
+    if not allowed:
+        return throttled_response(retry_after)
+    
     data = request.get_json()
     
     try:
-        # 获取基本信息
-        name = data.get('name', '')
-        gender = data.get('gender', '')
-        birth_year = int(data.get('birth_year'))
-        birth_month = int(data.get('birth_month'))
-        birth_day = int(data.get('birth_day'))
-        birth_hour = int(data.get('birth_hour', 12))
-        is_lunar_date = bool(data.get('is_lunar_date', False))
-        purpose = data.get('purpose', '财运')
-        religion = data.get('religion', '无')
-        birth_place = data.get('birth_place', '')
-        
-        # 如果是阴历日期，转换为阳历
-        if is_lunar_date:
-            solar_info = lunar_to_solar(birth_year, birth_month, birth_day)
-            birth_date = solar_info['solar_date']
-        else:
-            birth_date = datetime.date(birth_year, birth_month, birth_day)
-        
-        # 获取八字
-        eight_characters = get_eight_characters(birth_year, birth_month, birth_day, birth_hour, is_lunar_date)
-        
-        # 获取星座
-        zodiac_sign = get_zodiac_sign(birth_date.month, birth_date.day)
-        
-        # 获取生肖
-        lunar_info = solar_to_lunar(birth_date.year, birth_date.month, birth_date.day)
-        zodiac = lunar_info['zodiac']
-        
-        # 获取五行属性
-        five_elements = []
-        for pillar in eight_characters.values():
-            for char in pillar:
-                if char in FIVE_ELEMENTS:
-                    element = FIVE_ELEMENTS[char]
-                    if element not in five_elements:
-                        five_elements.append(element)
-        
-        # 计算幸运数字
-        lucky_number1 = (birth_date.day + birth_date.month) % 9 + 1
-        lucky_number2 = (birth_date.year % 100) % 9 + 1
-        if lucky_number1 == lucky_number2:
-            lucky_number2 = (lucky_number2 % 9) + 1
-        lucky_numbers = [lucky_number1, lucky_number2]
-        
-        # 获取幸运颜色
-        color_map = {
-            "木": ["绿色", "青色"],
-            "火": ["红色", "紫色"],
-            "土": ["黄色", "棕色"],
-            "金": ["白色", "金色"],
-            "水": ["黑色", "蓝色"]
-        }
+        deadline = request_deadline()
+        
+        # 生成基本预测结果
+        basic_prediction, user_info = build_basic_prediction(data)
         
-        lucky_colors = []
-        for element in five_elements:
-            if element in color_map:
-                lucky_colors.extend(color_map[element])
+        # 使用DeepSeek API增强预测，服务繁忙或超过截止时间时直接使用基本预测结果
+        enhanced_prediction = get_admitted_enhanced_prediction(user_info, basic_prediction, deadline)
+        
+        # 推荐手串并保存预测结果
+        result = build_prediction_result(basic_prediction, enhanced_prediction)
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/predict/fortune/stream', methods=['POST'])
+def api_predict_fortune_stream():
+    """
+    流式命运预测API(Server-Sent Events)
+    
+    事件依次为：
+    basic: 基本预测结果和基本手串推荐，立即返回
+    field: DeepSeek API返回的某个字段解析完整后立即返回
+    result: 完整的预测结果(含预测结果ID)
+    """
+    allowed, retry_after = admission.check_rate(client_id(), 'stream')
+    if not allowed:
+        return throttled_response(retry_after)
+    
+    data = request.get_json()
+    
+    try:
+        deadline = request_deadline()
         
         # 生成基本预测结果
-        basic_prediction = {
-            'name': name,
-            'gender': gender,
-            'birth_date': str(birth_date),
-            'birth_time': f"{birth_hour}:00",
-            'birth_place': birth_place,
-            'zodiac': zodiac,
-            'zodiac_sign': zodiac_sign,
-            'eight_characters': eight_characters,
-            'five_elements': five_elements,
-            'lucky_numbers': lucky_numbers,
-            'lucky_colors': lucky_colors,
-            'purpose': purpose,
-            'religion': religion
-        }
+        basic_prediction, user_info = build_basic_prediction(data)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def generate():
+        try:
+            yield format_sse('basic', {
+                'basic_prediction': basic_prediction,
+                'bracelet_recommendation': recommend_bracelet(basic_prediction, {})
+            })
+            
+            # 分群内容和缓存命中时不占用名额；服务繁忙时不调用DeepSeek API，直接使用基本预测结果
+            from deepseek_api import replay_enhanced_prediction, stream_enhanced_prediction
+            cached_prediction = lookup_enhanced_prediction(basic_prediction)
+            if cached_prediction is not None:
+                admitted, events = False, replay_enhanced_prediction(cached_prediction)
+            else:
+                reason = admission.try_acquire('stream')
+                admitted = reason is None
+                events = (stream_enhanced_prediction(user_info, basic_prediction, deadline, lookup=False)
+                          if admitted else replay_enhanced_prediction(shed_prediction(reason)))
+            
+            enhanced_prediction = None
+            start = time.perf_counter()
+            try:
+                for event, name, value in events:
+                    if event == 'field':
+                        yield format_sse('field', {'name': name, 'value': value})
+                    else:
+                        enhanced_prediction = name
+            finally:
+                if admitted:
+                    admission.release(time.perf_counter() - start)
+            
+            # 推荐手串并保存预测结果
+            yield format_sse('result', build_prediction_result(basic_prediction, enhanced_prediction))
+        
+        except Exception as e:
+            yield format_sse('error', {'error': str(e)})
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/predict/fortune/batch', methods=['POST'])
+def api_predict_fortune_batch():
+    """
+    批量命运预测API
+    
+    先一次性计算所有人的基本预测，再以有限并发调用DeepSeek API(与交互请求共用准入名额)，
+    按完成顺序以NDJSON逐行返回每个人的结果，最后一行为耗时汇总
+    """
+    data = request.get_json()
+    
+    try:
+        people = data.get('people')
+        if not isinstance(people, list) or not people:
+            return jsonify({'error': '缺少批量预测人员列表'}), 400
+        if len(people) > BATCH_PREDICT_MAX_SIZE:
+            return jsonify({'error': f'单次最多预测{BATCH_PREDICT_MAX_SIZE}人'}), 400
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 计算所有基本预测，输入有误的条目直接记录错误
+    items = []
+    errors = []
+    for index, person in enumerate(people):
+        try:
+            items.append((index,) + build_basic_prediction(person))
+        except Exception as e:
+            errors.append({'index': index, 'error': str(e)})
+    
+    def predict(basic_prediction, user_info):
+        start = time.perf_counter()
+        try:
+            enhanced_prediction = get_background_enhanced_prediction(user_info, basic_prediction, 'batch')
+        except Exception as e:
+            enhanced_prediction = {
+                'enhanced': False,
+                'error': str(e),
+                'message': '获取增强预测时出错，使用基本预测结果'
+            }
+        llm_time = time.perf_counter() - start
+        return build_prediction_result(basic_prediction, enhanced_prediction), llm_time
+    
+    def generate():
+        start = time.perf_counter()
+        sequential_time = 0.0
         
-        # 使用DeepSeek API增强预测
-        user_info = {
-            'name': name,
-            'gender': gender,
-            'birth_date': str(birth_date),
-            'birth_time': f"{birth_hour}:00",
-            'birth_place': birth_place,
-            'purpose': purpose,
-            'religion': religion
-        }
-        enhanced_prediction = get_enhanced_prediction(user_info, basic_prediction)
+        for error in errors:
+            yield json.dumps(error, ensure_ascii=False) + '\n'
         
-        # 推荐手串
-        bracelet_recommendation = recommend_bracelet(basic_prediction, enhanced_prediction)
+        with ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY) as executor:
+            futures = {
+                executor.submit(predict, basic_prediction, user_info): (index, basic_prediction)
+                for index, basic_prediction, user_info in items
+            }
+            for future in as_completed(futures):
+                index, basic_prediction = futures[future]
+                try:
+                    result, llm_time = future.result()
+                    sequential_time += llm_time
+                    line = {'index': index, 'result': result}
+                except Exception as e:
+                    # 保存等步骤出错时，仍返回基本手串推荐
+                    line = {
+                        'index': index,
+                        'error': str(e),
+                        'result': {
+                            'basic_prediction': basic_prediction,
+                            'enhanced_prediction': {'enhanced': False, 'error': str(e)},
+                            'bracelet_recommendation': recommend_bracelet(basic_prediction, {})
+                        }
+                    }
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+        
+        wall_time = time.perf_counter() - start
+        yield json.dumps({
+            'summary': {
+                'total': len(people),
+                'succeeded': len(items),
+                'failed': len(errors),
+                'concurrency': BATCH_LLM_CONCURRENCY,
+                'wall_time': round(wall_time, 3),
+                'sequential_time': round(sequential_time, 3),
+                'speedup': round(sequential_time / wall_time, 2) if wall_time > 0 else None
+            }
+        }, ensure_ascii=False) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/jobs', methods=['POST'])
+def api_submit_prediction_job():
+    """
+    提交异步命运预测任务API
+    
+    立即计算并校验基本预测，增强预测和保存由后台任务执行；返回任务ID，
+    客户端通过/api/jobs/<job_id>轮询或长轮询结果。priority为interactive(默认)或batch，
+    interactive任务先执行
+    """
+    data = request.get_json()
+    
+    try:
+        priority = data.get('priority', DEFAULT_JOB_PRIORITY)
+        if priority not in JOB_PRIORITIES:
+            return jsonify({'error': f'未知的任务优先级: {priority}'}), 400
         
-        # 合并结果
-        result = {
-            'basic_prediction': basic_prediction,
-            'enhanced_prediction': enhanced_prediction,
-            'bracelet_recommendation': bracelet_recommendation
-        }
+        # 生成基本预测结果，输入有误时直接返回错误
+        basic_prediction, user_info = build_basic_prediction(data)
         
-        # 保存预测结果
-        prediction_id = save_prediction(result)
-        result['id'] = prediction_id
+        # 首次使用任务队列时在当前进程启动执行任务的线程
+        job_queue.start()
+        job_id = job_queue.submit({'basic_prediction': basic_prediction, 'user_info': user_info}, priority)
+        
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'priority': priority,
+            'poll_url': url_for('api_get_prediction_job', job_id=job_id)
+        }), 202
+    
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_get_prediction_job(job_id):
+    """
+    获取预测任务状态API
+    
+    wait参数为长轮询的最长等待秒数，任务完成或超时后返回；status为done时result为完整的预测结果
+    """
+    try:
+        wait = float(request.args.get('wait', 0))
+        job_queue.start()
+        job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+        
+        if job is None:
+            return jsonify({'error': '任务不存在或已过期'}), 404
+        
+        return jsonify(job)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def api_prediction_job_stats():
+    """预测任务队列统计API"""
+    try:
+        return jsonify(job_queue.stats())
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/recommend/products', methods=['POST'])
+def api_recommend_products():
+    """商品推荐API，按基本预测结果从库存中选出得分最高的商品"""
+    data = request.get_json()
+    
+    try:
+        from inventory import get_inventory, MAX_TOP_K
+        
+        # 可以直接传入基本预测结果，否则根据出生信息生成
+        basic_prediction = data.get('basic_prediction')
+        if basic_prediction is None:
+            basic_prediction, _ = build_basic_prediction(data)
+        
+        k = int(data.get('k', 10))
+        if not 1 <= k <= MAX_TOP_K:
+            return jsonify({'error': f'k必须在1到{MAX_TOP_K}之间'}), 400
+        
+        min_price = data.get('min_price')
+        max_price = data.get('max_price')
+        
+        start_time = time.perf_counter()
+        result = get_inventory().recommend(
+            basic_prediction,
+            k=k,
+            min_price=float(min_price) if min_price is not None else None,
+            max_price=float(max_price) if max_price is not None else None,
+            min_stock=int(data.get('min_stock', 1))
+        )
+        result['elapsed_ms'] = round((time.perf_counter() - start_time) * 1000, 3)
         
         return jsonify(result)
     
@@ -395,20 +554,339 @@ def api_get_shared_prediction(share_id):
 def api_test_deepseek():
     """测试DeepSeek API连接"""
     try:
+        from deepseek_api import test_deepseek_api
         result = test_deepseek_api()
         return jsonify(result)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
-def is_network_available():
-    """检查网络连接是否可用"""
+@app.route('/api/cache/deepseek', methods=['GET'])
+def api_deepseek_cache_stats():
+    """DeepSeek增强预测缓存、分群内容库和请求合并统计API"""
     try:
-        # 尝试连接到百度
-        response = requests.get('https://www.baidu.com', timeout=5)
-        return response.status_code == 200
-    except:
-        return False
+        from deepseek_api import get_cache_stats, get_segment_stats
+        from deepseek_async import get_async_stats
+        stats = get_cache_stats()
+        stats['segments'] = get_segment_stats()
+        stats['coalescing'] = get_async_stats()
+        return jsonify(stats)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/catalog', methods=['GET'])
+def api_catalog():
+    """编译后的材质目录API，支持ETag条件请求"""
+    try:
+        catalog = get_catalog()
+        if catalog.etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(catalog.payload, mimetype='application/json')
+        response.set_etag(catalog.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/catalog/stats', methods=['GET'])
+def api_catalog_stats():
+    """材质目录热加载统计API"""
+    try:
+        return jsonify(catalog_loader.stats())
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/cache/storage', methods=['GET'])
+def api_storage_cache_stats():
+    """分享和预测结果读缓存统计API"""
+    try:
+        return jsonify(get_storage_cache_stats())
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/storage/sweeper', methods=['GET'])
+def api_storage_sweeper_stats():
+    """过期记录后台清理统计API"""
+    try:
+        return jsonify(get_sweeper_stats())
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/storage/migration', methods=['GET'])
+def api_storage_migration_stats():
+    """存储布局后台迁移统计API"""
+    try:
+        return jsonify(get_migrator_stats())
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    """Prometheus格式的指标API"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/profiles', methods=['GET'])
+def api_list_profiles():
+    """最近的请求剖析结果列表API，需要签名请求头"""
+    if not profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'error': '无权访问剖析结果'}), 403
+    
+    try:
+        limit = int(request.args.get('limit', 20))
+        return jsonify({
+            'profiles': profiler.store.list(limit),
+            'stats': profiler.stats()
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def api_download_profile(profile_id):
+    """
+    下载请求剖析结果API，需要签名请求头
+    
+    format参数：json(请求信息和分配最多的位置，默认)、pstats、speedscope或tracemalloc
+    """
+    if not profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'error': '无权访问剖析结果'}), 403
+    
+    try:
+        profile_format = request.args.get('format', 'json')
+        if profile_format == 'json':
+            info = profiler.store.get(profile_id)
+            if info is None:
+                return jsonify({'error': '剖析结果不存在'}), 404
+            return jsonify(info)
+        
+        if profile_format not in ('pstats', 'speedscope', 'tracemalloc'):
+            return jsonify({'error': f"不支持的格式: {profile_format}"}), 400
+        
+        path = profiler.store.path(profile_id, 'tracemalloc' if profile_format == 'tracemalloc' else 'pstats')
+        if path is None:
+            return jsonify({'error': '剖析结果不存在'}), 404
+        
+        if profile_format == 'speedscope':
+            return Response(
+                json.dumps(to_speedscope(path, profile_id)),
+                mimetype='application/json',
+                headers={'Content-Disposition': f'attachment; filename={profile_id}.speedscope.json'}
+            )
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f"{profile_id}.{profile_format}")
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/admission/stats', methods=['GET'])
+def api_admission_stats():
+    """准入控制统计API"""
+    try:
+        return jsonify(admission.stats())
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+def client_id():
+    """限流使用的客户端标识，为连接的对端地址；配置了TRUSTED_PROXY_HOPS时由ProxyFix换成受信任代理记录的客户端地址"""
+    return request.remote_addr
+
+def throttled_response(retry_after):
+    """超过客户端速率限制时的响应"""
+    return jsonify({'error': '请求过于频繁，请稍后再试'}), 429, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+def request_deadline():
+    """
+    计算当前预测请求的截止时间
+    
+    返回:
+        time.monotonic()的取值，为收到请求后PREDICT_DEADLINE秒与请求头指定时间中较早的一个
+    """
+    budget = PREDICT_DEADLINE
+    value = request.headers.get(DEADLINE_HEADER)
+    if value is not None:
+        try:
+            milliseconds = float(value)
+        except ValueError:
+            raise ValueError(f'{DEADLINE_HEADER}请求头格式有误')
+        if not milliseconds >= 0:
+            raise ValueError(f'{DEADLINE_HEADER}请求头格式有误')
+        budget = min(budget, milliseconds / 1000)
+    return time.monotonic() - metrics.request_elapsed() + budget
+
+def lookup_enhanced_prediction(basic_prediction):
+    """查找离线生成的分群内容和缓存结果，未命中时返回None"""
+    from deepseek_api import lookup_enhanced_prediction
+    with stage('llm_lookup'):
+        return lookup_enhanced_prediction(basic_prediction)
+
+def get_admitted_enhanced_prediction(user_info, basic_prediction, deadline=None):
+    """
+    占用准入名额后使用DeepSeek API增强预测
+    
+    先查离线生成的分群内容和缓存，命中时不占用名额；未命中时才占用名额调用DeepSeek API。
+    同时进行的增强预测已达上限(或因延迟超标降低了上限)时不等待，直接返回未增强的结果，
+    手串推荐使用基本推荐
+    
+    参数:
+        user_info: 用户基本信息
+        basic_prediction: 基本预测结果
+        deadline: 请求截止时间(time.monotonic()的取值)
+        
+    返回:
+        增强的预测结果
+    """
+    cached_prediction = lookup_enhanced_prediction(basic_prediction)
+    if cached_prediction is not None:
+        return cached_prediction
+    
+    reason = admission.try_acquire('predict')
+    if reason is not None:
+        return shed_prediction(reason)
+    
+    from deepseek_async import get_enhanced_prediction
+    start = time.perf_counter()
+    try:
+        with stage('llm'):
+            return get_enhanced_prediction(user_info, basic_prediction, deadline, lookup=False)
+    finally:
+        admission.release(time.perf_counter() - start)
+
+def get_background_enhanced_prediction(user_info, basic_prediction, endpoint):
+    """
+    批量预测和后台任务使用DeepSeek API增强预测
+    
+    分群内容和缓存命中时不占用名额；未命中时与交互请求共用同时调用数上限和延迟统计，
+    排队等待名额，最多占用上限的ADMISSION_BACKGROUND_SHARE；等待超时时返回未增强的结果
+    
+    参数:
+        user_info: 用户基本信息
+        basic_prediction: 基本预测结果
+        endpoint: 指标中的接口名称，batch或job
+        
+    返回:
+        增强的预测结果
+    """
+    cached_prediction = lookup_enhanced_prediction(basic_prediction)
+    if cached_prediction is not None:
+        return cached_prediction
+    
+    reason = admission.acquire_background(endpoint)
+    if reason is not None:
+        return shed_prediction(reason)
+    
+    from deepseek_async import get_enhanced_prediction
+    start = time.perf_counter()
+    try:
+        with stage('llm'):
+            return get_enhanced_prediction(user_info, basic_prediction, lookup=False)
+    finally:
+        admission.release(time.perf_counter() - start, background=True)
+
+def format_sse(event, data):
+    """
+    格式化一条Server-Sent Events消息
+    
+    参数:
+        event: 事件名称
+        data: 可JSON序列化的数据
+        
+    返回:
+        SSE消息文本
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def build_basic_prediction(data):
+    """
+    根据用户提交的信息生成基本预测结果
+    
+    参数:
+        data: 用户提交的出生信息和所求事项
+        
+    返回:
+        (基本预测结果, 用于增强预测的用户信息)
+    """
+    # 获取基本信息
+    name = data.get('name', '')
+    gender = data.get('gender', '')
+    birth_year = int(data.get('birth_year'))
+    birth_month = int(data.get('birth_month'))
+    birth_day = int(data.get('birth_day'))
+    birth_hour = int(data.get('birth_hour', 12))
+    is_lunar_date = bool(data.get('is_lunar_date', False))
+    purpose = data.get('purpose', '财运')
+    religion = data.get('religion', '无')
+    birth_place = data.get('birth_place', '')
+    
+    # 一次计算出阳历日期、生肖、星座、八字、五行、幸运数字和幸运颜色
+    with stage('birth_chart'):
+        chart = get_birth_chart(birth_year, birth_month, birth_day, birth_hour, is_lunar_date)
+    birth_date = chart.solar_date
+    
+    # 生成基本预测结果
+    basic_prediction = {
+        'name': name,
+        'gender': gender,
+        'birth_date': str(birth_date),
+        'birth_time': f"{birth_hour}:00",
+        'birth_place': birth_place,
+        'zodiac': chart.zodiac,
+        'zodiac_sign': chart.zodiac_sign,
+        'eight_characters': chart.eight_characters(),
+        'five_elements': list(chart.five_elements),
+        'lucky_numbers': list(chart.lucky_numbers),
+        'lucky_colors': list(chart.lucky_colors),
+        'purpose': purpose,
+        'religion': religion
+    }
+    
+    # 用于DeepSeek API增强预测的用户信息
+    user_info = {
+        'name': name,
+        'gender': gender,
+        'birth_date': str(birth_date),
+        'birth_time': f"{birth_hour}:00",
+        'birth_place': birth_place,
+        'purpose': purpose,
+        'religion': religion
+    }
+    
+    return basic_prediction, user_info
+
+def build_prediction_result(basic_prediction, enhanced_prediction):
+    """
+    推荐手串、合并并保存预测结果
+    
+    参数:
+        basic_prediction: 基本预测结果
+        enhanced_prediction: 增强预测结果
+        
+    返回:
+        包含预测结果ID的完整预测结果
+    """
+    # 推荐手串
+    with stage('recommend'):
+        bracelet_recommendation = recommend_bracelet(basic_prediction, enhanced_prediction)
+    
+    # 合并结果
+    result = {
+        'basic_prediction': basic_prediction,
+        'enhanced_prediction': enhanced_prediction,
+        'bracelet_recommendation': bracelet_recommendation
+    }
+    
+    # 保存预测结果
+    prediction_id = save_prediction(result)
+    result['id'] = prediction_id
+    
+    return result
 
 def recommend_bracelet(basic_prediction, enhanced_prediction):
     """推荐手串"""
@@ -429,115 +907,8 @@ def recommend_bracelet(basic_prediction, enhanced_prediction):
                 'recommendation': enhanced_bracelet
             }
         
-        # 否则，使用基本算法推荐
-        # 根据五行属性选择材质
-        missing_elements = []
-        all_elements = ['木', '火', '土', '金', '水']
-        for element in all_elements:
-            if element not in five_elements:
-                missing_elements.append(element)
-        
-        # 如果没有缺失的五行，选择与所求事项相关的五行
-        if not missing_elements:
-            if purpose == '财运':
-                missing_elements = ['金', '木']
-            elif purpose == '事业':
-                missing_elements = ['火', '木']
-            elif purpose == '健康':
-                missing_elements = ['土', '金']
-            elif purpose == '婚姻':
-                missing_elements = ['火', '土']
-            elif purpose == '学业':
-                missing_elements = ['水', '木']
-            elif purpose == '人际':
-                missing_elements = ['火', '木']
-            elif purpose == '破小人':
-                missing_elements = ['金', '水']
-            else:
-                missing_elements = ['土']
-        
-        # 选择材质
-        recommended_materials = []
-        for material, info in BRACELET_MATERIALS.items():
-            if info['五行'] in missing_elements:
-                # 检查是否有幸运颜色
-                has_lucky_color = False
-                for color in info['颜色']:
-                    if color in lucky_colors:
-                        has_lucky_color = True
-                        break
-                
-                recommended_materials.append({
-                    'name': material,
-                    'element': info['五行'],
-                    'colors': info['颜色'],
-                    'effects': info['功效'],
-                    'suitable_for': info['适合人群'],
-                    'has_lucky_color': has_lucky_color
-                })
-        
-        # 根据宗教信仰选择特色材质
-        religious_materials = RELIGIOUS_MATERIALS.get(religion, [])
-        for material in religious_materials:
-            if material in BRACELET_MATERIALS:
-                info = BRACELET_MATERIALS[material]
-                # 检查是否已经推荐过
-                already_recommended = False
-                for rec in recommended_materials:
-                    if rec['name'] == material:
-                        already_recommended = True
-                        break
-                
-                if not already_recommended:
-                    # 检查是否有幸运颜色
-                    has_lucky_color = False
-                    for color in info['颜色']:
-                        if color in lucky_colors:
-                            has_lucky_color = True
-                            break
-                    
-                    recommended_materials.append({
-                        'name': material,
-                        'element': info['五行'],
-                        'colors': info['颜色'],
-                        'effects': info['功效'],
-                        'suitable_for': info['适合人群'],
-                        'has_lucky_color': has_lucky_color,
-                        'religious': True
-                    })
-        
-        # 选择宗教符号
-        religious_symbols = RELIGIOUS_SYMBOLS.get(religion, [])
-        
-        # 生成推荐文本
-        recommendation_text = f"根据您的五行属性和{purpose}需求，推荐以下手串材质组合：\n\n"
-        
-        # 添加材质描述
-        for i, material in enumerate(recommended_materials[:3]):
-            recommendation_text += f"{i+1}. {material['name']}（{material['element']}属性）\n"
-            recommendation_text += f"   颜色：{', '.join(material['colors'])}\n"
-            recommendation_text += f"   功效：{', '.join(material['effects'])}\n"
-            recommendation_text += f"   适合：{', '.join(material['suitable_for'])}\n\n"
-        
-        # 添加宗教符号建议
-        if religious_symbols:
-            recommendation_text += f"根据您的{religion}信仰，建议在手串上添加以下吉祥物或符号：\n"
-            recommendation_text += f"{', '.join(religious_symbols[:3])}\n\n"
-        
-        # 添加佩戴建议
-        recommendation_text += "佩戴建议：\n"
-        recommendation_text += "1. 手串通常佩戴在左手，因为左手靠近心脏，能更好地吸收能量。\n"
-        recommendation_text += "2. 新购买的手串最好先净化，可以用清水冲洗或放在阳光下晒一晒。\n"
-        recommendation_text += "3. 佩戴时保持心态平和，有助于增强手串的效果。\n"
-        recommendation_text += "4. 定期清洁手串，保持其能量纯净。\n"
-        
-        return {
-            'source': 'basic',
-            'missing_elements': missing_elements,
-            'materials': recommended_materials[:3],
-            'religious_symbols': religious_symbols[:3],
-            'recommendation': recommendation_text
-        }
+        # 否则，使用当前材质目录的推荐索引
+        return get_catalog().recommendation_index.recommend(five_elements, purpose, religion, lucky_colors)
     
     except Exception as e:
         return {
@@ -546,6 +917,40 @@ def recommend_bracelet(basic_prediction, enhanced_prediction):
             'recommendation': f"手串推荐生成出错：{str(e)}"
         }
 
+def run_prediction_job(payload):
+    """
+    执行预测任务：增强预测，推荐手串并保存预测结果
+    
+    参数:
+        payload: 任务数据，包含basic_prediction和user_info
+        
+    返回:
+        包含预测结果ID的完整预测结果
+    """
+    basic_prediction = payload['basic_prediction']
+    enhanced_prediction = get_background_enhanced_prediction(payload['user_info'], basic_prediction, 'job')
+    return build_prediction_result(basic_prediction, enhanced_prediction)
+
+# 增强预测的准入控制
+admission = AdmissionController()
+
+# 预测任务队列，排队的任务持久化在存储目录中
+job_queue = JobQueue(run_prediction_job)
+
+# 已启动后台线程的进程ID，gunicorn预先fork的子进程各自启动
+_background_pid = None
+
+def start_background_workers():
+    """
+    在当前进程启动后台线程：清理过期的分享和预测结果、把旧版平铺的存储文件迁移到分级子目录(完成后自动结束)、
+    执行预测任务；未启动时执行预测任务的线程在首次提交或查询任务时启动
+    """
+    global _background_pid
+    _background_pid = os.getpid()
+    start_expiry_sweeper()
+    start_layout_migrator()
+    job_queue.start()
+
 # Vercel入口点
 app = app
 
@@ -553,6 +958,7 @@ app = app
 if __name__ == '__main__':
     # 清理过期的分享
     cleanup_expired_shares()
+    start_background_workers()
     # 从环境变量获取端口，如果没有则使用8080
     port = int(os.environ.get('PORT', 8080))
     # 启动应用
@@ -0,0 +1,233 @@
+"""
+手串饰品预测软件 - 材质目录模块
+从数据文件加载材质目录并编译为紧凑的查询结构，文件变化时热加载
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from recommendation import ALL_ELEMENTS, RecommendationIndex, element_mask
+from startup_snapshot import get_snapshot_section
+
+# 目录数据文件路径
+CATALOG_PATH = os.environ.get(
+    "CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "catalog.json"))
+
+# 检查目录文件是否变化的最短间隔(秒)
+CATALOG_RELOAD_INTERVAL = float(os.environ.get("CATALOG_RELOAD_INTERVAL", 2))
+
+# 支持的目录数据格式版本
+CATALOG_VERSIONS = (1,)
+
+# 编译后的材质，id为材质在目录中的序号，颜色、功效和适合人群为元组，
+# purpose_bits为功效对应的所求事项位掩码
+Material = namedtuple('Material', [
+    'id', 'name', 'element', 'colors', 'effects', 'suitable_for', 'element_bits', 'color_bits', 'purpose_bits'
+])
+
+class Catalog:
+    """
+    编译后的材质目录，创建后不再修改
+
+    字符串全部驻留，五行和颜色编为位掩码，宗教特色材质只保留目录中存在的材质id；
+    同时构建手串推荐索引和/api/catalog的响应内容
+    """
+
+    def __init__(self, data, etag):
+        """
+        参数:
+            data: 目录数据，包含version、five_elements、materials、religious_symbols、religious_materials
+                  和可选的purpose_effects(所求事项 -> 相关功效列表)
+            etag: 数据文件内容的摘要
+        """
+        if data.get('version') not in CATALOG_VERSIONS:
+            raise ValueError(f"不支持的目录版本: {data.get('version')}")
+
+        self.source = data
+        self.version = data['version']
+        self.etag = etag
+
+        self.five_elements = {
+            sys.intern(char): sys.intern(element) for char, element in data['five_elements'].items()
+        }
+        for element in self.five_elements.values():
+            if element not in ALL_ELEMENTS:
+                raise ValueError(f"未知的五行: {element}")
+
+        # 所有材质出现过的颜色，各占一位
+        self.color_bits = {}
+        for info in data['materials'].values():
+            for color in info['颜色']:
+                self.color_bits.setdefault(sys.intern(color), 1 << len(self.color_bits))
+
+        # 每个所求事项占一位，记录各功效对应的所求事项
+        self.purpose_bits = {}
+        effect_purposes = {}
+        for purpose, effects in data.get('purpose_effects', {}).items():
+            bit = 1 << len(self.purpose_bits)
+            self.purpose_bits[sys.intern(purpose)] = bit
+            for effect in effects:
+                effect_purposes[effect] = effect_purposes.get(effect, 0) | bit
+
+        materials = []
+        for name, info in data['materials'].items():
+            if info['五行'] not in ALL_ELEMENTS:
+                raise ValueError(f"材质{name}的五行未知: {info['五行']}")
+            colors = tuple(sys.intern(color) for color in info['颜色'])
+            materials.append(Material(
+                id=len(materials),
+                name=sys.intern(name),
+                element=sys.intern(info['五行']),
+                colors=colors,
+                effects=tuple(sys.intern(effect) for effect in info['功效']),
+                suitable_for=tuple(sys.intern(people) for people in info['适合人群']),
+                element_bits=element_mask([info['五行']]),
+                color_bits=self.color_mask(colors),
+                purpose_bits=sum_bits(effect_purposes.get(effect, 0) for effect in info['功效'])
+            ))
+        self.materials = tuple(materials)
+        self.material_ids = {material.name: material.id for material in self.materials}
+
+        self.religious_symbols = {
+            sys.intern(religion): tuple(sys.intern(symbol) for symbol in symbols)
+            for religion, symbols in data['religious_symbols'].items()
+        }
+        self.religious_materials = {
+            sys.intern(religion): tuple(self.material_ids[name] for name in names if name in self.material_ids)
+            for religion, names in data['religious_materials'].items()
+        }
+
+        # 启动快照中有同一目录的推荐结果时直接使用
+        self.recommendation_index = RecommendationIndex(self, get_snapshot_section('recommendations', etag))
+        self.payload = json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def color_mask(self, colors):
+        """将颜色列表转为位掩码，不在任何材质中出现的颜色忽略"""
+        mask = 0
+        for color in colors:
+            mask |= self.color_bits.get(color, 0)
+        return mask
+
+    def to_dict(self):
+        """编译后的目录，供客户端缓存"""
+        return {
+            'version': self.version,
+            'etag': self.etag,
+            'elements': ALL_ELEMENTS,
+            'colors': sorted(self.color_bits, key=self.color_bits.get),
+            'purposes': sorted(self.purpose_bits, key=self.purpose_bits.get),
+            'five_elements': self.five_elements,
+            'materials': [material._asdict() for material in self.materials],
+            'religious_symbols': self.religious_symbols,
+            'religious_materials': self.religious_materials
+        }
+
+def sum_bits(bits):
+    """按位或合并多个位掩码"""
+    mask = 0
+    for bit in bits:
+        mask |= bit
+    return mask
+
+def load_catalog(path):
+    """
+    从数据文件加载并编译材质目录
+
+    参数:
+        path: 数据文件路径
+
+    返回:
+        Catalog对象
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    return Catalog(json.loads(content.decode('utf-8')), hashlib.sha256(content).hexdigest()[:32])
+
+class CatalogLoader:
+    """
+    材质目录热加载
+
+    首次get()时才加载，不使用目录的请求不承担加载耗时。
+    之后get()至多每reload_interval秒检查一次文件的修改时间和大小，变化时由一个线程重新编译，
+    编译完成后整体替换目录引用；其他线程不等待，继续使用旧目录。新文件无效时保留旧目录
+    """
+
+    def __init__(self, path=CATALOG_PATH, reload_interval=CATALOG_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._reload_lock = threading.Lock()
+        self._signature = None
+        self._catalog = None
+        self._checked_at = 0.0
+        self._stats = {
+            'reloads': 0,
+            'reload_errors': 0,
+            'last_error': None,
+            'loaded_at': None
+        }
+
+    def get(self):
+        """获取当前的材质目录，首次调用时加载"""
+        if self._catalog is None:
+            with self._reload_lock:
+                if self._catalog is None:
+                    self._signature = self._file_signature()
+                    self._catalog = load_catalog(self.path)
+                    self._checked_at = time.monotonic()
+                    self._stats['loaded_at'] = time.time()
+        elif time.monotonic() - self._checked_at >= self.reload_interval and self._reload_lock.acquire(blocking=False):
+            try:
+                self._checked_at = time.monotonic()
+                self._reload_if_changed()
+            finally:
+                self._reload_lock.release()
+        return self._catalog
+
+    def stats(self):
+        """获取热加载统计信息"""
+        catalog = self.get()
+        stats = dict(self._stats)
+        stats['path'] = self.path
+        stats['version'] = catalog.version
+        stats['etag'] = catalog.etag
+        return stats
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload_if_changed(self):
+        try:
+            signature = self._file_signature()
+        except OSError as e:
+            self._record_error(e)
+            return
+        if signature == self._signature:
+            return
+
+        # 无效的文件只尝试一次，等下次修改
+        self._signature = signature
+        try:
+            catalog = load_catalog(self.path)
+        except Exception as e:
+            self._record_error(e)
+            return
+
+        if catalog.etag != self._catalog.etag:
+            self._catalog = catalog
+            self._stats['reloads'] += 1
+            self._stats['loaded_at'] = time.time()
+
+    def _record_error(self, error):
+        self._stats['reload_errors'] += 1
+        self._stats['last_error'] = str(error)
+
+# 当前进程的材质目录
+catalog_loader = CatalogLoader()
+
+def get_catalog():
+    """获取当前的材质目录"""
+    return catalog_loader.get()
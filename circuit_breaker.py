@@ -0,0 +1,173 @@
+"""
+手串饰品预测软件 - 熔断器模块
+按失败率熔断外部服务调用，熔断期间由后台探测恢复
+"""
+import threading
+import time
+from collections import deque
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed: 正常放行请求，统计最近window_size次调用的失败率，
+            达到阈值后进入open
+    open: 直接拒绝请求，recovery_timeout秒后由后台线程调用probe探测，
+          探测期间为half_open
+    half_open: 最多放行half_open_max_calls个试探请求，
+               探测或试探成功则恢复closed，失败则重新open
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, probe=None, window_size=20, min_requests=5,
+                 failure_rate_threshold=0.5, recovery_timeout=30.0, half_open_max_calls=1):
+        """
+        参数:
+            name: 熔断器名称
+            probe: 恢复探测函数，返回True表示服务已恢复；为None时由试探请求决定
+            window_size: 统计失败率的最近调用次数
+            min_requests: 窗口内至少有多少次调用才判断失败率
+            failure_rate_threshold: 触发熔断的失败率
+            recovery_timeout: 熔断后多久开始探测恢复(秒)
+            half_open_max_calls: half_open状态下最多放行的试探请求数
+        """
+        self.name = name
+        self.probe = probe
+        self.min_requests = min_requests
+        self.failure_rate_threshold = failure_rate_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._half_open_calls = 0
+        self._probe_thread = None
+        self._stats = {
+            'rejected': 0,
+            'times_opened': 0,
+            'probes': 0,
+            'probe_failures': 0
+        }
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow_request(self):
+        """
+        判断是否放行本次请求
+
+        返回:
+            布尔值，False表示熔断中，调用方应直接走降级逻辑
+        """
+        with self._lock:
+            if self._state == self.OPEN and self.probe is None:
+                if time.time() - self._opened_at >= self.recovery_timeout:
+                    self._state = self.HALF_OPEN
+                    self._half_open_calls = 0
+
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+
+            if self._state == self.OPEN:
+                self._schedule_probe_locked()
+            self._stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._close_locked()
+            elif self._state == self.CLOSED:
+                self._outcomes.append(True)
+
+    def record_failure(self):
+        """记录一次失败调用"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open_locked()
+            elif self._state == self.CLOSED:
+                self._outcomes.append(False)
+                if len(self._outcomes) >= self.min_requests and self._failure_rate() >= self.failure_rate_threshold:
+                    self._open_locked()
+
+    def snapshot(self):
+        """获取熔断器当前状态和统计信息"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                'name': self.name,
+                'state': self._state,
+                'failure_rate': round(self._failure_rate(), 4),
+                'window_calls': len(self._outcomes),
+                'failure_rate_threshold': self.failure_rate_threshold,
+                'recovery_timeout': self.recovery_timeout,
+                'opened_at': self._opened_at
+            })
+        return snapshot
+
+    def _failure_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def _close_locked(self):
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._outcomes.clear()
+
+    def _open_locked(self):
+        self._state = self.OPEN
+        self._opened_at = time.time()
+        self._half_open_calls = 0
+        self._outcomes.clear()
+        self._stats['times_opened'] += 1
+        self._schedule_probe_locked()
+
+    def _schedule_probe_locked(self):
+        if self.probe is None:
+            return
+        if self._probe_thread is not None and self._probe_thread.is_alive():
+            return
+        self._probe_thread = threading.Thread(
+            target=self._probe_loop, name=f"{self.name}-breaker-probe", daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        """后台探测，直到服务恢复或熔断器被试探请求关闭"""
+        while True:
+            with self._lock:
+                if self._state != self.OPEN:
+                    return
+                wait = self._opened_at + self.recovery_timeout - time.time()
+                if wait <= 0:
+                    self._state = self.HALF_OPEN
+                    self._half_open_calls = 0
+            if wait > 0:
+                time.sleep(wait)
+                continue
+
+            try:
+                recovered = bool(self.probe())
+            except Exception:
+                recovered = False
+
+            with self._lock:
+                self._stats['probes'] += 1
+                if self._state != self.HALF_OPEN:
+                    return
+                if recovered:
+                    self._close_locked()
+                    return
+                self._stats['probe_failures'] += 1
+                self._state = self.OPEN
+                self._opened_at = time.time()
@@ -4,65 +4,207 @@
 """
 import os
 import json
-import requests
+import time
+from circuit_breaker import CircuitBreaker
+from http_client import get_session
+from metrics import LLM_REQUESTS, record_llm_fallback, record_llm_usage, stage
+from response_cache import ResponseCache
+from segment_store import SegmentStore
+from storage import STORAGE_DIR
 
 # DeepSeek API配置
 DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "sk-b21ed31cf5f34cf483602422613aac4c")
 DEEPSEEK_API_ENDPOINT = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_MODELS_ENDPOINT = "https://api.deepseek.com/v1/models"
+DEEPSEEK_MODEL = "deepseek-chat"
+DEEPSEEK_TEMPERATURE = 0.7
 
-def get_enhanced_prediction(user_info, basic_prediction):
+# 单次增强预测请求的超时时间(秒)，请求截止时间更早时以截止时间为准
+DEEPSEEK_TIMEOUT = 30
+
+def probe_deepseek_api():
+    """
+    熔断恢复探测：请求模型列表接口，服务端无5xx错误即视为恢复
+    
+    返回:
+        布尔值，表示DeepSeek API是否可用
+    """
+    response = get_session().get(
+        DEEPSEEK_MODELS_ENDPOINT,
+        headers={"Authorization": f"Bearer {DEEPSEEK_API_KEY}"},
+        timeout=5
+    )
+    return not is_breaker_failure(response.status_code)
+
+def is_breaker_failure(status_code):
+    """限流和服务端错误计为熔断失败，鉴权等客户端错误不计"""
+    return status_code == 429 or status_code >= 500
+
+# 增强预测结果中的字段
+ENHANCED_FIELDS = ('yearly_fortune', 'purpose_advice', 'bracelet_recommendation', 'usage_tips')
+
+# DeepSeek API熔断器
+deepseek_breaker = CircuitBreaker(
+    "deepseek",
+    probe=probe_deepseek_api,
+    window_size=int(os.environ.get("DEEPSEEK_BREAKER_WINDOW", 20)),
+    min_requests=int(os.environ.get("DEEPSEEK_BREAKER_MIN_REQUESTS", 5)),
+    failure_rate_threshold=float(os.environ.get("DEEPSEEK_BREAKER_FAILURE_RATE", 0.5)),
+    recovery_timeout=float(os.environ.get("DEEPSEEK_BREAKER_RECOVERY_TIMEOUT", 30))
+)
+
+# 增强预测结果缓存，TTL为0时禁用
+prediction_cache = ResponseCache(
+    os.path.join(STORAGE_DIR, "llm_cache"),
+    ttl=int(os.environ.get("DEEPSEEK_CACHE_TTL", 7 * 24 * 60 * 60)),
+    max_memory_entries=int(os.environ.get("DEEPSEEK_CACHE_MEMORY_SIZE", 256)),
+    max_disk_entries=int(os.environ.get("DEEPSEEK_CACHE_DISK_SIZE", 10000))
+)
+
+# 离线预先生成的分群增强内容
+segment_store = SegmentStore()
+
+def replay_enhanced_prediction(enhanced_prediction):
+    """
+    按流式增强预测的事件格式产生已有的增强内容
+
+    返回:
+        生成器，依次产生('field', 字段名, 字段值)，最后产生('done', 增强的预测结果, None)
+    """
+    for name, value in enhanced_prediction.items():
+        if name in ENHANCED_FIELDS:
+            yield 'field', name, value
+    yield 'done', enhanced_prediction, None
+
+def get_segment_prediction(basic_prediction):
+    """
+    获取基本预测结果所属分群离线生成的增强内容，不请求DeepSeek API
+    
+    参数:
+        basic_prediction: 基本预测结果
+        
+    返回:
+        增强的预测结果，内容库中没有该分群时返回None
+    """
+    enhanced_prediction = segment_store.lookup(basic_prediction)
+    if enhanced_prediction is None:
+        return None
+    enhanced_prediction['enhanced'] = True
+    enhanced_prediction['source'] = 'segment'
+    LLM_REQUESTS.inc('segment_hit')
+    return enhanced_prediction
+
+def lookup_enhanced_prediction(basic_prediction):
+    """
+    不请求DeepSeek API，查找离线生成的分群内容和相同提示信息的缓存结果
+    
+    准入控制只需为未命中的请求占用调用名额
+    
+    参数:
+        basic_prediction: 基本预测结果
+        
+    返回:
+        增强的预测结果，都未命中时返回None
+    """
+    segment_prediction = get_segment_prediction(basic_prediction)
+    if segment_prediction is not None:
+        return segment_prediction
+    
+    cache_key = prediction_cache.make_key(create_prompt(basic_prediction), DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE)
+    cached_prediction = prediction_cache.get(cache_key)
+    if cached_prediction is not None:
+        LLM_REQUESTS.inc('cache_hit')
+    return cached_prediction
+
+def remaining_time(deadline):
+    """
+    距请求截止时间的剩余秒数
+    
+    参数:
+        deadline: 截止时间(time.monotonic()的取值)，None表示不设截止时间
+        
+    返回:
+        剩余秒数，不超过DEEPSEEK_TIMEOUT
+    """
+    if deadline is None:
+        return DEEPSEEK_TIMEOUT
+    return min(DEEPSEEK_TIMEOUT, deadline - time.monotonic())
+
+def deadline_exceeded_prediction():
+    """超过请求截止时间时的增强预测结果，手串推荐使用基本推荐"""
+    record_llm_fallback('deadline')
+    return {
+        'enhanced': False,
+        'error': '超过请求截止时间',
+        'message': 'DeepSeek API响应超时，使用基本预测结果'
+    }
+
+def get_enhanced_prediction(user_info, basic_prediction, deadline=None, lookup=True):
     """
     使用DeepSeek API增强预测结果
     
     参数:
         user_info: 用户基本信息
         basic_prediction: 基本预测结果
+        deadline: 请求截止时间(time.monotonic()的取值)，None时只受DEEPSEEK_TIMEOUT限制
+        lookup: 是否先查分群内容和缓存，调用方已用lookup_enhanced_prediction查过时为False
         
     返回:
         增强的预测结果
     """
     try:
-        # 检查网络连接
-        if not is_network_available():
+        # 所属分群已有离线生成的内容或相同提示信息已有缓存结果时直接使用
+        if lookup:
+            cached_prediction = lookup_enhanced_prediction(basic_prediction)
+            if cached_prediction is not None:
+                return cached_prediction
+        
+        # 构建提示信息
+        prompt = create_prompt(basic_prediction)
+        cache_key = prediction_cache.make_key(prompt, DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE)
+        
+        # 熔断中直接使用基本预测结果
+        if not deepseek_breaker.allow_request():
+            record_llm_fallback('breaker_open')
             return {
                 'enhanced': False,
-                'error': '网络连接不可用',
-                'message': '无法连接到DeepSeek API，使用基本预测结果'
+                'error': 'DeepSeek API熔断中',
+                'message': 'DeepSeek API暂时不可用，使用基本预测结果'
             }
         
-        # 构建请求头
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-        }
+        # 已超过截止时间时不再请求
+        timeout = remaining_time(deadline)
+        if timeout <= 0:
+            return deadline_exceeded_prediction()
         
-        # 构建提示信息
-        prompt = create_prompt(basic_prediction)
-        
-        # 构建请求体
-        data = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": "你是一位精通命理学、风水学和手串饰品的专家顾问，擅长根据用户的命理特征提供个性化的运势预测和手串饰品推荐。"},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 2000
-        }
+        # 构建请求
+        headers, data = build_prediction_request(prompt)
         
         # 发送请求
-        response = requests.post(DEEPSEEK_API_ENDPOINT, headers=headers, data=json.dumps(data), timeout=30)
+        start_time = time.perf_counter()
+        with stage('llm_upstream'):
+            response = post_with_breaker(headers, data, timeout=timeout, retries=deadline is None)
+        latency = time.perf_counter() - start_time
         
         # 检查响应状态
         if response.status_code == 200:
             result = response.json()
             enhanced_content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+            record_llm_usage(result.get("usage"))
             
             # 解析增强内容
-            enhanced_prediction = parse_enhanced_content(enhanced_content)
+            with stage('llm_parse'):
+                enhanced_prediction = parse_enhanced_content(enhanced_content)
             enhanced_prediction['enhanced'] = True
+            LLM_REQUESTS.inc('enhanced')
+            
+            # 只缓存解析成功的结果
+            if 'raw_content' not in enhanced_prediction:
+                tokens = result.get("usage", {}).get("total_tokens", 0)
+                prediction_cache.set(cache_key, enhanced_prediction, latency=latency, tokens=tokens)
             return enhanced_prediction
         else:
+            record_llm_fallback('http_error')
             return {
                 'enhanced': False,
                 'error': f"API请求失败: {response.status_code}",
@@ -70,12 +212,199 @@ def get_enhanced_prediction(user_info, basic_prediction):
             }
     
     except Exception as e:
+        if deadline is not None and time.monotonic() >= deadline:
+            return deadline_exceeded_prediction()
+        record_llm_fallback('exception')
         return {
             'enhanced': False,
             'error': str(e),
             'message': '获取增强预测时出错，使用基本预测结果'
         }
 
+def stream_enhanced_prediction(user_info, basic_prediction, deadline=None, lookup=True):
+    """
+    以流式方式调用DeepSeek API增强预测结果
+    
+    超过请求截止时间时停止读取，已产生的字段保留，结果标记为未增强
+    
+    参数:
+        user_info: 用户基本信息
+        basic_prediction: 基本预测结果
+        deadline: 请求截止时间(time.monotonic()的取值)，None时只受DEEPSEEK_TIMEOUT限制
+        lookup: 是否先查分群内容和缓存，调用方已用lookup_enhanced_prediction查过时为False
+        
+    返回:
+        生成器，依次产生('field', 字段名, 字段值)，每个顶层字段解析完整后立即产生；
+        最后产生('done', 增强的预测结果, None)
+    """
+    emitted = set()
+    try:
+        # 所属分群已有离线生成的内容或相同提示信息已有缓存结果时直接使用
+        cached_prediction = lookup_enhanced_prediction(basic_prediction) if lookup else None
+        if cached_prediction is not None:
+            yield from replay_enhanced_prediction(cached_prediction)
+            return
+        
+        # 构建提示信息
+        prompt = create_prompt(basic_prediction)
+        cache_key = prediction_cache.make_key(prompt, DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE)
+        
+        # 熔断中直接使用基本预测结果
+        if not deepseek_breaker.allow_request():
+            record_llm_fallback('breaker_open')
+            yield 'done', {
+                'enhanced': False,
+                'error': 'DeepSeek API熔断中',
+                'message': 'DeepSeek API暂时不可用，使用基本预测结果'
+            }, None
+            return
+        
+        # 已超过截止时间时不再请求
+        timeout = remaining_time(deadline)
+        if timeout <= 0:
+            yield 'done', deadline_exceeded_prediction(), None
+            return
+        
+        # 发送流式请求，读取超时不超过剩余时间
+        headers, data = build_prediction_request(prompt, stream=True)
+        start_time = time.perf_counter()
+        response = post_with_breaker(headers, data, timeout=timeout, stream=True, retries=deadline is None)
+        
+        if response.status_code != 200:
+            response.close()
+            record_llm_fallback('http_error')
+            yield 'done', {
+                'enhanced': False,
+                'error': f"API请求失败: {response.status_code}",
+                'message': '无法获取增强预测，使用基本预测结果'
+            }, None
+            return
+        
+        # 逐块读取并增量解析
+        parser = EnhancedContentStreamParser()
+        usage = None
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    yield 'done', deadline_exceeded_prediction(), None
+                    return
+                
+                chunk = json.loads(payload)
+                usage = chunk.get("usage") or usage
+                delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content") or ''
+                for name, value in parser.feed(delta):
+                    emitted.add(name)
+                    yield 'field', name, value
+        latency = time.perf_counter() - start_time
+        record_llm_usage(usage)
+        
+        # 整体再解析一次，补齐增量解析未能产生的字段(如非JSON格式的回复)
+        with stage('llm_parse'):
+            enhanced_prediction = parse_enhanced_content(parser.buffer)
+        enhanced_prediction['enhanced'] = True
+        LLM_REQUESTS.inc('enhanced')
+        for name in ENHANCED_FIELDS:
+            if name in enhanced_prediction and name not in emitted:
+                yield 'field', name, enhanced_prediction[name]
+        
+        # 只缓存解析成功的结果
+        if 'raw_content' not in enhanced_prediction:
+            tokens = (usage or {}).get("total_tokens", 0)
+            prediction_cache.set(cache_key, enhanced_prediction, latency=latency, tokens=tokens)
+        yield 'done', enhanced_prediction, None
+    
+    except Exception as e:
+        if deadline is not None and time.monotonic() >= deadline:
+            yield 'done', deadline_exceeded_prediction(), None
+            return
+        record_llm_fallback('exception')
+        yield 'done', {
+            'enhanced': False,
+            'error': str(e),
+            'message': '获取增强预测时出错，使用基本预测结果'
+        }, None
+
+def get_cache_stats():
+    """
+    获取增强预测缓存的统计信息
+    
+    返回:
+        命中、未命中、淘汰计数以及节省的耗时和token数
+    """
+    stats = prediction_cache.stats()
+    stats['enabled'] = prediction_cache.enabled
+    stats['ttl'] = prediction_cache.ttl
+    return stats
+
+def get_segment_stats():
+    """
+    获取分群增强内容库的统计信息
+    
+    返回:
+        条目数、覆盖率、命中数和命中率
+    """
+    return segment_store.stats()
+
+def build_prediction_request(prompt, stream=False):
+    """
+    构建增强预测的请求头和请求体
+    
+    参数:
+        prompt: 提示信息
+        stream: 是否流式返回
+        
+    返回:
+        (请求头, 请求体)
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
+    }
+    data = {
+        "model": DEEPSEEK_MODEL,
+        "messages": [
+            {"role": "system", "content": "你是一位精通命理学、风水学和手串饰品的专家顾问，擅长根据用户的命理特征提供个性化的运势预测和手串饰品推荐。"},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": DEEPSEEK_TEMPERATURE,
+        "max_tokens": 2000
+    }
+    if stream:
+        data["stream"] = True
+    return headers, data
+
+def post_with_breaker(headers, data, timeout, stream=False, retries=True):
+    """
+    发送DeepSeek API请求，并把结果记录到熔断器
+    
+    参数:
+        headers: 请求头
+        data: 请求体
+        timeout: 超时时间(秒)
+        stream: 是否流式读取响应
+        retries: 连接失败时是否重试；有截止时间的请求不重试，耗时不超出截止时间
+        
+    返回:
+        响应对象
+    """
+    try:
+        response = get_session(retries).post(DEEPSEEK_API_ENDPOINT, headers=headers, data=json.dumps(data),
+                                      timeout=timeout, stream=stream)
+    except Exception:
+        deepseek_breaker.record_failure()
+        raise
+    
+    if is_breaker_failure(response.status_code):
+        deepseek_breaker.record_failure()
+    else:
+        deepseek_breaker.record_success()
+    return response
+
 def create_prompt(basic_prediction):
     """
     创建DeepSeek API请求的提示信息
@@ -116,6 +445,44 @@ def create_prompt(basic_prediction):
 3. 个性化的手串饰品推荐，包括材质、颜色、配饰等
 4. 佩戴手串的注意事项和增强效果的方法
 
+请以JSON格式回复，包含以下字段:
+- yearly_fortune: 流年运势分析
+- purpose_advice: 所求事项建议
+- bracelet_recommendation: 手串推荐
+- usage_tips: 使用建议
+"""
+    
+    return prompt
+
+def create_segment_prompt(segment):
+    """
+    创建分群增强内容的提示信息，只包含分群共有的特征，不含姓名、出生日期等个人信息
+    
+    参数:
+        segment: 分群特征，包含zodiac、zodiac_sign、five_elements、purpose、religion
+        
+    返回:
+        提示信息
+    """
+    purpose = segment['purpose']
+    
+    prompt = f"""
+请根据以下命理特征，为具有这些特征的用户提供命运预测和手串饰品推荐。
+内容面向所有具有这些特征的用户，不要出现姓名、性别或具体出生日期：
+
+命理特征:
+- 生肖: {segment['zodiac']}
+- 星座: {segment['zodiac_sign']}
+- 八字中出现的五行: {', '.join(segment['five_elements'])}
+- 所求事项: {purpose}
+- 宗教信仰: {segment['religion']}
+
+请提供以下内容:
+1. 详细的流年运势分析，包括事业、财运、健康、感情等方面
+2. 针对所求事项({purpose})的深入建议
+3. 个性化的手串饰品推荐，包括材质、颜色、配饰等
+4. 佩戴手串的注意事项和增强效果的方法
+
 请以JSON格式回复，包含以下字段:
 - yearly_fortune: 流年运势分析
 - purpose_advice: 所求事项建议
@@ -164,6 +531,102 @@ def parse_enhanced_content(content):
             'raw_content': content
         }
 
+class EnhancedContentStreamParser:
+    """
+    增量解析流式返回的JSON内容
+    
+    跳过JSON对象之前的说明文字或代码块标记，跟踪字符串、转义和嵌套层级，
+    每当顶层对象的一个字段值完整时就解析并返回该字段
+    """
+    
+    def __init__(self):
+        self.buffer = ''
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = 'key'
+        self._key = None
+        self._value_start = None
+    
+    def feed(self, text):
+        """
+        追加一段内容
+        
+        参数:
+            text: 新收到的内容片段
+            
+        返回:
+            本次新解析完整的(字段名, 字段值)列表
+        """
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+        i = self._pos
+        while i < len(buffer) and not self.done:
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._expect == 'key':
+                            self._key = json.loads(buffer[self._value_start:i + 1])
+                            self._expect = 'colon'
+                        else:
+                            self._complete(buffer[self._value_start:i + 1], completed)
+            elif self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                    self._expect = 'key'
+            elif char == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._value_start = i
+            elif char in '{[':
+                if self._depth == 1:
+                    self._value_start = i
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 1:
+                    self._complete(buffer[self._value_start:i + 1], completed)
+                elif self._depth == 0:
+                    self._complete_primitive(buffer, i, completed)
+                    self.done = True
+            elif self._depth == 1:
+                if char == ':':
+                    self._expect = 'value'
+                    self._value_start = None
+                elif char == ',':
+                    self._complete_primitive(buffer, i, completed)
+                    self._expect = 'key'
+                elif not char.isspace() and self._expect == 'value' and self._value_start is None:
+                    self._value_start = i
+            i += 1
+        self._pos = i
+        return completed
+    
+    def _complete_primitive(self, buffer, end, completed):
+        """数字、布尔值等没有结束符号的值，遇到逗号或右括号时才完整"""
+        if self._expect == 'value' and self._value_start is not None:
+            self._complete(buffer[self._value_start:end].strip(), completed)
+    
+    def _complete(self, raw, completed):
+        self._expect = 'next'
+        self._value_start = None
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return
+        self.fields[self._key] = value
+        completed.append((self._key, value))
+
 def test_deepseek_api():
     """
     测试DeepSeek API连接
@@ -172,13 +635,6 @@ def test_deepseek_api():
         测试结果
     """
     try:
-        # 检查网络连接
-        if not is_network_available():
-            return {
-                'success': False,
-                'message': '网络连接不可用'
-            }
-        
         # 构建请求头
         headers = {
             "Content-Type": "application/json",
@@ -187,7 +643,7 @@ def test_deepseek_api():
         
         # 构建请求体
         data = {
-            "model": "deepseek-chat",
+            "model": DEEPSEEK_MODEL,
             "messages": [
                 {"role": "user", "content": "你好，这是一个测试消息。请回复'DeepSeek API连接正常'。"}
             ],
@@ -196,7 +652,7 @@ def test_deepseek_api():
         }
         
         # 发送请求
-        response = requests.post(DEEPSEEK_API_ENDPOINT, headers=headers, data=json.dumps(data), timeout=10)
+        response = post_with_breaker(headers, data, timeout=10)
         
         # 检查响应状态
         if response.status_code == 200:
@@ -206,31 +662,20 @@ def test_deepseek_api():
             return {
                 'success': True,
                 'message': '连接成功',
-                'response': content
+                'response': content,
+                'circuit_breaker': deepseek_breaker.snapshot()
             }
         else:
             return {
                 'success': False,
                 'message': f"API请求失败: {response.status_code}",
-                'response': response.text
+                'response': response.text,
+                'circuit_breaker': deepseek_breaker.snapshot()
             }
     
     except Exception as e:
         return {
             'success': False,
-            'message': f"连接出错: {str(e)}"
+            'message': f"连接出错: {str(e)}",
+            'circuit_breaker': deepseek_breaker.snapshot()
         }
-
-def is_network_available():
-    """
-    检查网络连接是否可用
-    
-    返回:
-        布尔值，表示网络是否可用
-    """
-    try:
-        # 尝试连接到百度
-        response = requests.get('https://www.baidu.com', timeout=5)
-        return response.status_code == 200
-    except:
-        return False
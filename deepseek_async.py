@@ -0,0 +1,360 @@
+"""
+手串饰品预测软件 - DeepSeek API异步客户端模块
+每个工作进程共享一个事件循环，限制全局并发，合并相同提示信息的并发请求，
+按请求截止时间返回，并可对慢请求发出对冲请求
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import copy
+import json
+import os
+import threading
+import time
+from collections import deque
+import aiohttp
+from deepseek_api import (
+    DEEPSEEK_API_ENDPOINT, DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE, DEEPSEEK_TIMEOUT,
+    create_prompt, build_prediction_request, parse_enhanced_content, remaining_time, deadline_exceeded_prediction,
+    get_segment_prediction, is_breaker_failure, deepseek_breaker, prediction_cache
+)
+from metrics import (
+    LLM_COALESCED, LLM_HEDGED, LLM_REQUESTS, record_llm_fallback, record_llm_usage, request_timings, stage
+)
+
+# 同时发往DeepSeek API的最大请求数
+DEEPSEEK_MAX_CONCURRENCY = int(os.environ.get("DEEPSEEK_MAX_CONCURRENCY", 16))
+
+# 对冲请求的延迟取近期上游耗时的分位数(如0.95)，首个请求超过该耗时仍未返回时再发一个相同请求，
+# 使用先成功返回的结果；为0时不对冲
+DEEPSEEK_HEDGE_QUANTILE = float(os.environ.get("DEEPSEEK_HEDGE_QUANTILE", 0))
+
+# 对冲延迟的下限(秒)
+DEEPSEEK_HEDGE_MIN_DELAY = float(os.environ.get("DEEPSEEK_HEDGE_MIN_DELAY", 0.5))
+
+# 估计分位数所需的最少样本数和保留的近期样本数
+DEEPSEEK_HEDGE_MIN_SAMPLES = 20
+DEEPSEEK_HEDGE_WINDOW = 200
+
+# 同步包装在截止时间(或DEEPSEEK_TIMEOUT)之后再多等待的秒数；
+# 事件循环线程卡住或退出时，调用线程最多等待到此为止
+EVENT_LOOP_WAIT_MARGIN = 1.0
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+# 以下对象只在事件循环线程中访问
+_semaphore = None
+_session = None
+_inflight = {}
+_upstream_latencies = deque(maxlen=DEEPSEEK_HEDGE_WINDOW)
+_stats = {
+    'requests': 0,
+    'upstream_calls': 0,
+    'coalesced': 0,
+    'deadline_exceeded': 0,
+    'hedged': 0,
+    'hedge_wins': 0
+}
+
+# 同步包装等待事件循环超时的次数，在调用线程中更新
+_loop_timeouts = 0
+_loop_timeouts_lock = threading.Lock()
+
+def get_event_loop():
+    """
+    获取当前进程共享的事件循环，首次调用时在后台线程中启动
+
+    按进程ID懒加载，gunicorn预先fork的子进程各自启动自己的事件循环
+    """
+    global _loop, _loop_pid, _semaphore, _session, _inflight
+
+    pid = os.getpid()
+    if _loop is None or _loop_pid != pid:
+        with _loop_lock:
+            if _loop is None or _loop_pid != pid:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="deepseek-event-loop", daemon=True).start()
+                _semaphore = None
+                _session = None
+                _inflight = {}
+                _loop = loop
+                _loop_pid = pid
+    return _loop
+
+def _close_session():
+    """进程退出时关闭连接池"""
+    if _loop is None or _loop_pid != os.getpid() or _session is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_session.close(), _loop).result(timeout=5)
+    except Exception:
+        pass
+
+atexit.register(_close_session)
+
+def _get_session():
+    global _session
+
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=DEEPSEEK_MAX_CONCURRENCY, keepalive_timeout=60)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=DEEPSEEK_TIMEOUT))
+    return _session
+
+def _get_semaphore():
+    global _semaphore
+
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(DEEPSEEK_MAX_CONCURRENCY)
+    return _semaphore
+
+async def get_enhanced_prediction_async(user_info, basic_prediction, deadline=None, lookup=True, timings=None):
+    """
+    使用DeepSeek API增强预测结果(异步版本)
+
+    先查离线生成的分群内容和缓存；相同提示信息的请求正在进行时，不再重复请求，直接等待同一个结果。
+    超过截止时间时不再等待，上游请求在后台继续完成并写入缓存
+
+    参数:
+        user_info: 用户基本信息
+        basic_prediction: 基本预测结果
+        deadline: 请求截止时间(time.monotonic()的取值)，None时只受DEEPSEEK_TIMEOUT限制
+        lookup: 是否先查分群内容和缓存，调用方已用lookup_enhanced_prediction查过时为False
+        timings: 调用方请求的阶段耗时列表，上游请求和解析的耗时记入其Server-Timing
+
+    返回:
+        增强的预测结果
+    """
+    _stats['requests'] += 1
+    try:
+        # 所属分群已有离线生成的内容时直接使用
+        if lookup:
+            segment_prediction = get_segment_prediction(basic_prediction)
+            if segment_prediction is not None:
+                return segment_prediction
+
+        # 构建提示信息
+        prompt = create_prompt(basic_prediction)
+
+        cache_key = prediction_cache.make_key(prompt, DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE)
+
+        # 合并进行中的相同请求
+        task = _inflight.get(cache_key)
+        if task is not None:
+            _stats['coalesced'] += 1
+            LLM_COALESCED.inc()
+        elif remaining_time(deadline) <= 0:
+            _stats['deadline_exceeded'] += 1
+            return deadline_exceeded_prediction()
+        else:
+            task = asyncio.ensure_future(_resolve_enhanced_prediction(prompt, cache_key, lookup, timings))
+            _inflight[cache_key] = task
+            task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+
+        try:
+            enhanced_prediction = await asyncio.wait_for(asyncio.shield(task), remaining_time(deadline))
+        except asyncio.TimeoutError:
+            _stats['deadline_exceeded'] += 1
+            return deadline_exceeded_prediction()
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            return {
+                'enhanced': False,
+                'error': '请求已取消',
+                'message': '获取增强预测时出错，使用基本预测结果'
+            }
+        return copy.deepcopy(enhanced_prediction)
+
+    except Exception as e:
+        record_llm_fallback('exception')
+        return {
+            'enhanced': False,
+            'error': str(e) or type(e).__name__,
+            'message': '获取增强预测时出错，使用基本预测结果'
+        }
+
+async def _resolve_enhanced_prediction(prompt, cache_key, lookup=True, timings=None):
+    """查缓存(lookup为False时不查)，未命中时请求DeepSeek API；出错时返回基本预测结果的标记"""
+    try:
+        # 磁盘缓存读写放到线程池，避免阻塞事件循环
+        enhanced_prediction = await asyncio.to_thread(prediction_cache.get, cache_key) if lookup else None
+        if enhanced_prediction is None:
+            enhanced_prediction = await _request_enhanced_prediction(prompt, cache_key, timings)
+        else:
+            LLM_REQUESTS.inc('cache_hit')
+        return enhanced_prediction
+    except Exception as e:
+        record_llm_fallback('exception')
+        return {
+            'enhanced': False,
+            'error': str(e) or type(e).__name__,
+            'message': '获取增强预测时出错，使用基本预测结果'
+        }
+
+async def _request_enhanced_prediction(prompt, cache_key, timings=None):
+    """向DeepSeek API发送一次请求并解析结果，上游请求和解析的耗时记入发起请求的timings"""
+    # 熔断中直接使用基本预测结果
+    if not deepseek_breaker.allow_request():
+        record_llm_fallback('breaker_open')
+        return {
+            'enhanced': False,
+            'error': 'DeepSeek API熔断中',
+            'message': 'DeepSeek API暂时不可用，使用基本预测结果'
+        }
+
+    headers, data = build_prediction_request(prompt)
+    start_time = time.perf_counter()
+    with stage('llm_upstream', timings):
+        status_code, result = await _post_hedged(headers, json.dumps(data))
+    latency = time.perf_counter() - start_time
+
+    if status_code != 200:
+        record_llm_fallback('http_error')
+        return {
+            'enhanced': False,
+            'error': f"API请求失败: {status_code}",
+            'message': '无法获取增强预测，使用基本预测结果'
+        }
+
+    enhanced_content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+    record_llm_usage(result.get("usage"))
+
+    # 解析增强内容
+    with stage('llm_parse', timings):
+        enhanced_prediction = parse_enhanced_content(enhanced_content)
+    enhanced_prediction['enhanced'] = True
+    LLM_REQUESTS.inc('enhanced')
+
+    # 只缓存解析成功的结果
+    if 'raw_content' not in enhanced_prediction:
+        tokens = result.get("usage", {}).get("total_tokens", 0)
+        await asyncio.to_thread(prediction_cache.set, cache_key, enhanced_prediction, latency, tokens)
+    return enhanced_prediction
+
+async def _post_once(headers, body):
+    """
+    向DeepSeek API发送一次请求，并把结果记录到熔断器
+
+    返回:
+        (状态码, 状态码为200时的响应JSON)
+    """
+    async with _get_semaphore():
+        _stats['upstream_calls'] += 1
+        start_time = time.perf_counter()
+        try:
+            async with _get_session().post(DEEPSEEK_API_ENDPOINT, headers=headers, data=body) as response:
+                status_code = response.status
+                result = await response.json(content_type=None) if status_code == 200 else None
+        except asyncio.CancelledError:
+            # 被对冲请求抢先时，已等待的时间是本次耗时的下限，同样计入样本，避免分位数被低估
+            _upstream_latencies.append(time.perf_counter() - start_time)
+            raise
+        except Exception:
+            deepseek_breaker.record_failure()
+            raise
+
+    if is_breaker_failure(status_code):
+        deepseek_breaker.record_failure()
+    else:
+        deepseek_breaker.record_success()
+        _upstream_latencies.append(time.perf_counter() - start_time)
+    return status_code, result
+
+def get_hedge_delay():
+    """
+    首个请求等待多久仍未返回时发出对冲请求
+
+    返回:
+        延迟秒数；未启用对冲或近期样本不足时返回None
+    """
+    if DEEPSEEK_HEDGE_QUANTILE <= 0 or len(_upstream_latencies) < DEEPSEEK_HEDGE_MIN_SAMPLES:
+        return None
+    latencies = sorted(_upstream_latencies)
+    index = min(len(latencies) - 1, int(len(latencies) * DEEPSEEK_HEDGE_QUANTILE))
+    return max(DEEPSEEK_HEDGE_MIN_DELAY, latencies[index])
+
+async def _post_hedged(headers, body):
+    """
+    发送增强预测请求；首个请求超过对冲延迟仍未返回且并发未满时，再发一个相同请求，
+    使用先成功返回的结果并取消另一个
+
+    返回:
+        (状态码, 状态码为200时的响应JSON)
+    """
+    first = asyncio.ensure_future(_post_once(headers, body))
+    delay = get_hedge_delay()
+    if delay is None:
+        return await first
+
+    try:
+        await asyncio.wait({first}, timeout=delay)
+    except asyncio.CancelledError:
+        first.cancel()
+        raise
+    if first.done() or _get_semaphore().locked():
+        return await first
+
+    _stats['hedged'] += 1
+    LLM_HEDGED.inc('sent')
+    hedge = asyncio.ensure_future(_post_once(headers, body))
+    try:
+        pending = {first, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in (first, hedge):
+                if task in done and task.exception() is None and task.result()[0] == 200:
+                    if task is hedge:
+                        _stats['hedge_wins'] += 1
+                        LLM_HEDGED.inc('won')
+                    return task.result()
+        # 两个请求都没有成功时使用首个请求的结果
+        return await first
+    finally:
+        for task in (first, hedge):
+            if not task.done():
+                task.cancel()
+
+def get_enhanced_prediction(user_info, basic_prediction, deadline=None, lookup=True):
+    """
+    使用DeepSeek API增强预测结果(同步包装)
+
+    在共享事件循环中运行异步版本并等待结果，供Flask路由直接调用；
+    等待时间以截止时间(或DEEPSEEK_TIMEOUT)加EVENT_LOOP_WAIT_MARGIN为限，事件循环无响应时也不会一直阻塞
+
+    参数:
+        user_info: 用户基本信息
+        basic_prediction: 基本预测结果
+        deadline: 请求截止时间(time.monotonic()的取值)，None时只受DEEPSEEK_TIMEOUT限制
+        lookup: 是否先查分群内容和缓存，调用方已用lookup_enhanced_prediction查过时为False
+
+    返回:
+        增强的预测结果
+    """
+    global _loop_timeouts
+
+    future = asyncio.run_coroutine_threadsafe(
+        get_enhanced_prediction_async(user_info, basic_prediction, deadline, lookup, request_timings()),
+        get_event_loop())
+    try:
+        return future.result(timeout=max(remaining_time(deadline), 0) + EVENT_LOOP_WAIT_MARGIN)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        with _loop_timeouts_lock:
+            _loop_timeouts += 1
+        return deadline_exceeded_prediction()
+
+def get_async_stats():
+    """
+    获取异步客户端的统计信息
+
+    返回:
+        总请求数、实际上游请求数、被合并的请求数、超过截止时间的请求数、对冲请求数、当前进行中的请求数
+        和等待事件循环超时的次数
+    """
+    stats = dict(_stats)
+    stats['in_flight'] = len(_inflight)
+    stats['loop_timeouts'] = _loop_timeouts
+    stats['max_concurrency'] = DEEPSEEK_MAX_CONCURRENCY
+    return stats
@@ -0,0 +1,107 @@
+"""
+手串饰品预测软件 - HTTP客户端模块
+提供带连接池、长连接和重试退避的共享HTTP客户端
+"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 连接池配置
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 2))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", 0.5))
+
+# 单次重试退避的最长时间(秒)，不按响应的Retry-After等待，重试的总耗时有上限
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", 2))
+
+# 连接失败时重试(请求尚未发出)；按状态码重试只用于GET等幂等请求，
+# POST已被服务端收到，重试可能重复计费。已发出的请求读取超时不重试
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+_adapters = {}
+_adapters_pid = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
+
+class BoundedRetry(Retry):
+    """退避时间不超过HTTP_BACKOFF_MAX的重试策略"""
+
+    def get_backoff_time(self):
+        return min(super().get_backoff_time(), HTTP_BACKOFF_MAX)
+
+def create_adapter(pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR):
+    """
+    创建带连接池和重试策略的HTTP适配器
+
+    参数:
+        pool_size: 每个主机保持的最大连接数
+        max_retries: 最大重试次数
+        backoff_factor: 重试退避系数(秒)
+
+    返回:
+        HTTPAdapter对象
+    """
+    retry = BoundedRetry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+    return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=False)
+
+def get_adapter(retries=True):
+    """
+    获取当前进程共享的HTTP适配器
+
+    gunicorn等预先fork的服务器中，子进程不能复用父进程的连接，
+    所以按进程ID懒加载，每个工作进程各有一个连接池
+
+    参数:
+        retries: 是否重试；有截止时间的请求不重试，重试和退避的耗时不会超出截止时间
+    """
+    global _adapters, _adapters_pid
+
+    pid = os.getpid()
+    adapter = _adapters.get(retries) if _adapters_pid == pid else None
+    if adapter is None:
+        with _adapter_lock:
+            if _adapters_pid != pid:
+                _adapters = {}
+                _adapters_pid = pid
+            adapter = _adapters.get(retries)
+            if adapter is None:
+                adapter = create_adapter(max_retries=HTTP_MAX_RETRIES if retries else 0)
+                _adapters[retries] = adapter
+    return adapter
+
+def get_session(retries=True):
+    """
+    获取当前线程的HTTP会话
+
+    requests.Session本身不保证线程安全，所以每个线程使用各自的Session，
+    但都挂载同一个适配器，共享其线程安全的连接池和长连接
+
+    参数:
+        retries: 是否重试，见get_adapter
+
+    返回:
+        requests.Session对象
+    """
+    adapter = get_adapter(retries)
+    sessions = getattr(_local, 'sessions', None)
+    if sessions is None:
+        sessions = _local.sessions = {}
+    session = sessions.get(retries)
+    if session is None or session.adapters['https://'] is not adapter:
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        sessions[retries] = session
+    return session
@@ -0,0 +1,248 @@
+"""
+手串饰品预测软件 - 商品库存模块
+将商品(SKU)编为NumPy特征数组，按基本预测结果一次向量化打分、过滤并取前k个
+"""
+import csv
+import os
+import threading
+import time
+import numpy as np
+from catalog import get_catalog
+from recommendation import element_mask, get_target_elements
+
+# 库存数据文件路径
+INVENTORY_PATH = os.environ.get(
+    "INVENTORY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "inventory.csv"))
+
+# 检查库存文件是否变化的最短间隔(秒)
+INVENTORY_RELOAD_INTERVAL = float(os.environ.get("INVENTORY_RELOAD_INTERVAL", 10))
+
+# 各项匹配的得分权重
+SCORE_ELEMENT = 8
+SCORE_LUCKY_COLOR = 4
+SCORE_PURPOSE = 3
+SCORE_RELIGION = 2
+
+# 单次最多返回的商品数
+MAX_TOP_K = 100
+
+class Inventory:
+    """
+    商品库存的特征数组
+
+    SKU的匹配特征只取决于(材质, 颜色)，所以按(材质, 颜色)分组：
+    分组特征矩阵每行为五行位、颜色位、所求事项位和宗教信仰位，与编译后的材质目录一致；
+    每个SKU只记录分组id、价格、库存和价格名次。打分时先算出每组的得分，再按分组id取出各SKU的得分
+    """
+
+    def __init__(self, records, catalog):
+        """
+        参数:
+            records: SKU记录列表，每条包含sku、material、color、bead_size_mm、price和stock
+            catalog: 编译后的材质目录(Catalog对象)
+        """
+        self.records = records
+        self.catalog = catalog
+
+        # 每个宗教信仰占一位
+        self.religion_bits = {religion: 1 << i for i, religion in enumerate(catalog.religious_materials)}
+        material_religions = {}
+        for religion, material_ids in catalog.religious_materials.items():
+            for material_id in material_ids:
+                material_religions[material_id] = material_religions.get(material_id, 0) | self.religion_bits[religion]
+
+        # 分组特征矩阵，最后一个材质和最后一个颜色留给目录中不存在的材质和颜色，各位为0
+        materials = catalog.materials
+        colors = list(catalog.color_bits)
+        color_slots = {color: i for i, color in enumerate(colors)}
+        group_columns = len(colors) + 1
+        material_features = np.zeros((len(materials) + 1, 3), dtype=np.int64)
+        for material in materials:
+            material_features[material.id] = (
+                material.element_bits, material.purpose_bits, material_religions.get(material.id, 0))
+        color_features = np.zeros(group_columns, dtype=np.int64)
+        color_features[:len(colors)] = [catalog.color_bits[color] for color in colors]
+
+        self.group_features = np.column_stack((
+            np.repeat(material_features, group_columns, axis=0),
+            np.tile(color_features, len(materials) + 1)
+        ))
+        self.group_materials = np.repeat(np.arange(len(materials) + 1, dtype=np.int32), group_columns)
+        self.group_materials[self.group_materials == len(materials)] = -1
+
+        count = len(records)
+        self.group_ids = np.empty(count, dtype=np.int32)
+        self.prices = np.empty(count, dtype=np.float64)
+        self.stocks = np.empty(count, dtype=np.int64)
+        for i, record in enumerate(records):
+            material_id = catalog.material_ids.get(record['material'], len(materials))
+            self.group_ids[i] = material_id * group_columns + color_slots.get(record['color'], len(colors))
+            self.prices[i] = record['price']
+            self.stocks[i] = record['stock']
+
+        # 价格名次：价格越低越大，各SKU互不相同，用于得分相同时排序并保证排序键唯一
+        self.price_rank = np.empty(count, dtype=np.int64)
+        self.price_rank[np.argsort(self.prices, kind='stable')] = np.arange(count - 1, -1, -1)
+
+    def __len__(self):
+        return len(self.records)
+
+    def rank(self, basic_prediction, k=10, min_price=None, max_price=None, min_stock=1):
+        """
+        按基本预测结果为所有SKU打分，返回得分最高的k个
+
+        打分、价格和库存过滤在同一次向量化计算中完成。排序键 = 得分 * SKU数 + 价格名次，
+        被过滤的SKU排序键为负；键互不相同，argpartition选出前k个后只对这k个排序
+
+        参数:
+            basic_prediction: 基本预测结果，使用five_elements、lucky_colors、purpose和religion
+            k: 返回的商品数
+            min_price: 最低价格，None表示不限
+            max_price: 最高价格，None表示不限
+            min_stock: 最低库存
+
+        返回:
+            (下标数组, 得分数组, 符合过滤条件的SKU数)
+        """
+        catalog = self.catalog
+        purpose = basic_prediction.get('purpose', '财运')
+        religion = basic_prediction.get('religion', '无')
+        target_mask = element_mask(get_target_elements(element_mask(basic_prediction.get('five_elements', [])), purpose))
+        query = np.array([
+            target_mask,
+            catalog.purpose_bits.get(purpose, 0),
+            self.religion_bits.get(religion, 0),
+            catalog.color_mask(basic_prediction.get('lucky_colors', []))
+        ], dtype=np.int64)
+        weights = np.array([SCORE_ELEMENT, SCORE_PURPOSE, SCORE_RELIGION, SCORE_LUCKY_COLOR], dtype=np.int64)
+        group_scores = ((self.group_features & query) != 0) @ weights
+
+        scores = group_scores[self.group_ids]
+        keys = scores * len(self) + self.price_rank
+
+        available = self.stocks >= min_stock
+        if min_price is not None:
+            available &= self.prices >= min_price
+        if max_price is not None:
+            available &= self.prices <= max_price
+        np.subtract(self.price_rank, len(self), out=keys, where=~available)
+        matched = int(np.count_nonzero(available))
+
+        k = min(k, matched)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), matched
+
+        if k < len(keys):
+            top = np.argpartition(keys, len(keys) - k)[len(keys) - k:]
+        else:
+            top = np.arange(len(keys))
+        top = top[np.argsort(-keys[top])]
+        return top, scores[top], matched
+
+    def recommend(self, basic_prediction, k=10, min_price=None, max_price=None, min_stock=1):
+        """
+        推荐商品
+
+        参数:
+            同rank
+
+        返回:
+            {'products': 商品列表, 'matched': 符合过滤条件的SKU数, 'total': SKU总数}
+        """
+        top, scores, matched = self.rank(basic_prediction, k, min_price, max_price, min_stock)
+        products = []
+        for index, score in zip(top.tolist(), scores.tolist()):
+            record = self.records[index]
+            material_id = int(self.group_materials[self.group_ids[index]])
+            products.append({
+                'sku': record['sku'],
+                'material': record['material'],
+                'element': self.catalog.materials[material_id].element if material_id >= 0 else None,
+                'color': record['color'],
+                'bead_size_mm': record['bead_size_mm'],
+                'price': record['price'],
+                'stock': record['stock'],
+                'score': score
+            })
+        return {'products': products, 'matched': matched, 'total': len(self)}
+
+def load_inventory_records(path):
+    """
+    从CSV文件加载SKU记录
+
+    参数:
+        path: CSV文件路径，表头为sku、material、color、bead_size_mm、price、stock
+
+    返回:
+        SKU记录列表
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return [{
+            'sku': row['sku'],
+            'material': row['material'],
+            'color': row['color'],
+            'bead_size_mm': float(row['bead_size_mm']),
+            'price': float(row['price']),
+            'stock': int(row['stock'])
+        } for row in csv.DictReader(f)]
+
+class InventoryLoader:
+    """
+    库存热加载
+
+    库存文件或材质目录变化时由一个线程重新编译特征数组并整体替换，其他线程继续使用旧库存
+    """
+
+    def __init__(self, path=INVENTORY_PATH, reload_interval=INVENTORY_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._reload_lock = threading.Lock()
+        self._inventory = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._stats = {
+            'reloads': 0,
+            'reload_errors': 0,
+            'last_error': None
+        }
+
+    def get(self):
+        """获取当前的库存，首次调用时加载"""
+        if self._inventory is None:
+            with self._reload_lock:
+                if self._inventory is None:
+                    self._reload()
+        elif time.monotonic() - self._checked_at >= self.reload_interval and self._reload_lock.acquire(blocking=False):
+            try:
+                self._reload()
+            except Exception as e:
+                # 新文件无效时保留旧库存
+                self._stats['reload_errors'] += 1
+                self._stats['last_error'] = str(e)
+            finally:
+                self._reload_lock.release()
+        return self._inventory
+
+    def stats(self):
+        """获取热加载统计信息"""
+        stats = dict(self._stats)
+        stats['path'] = self.path
+        stats['skus'] = len(self._inventory) if self._inventory is not None else 0
+        return stats
+
+    def _reload(self):
+        self._checked_at = time.monotonic()
+        catalog = get_catalog()
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size, catalog.etag)
+        if signature != self._signature:
+            self._signature = signature
+            self._inventory = Inventory(load_inventory_records(self.path), catalog)
+            self._stats['reloads'] += 1
+
+# 当前进程的商品库存
+inventory_loader = InventoryLoader()
+
+def get_inventory():
+    """获取当前的商品库存"""
+    return inventory_loader.get()
@@ -0,0 +1,359 @@
+"""
+手串饰品预测软件 - 异步任务队列模块
+预测任务持久化在SQLite中，按优先级由有限数量的后台线程执行，客户端轮询或长轮询任务状态
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import metrics
+from storage import STORAGE_DIR
+
+# 任务数据库路径
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(STORAGE_DIR, "jobs.db"))
+
+# 每个进程执行任务的线程数，0表示本进程只接收任务不执行
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+
+# 排队任务数上限，超过时拒绝新任务
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", 10000))
+
+# 任务租约(秒)：执行中的任务超过租约仍未完成(如进程重启)，重新排队
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 120))
+
+# 任务最多执行次数，超过后标记为失败
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+
+# 空闲时检查新任务的间隔(秒)，其他进程提交的任务靠轮询发现
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 0.5))
+
+# 长轮询的最长等待时间(秒)
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", 25))
+
+# 已完成任务的保留时间(秒)
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", 24 * 60 * 60))
+
+# 优先级类别，数值越小越先执行；交互式请求先于批量提交
+JOB_PRIORITIES = {
+    'interactive': 0,
+    'batch': 1
+}
+DEFAULT_JOB_PRIORITY = 'interactive'
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# 任务指标
+JOB_WAIT_SECONDS = metrics.Histogram('job_wait_seconds', '任务从提交到开始执行的排队时间(秒)', labels=('priority',))
+JOB_RUN_SECONDS = metrics.Histogram('job_run_seconds', '任务的执行时间(秒)', labels=('priority', 'status'))
+JOB_SUBMITTED = metrics.Counter('jobs_submitted_total', '提交的任务数', labels=('priority',))
+JOB_REJECTED = metrics.Counter('jobs_rejected_total', '队列已满被拒绝的任务数', labels=('priority',))
+JOB_REQUEUED = metrics.Counter('jobs_requeued_total', '租约过期后重新排队的任务数')
+
+class QueueFullError(Exception):
+    """排队任务数达到上限"""
+
+class JobQueue:
+    """
+    持久化的优先级任务队列
+
+    任务保存在SQLite(WAL模式)中，进程重启不丢失排队的任务；领取任务时在一个写事务中
+    选出优先级最高、提交最早的任务并加上租约，多个gunicorn进程共用一个数据库也不会重复领取。
+    执行中的任务租约过期后重新排队，执行JOB_MAX_ATTEMPTS次仍未完成则标记为失败
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id TEXT PRIMARY KEY,"
+        " priority INTEGER NOT NULL,"
+        " status TEXT NOT NULL,"
+        " payload TEXT NOT NULL,"
+        " result TEXT,"
+        " error TEXT,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " created_at REAL NOT NULL,"
+        " started_at REAL,"
+        " finished_at REAL,"
+        " lease_until REAL)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at)"
+    )
+
+    INSERT_JOB = "INSERT INTO jobs (id, priority, status, payload, created_at) VALUES (?, ?, ?, ?, ?)"
+    SELECT_JOB = (
+        "SELECT id, priority, status, result, error, attempts, created_at, started_at, finished_at"
+        " FROM jobs WHERE id = ?"
+    )
+    COUNT_QUEUED = "SELECT COUNT(*) FROM jobs WHERE status = ?"
+    COUNT_BY_STATUS = "SELECT status, priority, COUNT(*) FROM jobs GROUP BY status, priority"
+    SELECT_NEXT = (
+        "SELECT id, priority, payload, created_at, attempts FROM jobs"
+        " WHERE status = ? ORDER BY priority, created_at LIMIT 1"
+    )
+    CLAIM_JOB = "UPDATE jobs SET status = ?, started_at = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?"
+    # 只有仍持有租约的执行者能写入结果：租约过期后任务被重新领取时attempts已增加
+    FINISH_JOB = (
+        "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL"
+        " WHERE id = ? AND status = ? AND attempts = ?"
+    )
+    REQUEUE_EXPIRED = (
+        "UPDATE jobs SET status = ?, lease_until = NULL"
+        " WHERE status = ? AND lease_until < ? AND attempts < ?"
+    )
+    FAIL_EXPIRED = (
+        "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL"
+        " WHERE status = ? AND lease_until < ? AND attempts >= ?"
+    )
+    DELETE_FINISHED = (
+        "DELETE FROM jobs WHERE id IN"
+        " (SELECT id FROM jobs WHERE finished_at < ? LIMIT ?)"
+    )
+
+    def __init__(self, handler, path=JOB_DB_PATH, workers=JOB_WORKERS):
+        """
+        参数:
+            handler: 执行任务的函数，参数为任务数据，返回可JSON序列化的结果
+            path: 数据库路径
+            workers: 每个进程执行任务的线程数
+        """
+        self.handler = handler
+        self.path = path
+        self.workers = workers
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._lock = threading.Lock()
+        # 有新任务时唤醒一个执行线程，任务完成时唤醒所有长轮询
+        self._work_available = threading.Condition()
+        self._job_finished = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._running = 0
+        self._stats = {
+            'completed': 0,
+            'failed': 0,
+            'errors': 0,
+            'lost_leases': 0
+        }
+
+    def connection(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for statement in self.SCHEMA:
+                        conn.execute(statement)
+                    self._schema_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def submit(self, payload, priority=DEFAULT_JOB_PRIORITY):
+        """
+        提交任务
+
+        参数:
+            payload: 可JSON序列化的任务数据
+            priority: 优先级类别，见JOB_PRIORITIES
+
+        返回:
+            任务ID
+        """
+        if priority not in JOB_PRIORITIES:
+            raise ValueError(f"未知的任务优先级: {priority}")
+
+        conn = self.connection()
+        if conn.execute(self.COUNT_QUEUED, (JOB_QUEUED,)).fetchone()[0] >= JOB_MAX_QUEUED:
+            JOB_REJECTED.inc(priority)
+            raise QueueFullError("任务队列已满，请稍后再试")
+
+        job_id = str(uuid.uuid4())
+        conn.execute(self.INSERT_JOB, (
+            job_id, JOB_PRIORITIES[priority], JOB_QUEUED, json.dumps(payload, ensure_ascii=False), time.time()
+        ))
+        JOB_SUBMITTED.inc(priority)
+        with self._work_available:
+            self._work_available.notify()
+        return job_id
+
+    def get(self, job_id):
+        """
+        获取任务状态
+
+        返回:
+            任务信息，完成时包含result，失败时包含error；任务不存在时返回None
+        """
+        row = self.connection().execute(self.SELECT_JOB, (job_id,)).fetchone()
+        if row is None:
+            return None
+        job_id, priority, status, result, error, attempts, created_at, started_at, finished_at = row
+        job = {
+            'job_id': job_id,
+            'status': status,
+            'priority': _priority_name(priority),
+            'attempts': attempts,
+            'created_at': created_at,
+            'started_at': started_at,
+            'finished_at': finished_at
+        }
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def wait(self, job_id, timeout):
+        """
+        长轮询：等待任务完成或超时
+
+        本进程完成的任务立即唤醒，其他进程完成的任务按JOB_POLL_INTERVAL轮询发现
+
+        参数:
+            job_id: 任务ID
+            timeout: 最长等待时间(秒)，不超过JOB_MAX_WAIT
+
+        返回:
+            任务信息，任务不存在时返回None
+        """
+        deadline = time.monotonic() + min(max(timeout, 0), JOB_MAX_WAIT)
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in (JOB_DONE, JOB_FAILED) or remaining <= 0:
+                return job
+            with self._job_finished:
+                self._job_finished.wait(min(remaining, JOB_POLL_INTERVAL))
+
+    def depth(self):
+        """
+        获取各优先级类别的排队和执行中任务数
+
+        返回:
+            {状态: {优先级类别: 任务数}}
+        """
+        depth = {JOB_QUEUED: {}, JOB_RUNNING: {}}
+        for status, priority, count in self.connection().execute(self.COUNT_BY_STATUS):
+            if status in depth:
+                depth[status][_priority_name(priority)] = count
+        return depth
+
+    def start(self):
+        """启动执行任务的线程，每个进程只启动一次"""
+        with self._lock:
+            if self._pid == os.getpid() and any(thread.is_alive() for thread in self._threads):
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stats(self):
+        """获取任务队列统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running_here'] = self._running
+        stats['workers'] = self.workers if self._pid == os.getpid() else 0
+        stats['depth'] = self.depth()
+        stats['max_queued'] = JOB_MAX_QUEUED
+        return stats
+
+    def run_next(self):
+        """
+        领取并执行一个任务
+
+        返回:
+            是否执行了任务
+        """
+        job = self._claim()
+        if job is None:
+            return False
+
+        job_id, priority, payload, created_at, attempt, started_at = job
+        priority_name = _priority_name(priority)
+        JOB_WAIT_SECONDS.observe(started_at - created_at, priority_name)
+        with self._lock:
+            self._running += 1
+        start = time.perf_counter()
+        try:
+            result = self.handler(json.loads(payload))
+            status, result, error = JOB_DONE, json.dumps(result, ensure_ascii=False), None
+        except Exception as e:
+            status, result, error = JOB_FAILED, None, str(e) or type(e).__name__
+        JOB_RUN_SECONDS.observe(time.perf_counter() - start, priority_name, status)
+
+        finished = self.connection().execute(
+            self.FINISH_JOB, (status, result, error, time.time(), job_id, JOB_RUNNING, attempt)).rowcount
+        with self._lock:
+            self._running -= 1
+            if finished:
+                self._stats['completed' if status == JOB_DONE else 'failed'] += 1
+            else:
+                # 执行超过租约，任务已被重新领取或标记为失败，丢弃本次结果
+                self._stats['lost_leases'] += 1
+        with self._job_finished:
+            self._job_finished.notify_all()
+        return True
+
+    def maintain(self):
+        """重新排队租约过期的任务，并删除超过保留时间的已完成任务"""
+        conn = self.connection()
+        now = time.time()
+        requeued = conn.execute(
+            self.REQUEUE_EXPIRED, (JOB_QUEUED, JOB_RUNNING, now, JOB_MAX_ATTEMPTS)).rowcount
+        conn.execute(self.FAIL_EXPIRED, (JOB_FAILED, '任务多次执行未完成', now, JOB_RUNNING, now, JOB_MAX_ATTEMPTS))
+        conn.execute(self.DELETE_FINISHED, (now - JOB_RETENTION_SECONDS, 1000))
+        if requeued:
+            JOB_REQUEUED.inc(amount=requeued)
+
+    def _claim(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(self.SELECT_NEXT, (JOB_QUEUED,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            started_at = time.time()
+            conn.execute(self.CLAIM_JOB, (JOB_RUNNING, started_at, started_at + JOB_LEASE_SECONDS, row[0]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # 本次领取的执行序号，完成时据此确认仍持有租约
+        return row[:4] + (row[4] + 1, started_at)
+
+    def _run(self):
+        last_maintained = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_maintained >= JOB_LEASE_SECONDS / 4:
+                    last_maintained = time.monotonic()
+                    self.maintain()
+                if self.run_next():
+                    continue
+            except Exception:
+                with self._lock:
+                    self._stats['errors'] += 1
+            with self._work_available:
+                self._work_available.wait(JOB_POLL_INTERVAL)
+
+def _priority_name(priority):
+    for name, value in JOB_PRIORITIES.items():
+        if value == priority:
+            return name
+    return str(priority)
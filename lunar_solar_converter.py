@@ -2,8 +2,193 @@
 手串饰品预测软件 - 阴阳历转换模块
 提供阴历阳历互转、八字计算、星座判断等功能
 """
-from lunarcalendar import Converter, Solar, Lunar, DateNotExist
+from array import array
 import datetime
+import functools
+from startup_snapshot import get_snapshot_section
+
+# 阴历数据表支持的年份范围
+LUNAR_MIN_YEAR = 1900
+LUNAR_MAX_YEAR = 2100
+
+# 阴历年份数据(1900-2100年，与lunarcalendar的数据一致)
+# 每年一个整数：第13-16位为闰月月份(0表示无闰月)，
+# 第12位到第0位依次表示该年各月(含闰月，按先后顺序)是否为大月(30天)
+_LUNAR_YEAR_INFO = (
+    0x1096d, 0x0095c, 0x014ae, 0x0aa4d, 0x01a4c, 0x01b2a, 0x08d55, 0x00ad4, 0x0135a, 0x0495d,
+    0x0095c, 0x0d49b, 0x0149a, 0x01a4a, 0x0baa5, 0x016a8, 0x01ad4, 0x052da, 0x012b6, 0x0e937,
+    0x0092e, 0x01496, 0x0b64b, 0x00d4a, 0x00da8, 0x095b5, 0x0056c, 0x012ae, 0x0492f, 0x0092e,
+    0x0cc96, 0x01a94, 0x01d4a, 0x0ada9, 0x00b5a, 0x0056c, 0x0726e, 0x0125c, 0x0f92d, 0x0192a,
+    0x01a94, 0x0db4a, 0x016aa, 0x00ad4, 0x0955b, 0x004ba, 0x0125a, 0x0592b, 0x0152a, 0x0f695,
+    0x00d94, 0x016aa, 0x0aab5, 0x009b4, 0x014b6, 0x06a57, 0x00a56, 0x1152a, 0x01d2a, 0x00d54,
+    0x0d5aa, 0x0156a, 0x0096c, 0x094ae, 0x014ae, 0x00a4c, 0x07d26, 0x01b2a, 0x0eb55, 0x00ad4,
+    0x012da, 0x0a95d, 0x0095a, 0x0149a, 0x09a4d, 0x01a4a, 0x11aa5, 0x016a8, 0x016d4, 0x0d2da,
+    0x012b6, 0x00936, 0x09497, 0x01496, 0x1564b, 0x00d4a, 0x00da8, 0x0d5b4, 0x0156c, 0x012ae,
+    0x0a92f, 0x0092e, 0x00c96, 0x06d4a, 0x01d4a, 0x10d65, 0x00b58, 0x0156c, 0x0b26d, 0x0125c,
+    0x0192c, 0x09a95, 0x01a94, 0x01b4a, 0x04b55, 0x00ad4, 0x0f55b, 0x004ba, 0x0125a, 0x0b92b,
+    0x0152a, 0x01694, 0x096aa, 0x015aa, 0x12ab5, 0x00974, 0x014b6, 0x0ca57, 0x00a56, 0x01526,
+    0x08e95, 0x00d54, 0x015aa, 0x049b5, 0x0096c, 0x0d4ae, 0x0149c, 0x01a4c, 0x0bd26, 0x01aa6,
+    0x00b54, 0x06d6a, 0x012da, 0x1695d, 0x0095a, 0x0149a, 0x0da4b, 0x01a4a, 0x01aa4, 0x0bb54,
+    0x016b4, 0x00ada, 0x0495b, 0x00936, 0x0f497, 0x01496, 0x0154a, 0x0b6a5, 0x00da4, 0x015b4,
+    0x06ab6, 0x0126e, 0x1092f, 0x0092e, 0x00c96, 0x0cd4a, 0x01d4a, 0x00d64, 0x0956c, 0x0155c,
+    0x0125c, 0x0792e, 0x0192c, 0x0fa95, 0x01a94, 0x01b4a, 0x0ab55, 0x00ad4, 0x014da, 0x08a5d,
+    0x00a5a, 0x1152b, 0x0152a, 0x01694, 0x0d6aa, 0x015aa, 0x00ab4, 0x094ba, 0x014b6, 0x00a56,
+    0x07527, 0x00d26, 0x0ee53, 0x00d54, 0x015aa, 0x0a9b5, 0x0096c, 0x014ae, 0x08a4e, 0x01a4c,
+    0x11d26, 0x01aa4, 0x01b54, 0x0cd6a, 0x00ada, 0x0095c, 0x0949d, 0x0149a, 0x01a2a, 0x05b25,
+    0x01aa4,
+)
+
+# 阴历1900年正月初一对应的阳历日期
+_LUNAR_BASE_DATE = datetime.date(1900, 1, 31)
+_LUNAR_BASE_ORDINAL = _LUNAR_BASE_DATE.toordinal()
+
+# 生肖
+ZODIAC_ANIMALS = ('鼠', '牛', '虎', '兔', '龙', '蛇', '马', '羊', '猴', '鸡', '狗', '猪')
+
+# 天干
+HEAVENLY_STEMS = ('甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸')
+# 地支
+EARTHLY_BRANCHES = ('子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥')
+
+# 时辰对应的地支
+HOUR_TO_EARTHLY_BRANCH = (
+    0, 0, 0, 0, 0,  # 0-4点为子时
+    1, 1,           # 5-6点为丑时
+    2, 2,           # 7-8点为寅时
+    3, 3,           # 9-10点为卯时
+    4, 4,           # 11-12点为辰时
+    5, 5,           # 13-14点为巳时
+    6, 6,           # 15-16点为午时
+    7, 7,           # 17-18点为未时
+    8, 8,           # 19-20点为申时
+    9, 9,           # 21-22点为酉时
+    10, 10,         # 23-24点为戌时
+    11, 11          # 25-26点为亥时(实际上是第二天的1-2点)
+)
+
+# 各月节气分界日(简化处理，使用固定日期)
+MONTH_BOUNDARIES = (0, 6, 4, 6, 5, 6, 6, 7, 8, 8, 8, 7, 7)
+
+# 1900年1月1日为甲子日
+GANZHI_BASE_DATE = datetime.date(1900, 1, 1)
+_GANZHI_BASE_ORDINAL = GANZHI_BASE_DATE.toordinal()
+
+# 天干和地支对应的五行
+STEM_ELEMENTS = ('木', '木', '火', '火', '土', '土', '金', '金', '水', '水')
+BRANCH_ELEMENTS = ('水', '土', '木', '木', '土', '火', '火', '土', '金', '金', '土', '水')
+
+# 五行对应的幸运颜色
+ELEMENT_LUCKY_COLORS = {
+    "木": ("绿色", "青色"),
+    "火": ("红色", "紫色"),
+    "土": ("黄色", "棕色"),
+    "金": ("白色", "金色"),
+    "水": ("黑色", "蓝色")
+}
+
+# 干支名称和对应的(天干五行, 地支五行)，按[天干][地支]索引
+_GANZHI_NAMES = tuple(tuple(stem + branch for branch in EARTHLY_BRANCHES) for stem in HEAVENLY_STEMS)
+_GANZHI_ELEMENTS = {
+    HEAVENLY_STEMS[stem] + EARTHLY_BRANCHES[branch]: (STEM_ELEMENTS[stem], BRANCH_ELEMENTS[branch])
+    for stem in range(10) for branch in range(12)
+}
+
+# 命盘缓存的条目数
+BIRTH_CHART_CACHE_SIZE = 65536
+
+def _build_calendar_tables():
+    """
+    根据阴历年份数据构建按月、按日索引的查找表
+
+    返回:
+        (每年首月序号, 每年闰月, 各月信息, 每日所属月序号)
+        各月信息为(年份, 月份, 是否闰月, 首日偏移, 天数, 日期文本前缀)
+    """
+    year_first_month = array('i')
+    year_leap_month = array('b')
+    months = []
+    day_month = array('i')
+
+    offset = 0
+    for year_index, info in enumerate(_LUNAR_YEAR_INFO):
+        year = LUNAR_MIN_YEAR + year_index
+        leap = (info >> 13) & 0xf
+        year_first_month.append(len(months))
+        year_leap_month.append(leap)
+
+        for i in range(13 if leap else 12):
+            days = 30 if (info >> (12 - i)) & 1 else 29
+            if leap and i == leap:
+                number, is_leap = leap, True
+            elif leap and i > leap:
+                number, is_leap = i, False
+            else:
+                number, is_leap = i + 1, False
+
+            day_month.extend(array('i', [len(months)]) * days)
+            months.append((year, number, is_leap, offset, days,
+                           f"{year}年{'闰' if is_leap else ''}{number}月"))
+            offset += days
+
+    # 哨兵：最后一年之后的首月序号
+    year_first_month.append(len(months))
+
+    return year_first_month, year_leap_month, tuple(months), day_month
+
+# 优先使用启动快照中的查找表
+_YEAR_FIRST_MONTH, _YEAR_LEAP_MONTH, _MONTHS, _DAY_MONTH = (
+    get_snapshot_section('calendar') or _build_calendar_tables())
+
+# 阴历数据表覆盖的阳历日期范围
+SOLAR_MIN_DATE = _LUNAR_BASE_DATE
+SOLAR_MAX_DATE = datetime.date.fromordinal(_LUNAR_BASE_ORDINAL + len(_DAY_MONTH) - 1)
+
+@functools.lru_cache(maxsize=None)
+def _numpy_tables():
+    """批量计算使用的NumPy查找表，首次批量计算时才导入NumPy"""
+    import numpy as np
+
+    return {
+        'year_first_month': np.array(_YEAR_FIRST_MONTH, dtype=np.int64),
+        'year_leap_month': np.array(_YEAR_LEAP_MONTH, dtype=np.int64),
+        'month_start': np.array([info[3] for info in _MONTHS], dtype=np.int64),
+        'month_days': np.array([info[4] for info in _MONTHS], dtype=np.int64),
+        'lunar_base_date': np.datetime64(_LUNAR_BASE_DATE, 'D'),
+        'ganzhi_base_date': np.datetime64(GANZHI_BASE_DATE, 'D'),
+        'solar_month_days': np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype=np.int64),
+        'month_boundaries': np.array(MONTH_BOUNDARIES, dtype=np.int64),
+        'hour_to_earthly_branch': np.array(HOUR_TO_EARTHLY_BRANCH, dtype=np.int64),
+        'ganzhi': np.array([[stem + branch for branch in EARTHLY_BRANCHES] for stem in HEAVENLY_STEMS])
+    }
+
+def _lunar_month_index(year, month, day, is_leap_month=False):
+    """
+    查找阴历日期所在月份的序号
+
+    参数:
+        year: 阴历年份
+        month: 阴历月份
+        day: 阴历日期
+        is_leap_month: 是否闰月
+
+    返回:
+        月份序号，如果日期无效则返回-1
+    """
+    if not LUNAR_MIN_YEAR <= year <= LUNAR_MAX_YEAR or not 1 <= month <= 12:
+        return -1
+
+    year_index = year - LUNAR_MIN_YEAR
+    leap = _YEAR_LEAP_MONTH[year_index]
+    if is_leap_month and month != leap:
+        return -1
+
+    month_index = _YEAR_FIRST_MONTH[year_index] + month - 1
+    if leap and (month > leap or is_leap_month):
+        month_index += 1
+
+    if not 1 <= day <= _MONTHS[month_index][4]:
+        return -1
+    return month_index
 
 def solar_to_lunar(year, month, day):
     """
@@ -18,30 +203,31 @@ def solar_to_lunar(year, month, day):
         包含阴历日期信息的字典
     """
     try:
-        # 创建阳历日期对象
-        solar_date = Solar(year, month, day)
-        
-        # 转换为阴历
-        lunar_date = Converter.Solar2Lunar(solar_date)
-        
-        # 获取生肖
-        zodiac_animals = ['鼠', '牛', '虎', '兔', '龙', '蛇', '马', '羊', '猴', '鸡', '狗', '猪']
-        zodiac = zodiac_animals[(year - 4) % 12]
-        
-        # 返回结果
-        return {
-            'lunar_year': lunar_date.year,
-            'lunar_month': lunar_date.month,
-            'lunar_day': lunar_date.day,
-            'is_leap_month': lunar_date.isLeapMonth,
-            'lunar_date': f"{lunar_date.year}年{'闰' if lunar_date.isLeapMonth else ''}{lunar_date.month}月{lunar_date.day}日",
-            'zodiac': zodiac,
-            'solar_date': datetime.date(year, month, day)
-        }
-    except DateNotExist:
+        solar_date = datetime.date(year, month, day)
+    except ValueError:
         raise ValueError("无效的阳历日期")
-    except Exception as e:
-        raise ValueError(f"阳历转阴历出错: {str(e)}")
+
+    # 查表得到阴历月份
+    offset = solar_date.toordinal() - _LUNAR_BASE_ORDINAL
+    if not 0 <= offset < len(_DAY_MONTH):
+        raise ValueError(f"阳历转阴历出错: 仅支持{SOLAR_MIN_DATE}至{SOLAR_MAX_DATE}之间的日期")
+
+    lunar_year, lunar_month, is_leap_month, start, _, label = _MONTHS[_DAY_MONTH[offset]]
+    lunar_day = offset - start + 1
+
+    # 获取生肖
+    zodiac = ZODIAC_ANIMALS[(year - 4) % 12]
+
+    # 返回结果
+    return {
+        'lunar_year': lunar_year,
+        'lunar_month': lunar_month,
+        'lunar_day': lunar_day,
+        'is_leap_month': is_leap_month,
+        'lunar_date': f"{label}{lunar_day}日",
+        'zodiac': zodiac,
+        'solar_date': solar_date
+    }
 
 def lunar_to_solar(year, month, day, is_leap_month=False):
     """
@@ -56,30 +242,26 @@ def lunar_to_solar(year, month, day, is_leap_month=False):
     返回:
         包含阳历日期信息的字典
     """
-    try:
-        # 创建阴历日期对象
-        lunar_date = Lunar(year, month, day, is_leap_month)
-        
-        # 转换为阳历
-        solar_date = Converter.Lunar2Solar(lunar_date)
-        
-        # 获取生肖
-        zodiac_animals = ['鼠', '牛', '虎', '兔', '龙', '蛇', '马', '羊', '猴', '鸡', '狗', '猪']
-        zodiac = zodiac_animals[(year - 4) % 12]
-        
-        # 返回结果
-        return {
-            'solar_year': solar_date.year,
-            'solar_month': solar_date.month,
-            'solar_day': solar_date.day,
-            'solar_date': datetime.date(solar_date.year, solar_date.month, solar_date.day),
-            'lunar_date': f"{year}年{'闰' if is_leap_month else ''}{month}月{day}日",
-            'zodiac': zodiac
-        }
-    except DateNotExist:
+    # 查表得到阴历月份
+    month_index = _lunar_month_index(year, month, day, is_leap_month)
+    if month_index < 0:
         raise ValueError("无效的阴历日期")
-    except Exception as e:
-        raise ValueError(f"阴历转阳历出错: {str(e)}")
+
+    solar_date = datetime.date.fromordinal(
+        _LUNAR_BASE_ORDINAL + _MONTHS[month_index][3] + day - 1)
+
+    # 获取生肖
+    zodiac = ZODIAC_ANIMALS[(year - 4) % 12]
+
+    # 返回结果
+    return {
+        'solar_year': solar_date.year,
+        'solar_month': solar_date.month,
+        'solar_day': solar_date.day,
+        'solar_date': solar_date,
+        'lunar_date': f"{year}年{'闰' if is_leap_month else ''}{month}月{day}日",
+        'zodiac': zodiac
+    }
 
 def get_zodiac_sign(month, day):
     """
@@ -114,38 +296,17 @@ def get_hour_ganzhi(year, month, day, hour):
     返回:
         时辰干支
     """
-    # 天干
-    heavenly_stems = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸']
-    # 地支
-    earthly_branches = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥']
-    # 时辰对应的地支
-    hour_to_earthly_branch = [
-        0, 0, 0, 0, 0,  # 0-4点为子时
-        1, 1,           # 5-6点为丑时
-        2, 2,           # 7-8点为寅时
-        3, 3,           # 9-10点为卯时
-        4, 4,           # 11-12点为辰时
-        5, 5,           # 13-14点为巳时
-        6, 6,           # 15-16点为午时
-        7, 7,           # 17-18点为未时
-        8, 8,           # 19-20点为申时
-        9, 9,           # 21-22点为酉时
-        10, 10,         # 23-24点为戌时
-        11, 11          # 25-26点为亥时(实际上是第二天的1-2点)
-    ]
-    
     # 获取日干支
     solar_date = datetime.date(year, month, day)
-    base_date = datetime.date(1900, 1, 1)  # 1900年1月1日为甲子日
-    days_diff = (solar_date - base_date).days
+    days_diff = (solar_date - GANZHI_BASE_DATE).days
     day_stem_index = (days_diff + 10) % 10  # 日天干索引
     
     # 计算时辰天干
-    hour_branch_index = hour_to_earthly_branch[hour % 24]
+    hour_branch_index = HOUR_TO_EARTHLY_BRANCH[hour % 24]
     hour_stem_index = (day_stem_index * 2 + hour_branch_index) % 10
     
     # 返回时辰干支
-    return heavenly_stems[hour_stem_index] + earthly_branches[hour_branch_index]
+    return HEAVENLY_STEMS[hour_stem_index] + EARTHLY_BRANCHES[hour_branch_index]
 
 def get_eight_characters(year, month, day, hour=12, is_lunar=False):
     """
@@ -162,18 +323,65 @@ def get_eight_characters(year, month, day, hour=12, is_lunar=False):
         包含八字信息的字典
     """
     try:
-        # 如果是阴历日期，转换为阳历
+        return get_birth_chart(year, month, day, hour, is_lunar).eight_characters()
+    except Exception as e:
+        raise ValueError(f"计算八字出错: {str(e)}")
+
+class BirthChart:
+    """
+    命盘
+
+    一次计算出阳历日期、阴历日期、生肖、星座、四柱、五行、幸运数字和幸运颜色，
+    阴历出生日期只换算一次阳历，日干支只计算一次。创建后不再修改，可在多个请求间共享；
+    阳历日期超出阴历数据表范围时阴历字段为None
+    """
+
+    __slots__ = (
+        'solar_date', 'hour', 'lunar_year', 'lunar_month', 'lunar_day', 'is_leap_month', 'lunar_date',
+        'zodiac', 'zodiac_sign', 'pillars', 'five_elements', 'lucky_numbers', 'lucky_colors'
+    )
+
+    def __init__(self, year, month, day, hour=12, is_lunar=False):
+        """
+        参数:
+            year: 年份
+            month: 月份
+            day: 日期
+            hour: 小时(0-23)
+            is_lunar: 是否为阴历日期
+        """
+        self.hour = hour
+
+        # 阴历日期查表换算阳历，阳历日期查表得到阴历月份
         if is_lunar:
-            solar_info = lunar_to_solar(year, month, day)
-            solar_date = solar_info['solar_date']
+            month_index = _lunar_month_index(year, month, day)
+            if month_index < 0:
+                raise ValueError("无效的阴历日期")
+            offset = _MONTHS[month_index][3] + day - 1
+            ordinal = _LUNAR_BASE_ORDINAL + offset
+            solar_date = datetime.date.fromordinal(ordinal)
         else:
             solar_date = datetime.date(year, month, day)
-        
-        # 天干
-        heavenly_stems = ['甲', '乙', '丙', '丁', '戊', '己', '庚', '辛', '壬', '癸']
-        # 地支
-        earthly_branches = ['子', '丑', '寅', '卯', '辰', '巳', '午', '未', '申', '酉', '戌', '亥']
-        
+            ordinal = solar_date.toordinal()
+            offset = ordinal - _LUNAR_BASE_ORDINAL
+            month_index = _DAY_MONTH[offset] if 0 <= offset < len(_DAY_MONTH) else -1
+        self.solar_date = solar_date
+
+        if month_index >= 0:
+            lunar_year, lunar_month, is_leap_month, start, _, label = _MONTHS[month_index]
+            self.lunar_year = lunar_year
+            self.lunar_month = lunar_month
+            self.lunar_day = offset - start + 1
+            self.is_leap_month = is_leap_month
+            self.lunar_date = f"{label}{self.lunar_day}日"
+        else:
+            self.lunar_year = self.lunar_month = self.lunar_day = None
+            self.is_leap_month = self.lunar_date = None
+
+        # 生肖与solar_to_lunar一致，按阳历年份计算
+        self.zodiac = ZODIAC_ANIMALS[(solar_date.year - 4) % 12]
+        self.zodiac_sign = get_zodiac_sign(solar_date.month, solar_date.day)
+
         # 计算年柱
         # 以立春为界，立春前算上一年
         # 简化处理，使用固定日期：2月4日
@@ -181,10 +389,10 @@ def get_eight_characters(year, month, day, hour=12, is_lunar=False):
             year_offset = -1
         else:
             year_offset = 0
-        
+
         year_stem_index = (solar_date.year + year_offset - 4) % 10
         year_branch_index = (solar_date.year + year_offset - 4) % 12
-        
+
         # 计算月柱
         # 以节气为界，每个月的节气日期大约是：
         # 1月：6日小寒，21日大寒
@@ -199,47 +407,168 @@ def get_eight_characters(year, month, day, hour=12, is_lunar=False):
         # 10月：8日寒露，24日霜降
         # 11月：7日立冬，22日小雪
         # 12月：7日大雪，22日冬至
-        
+
         # 简化处理，使用固定日期
-        month_boundaries = [0, 6, 4, 6, 5, 6, 6, 7, 8, 8, 8, 7, 7]
-        
-        if solar_date.day < month_boundaries[solar_date.month]:
+        if solar_date.day < MONTH_BOUNDARIES[solar_date.month]:
             month_offset = -1
         else:
             month_offset = 0
-        
+
         # 计算月干支
         # 甲己年的正月起丙寅
         # 乙庚年的正月起戊寅
         # 丙辛年的正月起庚寅
         # 丁壬年的正月起壬寅
         # 戊癸年的正月起甲寅
-        month_index = (solar_date.month + month_offset - 1) % 12
-        if month_index <= 0:
-            month_index += 12
-        
-        year_stem = year_stem_index % 5
-        month_stem_index = (year_stem * 2 + month_index + 1) % 10
-        month_branch_index = (month_index + 1) % 12
-        
+        month_number = (solar_date.month + month_offset - 1) % 12
+        if month_number <= 0:
+            month_number += 12
+
+        month_stem_index = (year_stem_index % 5 * 2 + month_number + 1) % 10
+        month_branch_index = (month_number + 1) % 12
+
         # 计算日柱
-        base_date = datetime.date(1900, 1, 1)  # 1900年1月1日为甲子日
-        days_diff = (solar_date - base_date).days
+        days_diff = ordinal - _GANZHI_BASE_ORDINAL
         day_stem_index = (days_diff + 10) % 10
         day_branch_index = (days_diff + 12) % 12
-        
-        # 计算时柱
-        hour_ganzhi = get_hour_ganzhi(solar_date.year, solar_date.month, solar_date.day, hour)
-        
-        # 返回八字
-        return {
-            'year': heavenly_stems[year_stem_index] + earthly_branches[year_branch_index],
-            'month': heavenly_stems[month_stem_index] + earthly_branches[month_branch_index],
-            'day': heavenly_stems[day_stem_index] + earthly_branches[day_branch_index],
-            'hour': hour_ganzhi
-        }
-    except Exception as e:
-        raise ValueError(f"计算八字出错: {str(e)}")
+
+        # 计算时柱，使用已算出的日天干
+        hour_branch_index = HOUR_TO_EARTHLY_BRANCH[hour % 24]
+        hour_stem_index = (day_stem_index * 2 + hour_branch_index) % 10
+
+        self.pillars = pillars = (
+            _GANZHI_NAMES[year_stem_index][year_branch_index],
+            _GANZHI_NAMES[month_stem_index][month_branch_index],
+            _GANZHI_NAMES[day_stem_index][day_branch_index],
+            _GANZHI_NAMES[hour_stem_index][hour_branch_index]
+        )
+
+        # 五行按四柱中天干、地支出现的顺序去重
+        self.five_elements = tuple(dict.fromkeys(
+            _GANZHI_ELEMENTS[pillars[0]] + _GANZHI_ELEMENTS[pillars[1]] +
+            _GANZHI_ELEMENTS[pillars[2]] + _GANZHI_ELEMENTS[pillars[3]]
+        ))
+
+        # 计算幸运数字
+        lucky_number1 = (solar_date.day + solar_date.month) % 9 + 1
+        lucky_number2 = (solar_date.year % 100) % 9 + 1
+        if lucky_number1 == lucky_number2:
+            lucky_number2 = (lucky_number2 % 9) + 1
+        self.lucky_numbers = (lucky_number1, lucky_number2)
+
+        self.lucky_colors = _lucky_colors(self.five_elements)
+
+    def eight_characters(self):
+        """八字字典(每次返回新的字典)"""
+        return {'year': self.pillars[0], 'month': self.pillars[1], 'day': self.pillars[2], 'hour': self.pillars[3]}
+
+@functools.lru_cache(maxsize=None)
+def _lucky_colors(five_elements):
+    """五行对应的幸运颜色，五行组合有限，全部缓存"""
+    return tuple(color for element in five_elements for color in ELEMENT_LUCKY_COLORS[element])
+
+@functools.lru_cache(maxsize=BIRTH_CHART_CACHE_SIZE)
+def get_birth_chart(year, month, day, hour=12, is_lunar=False):
+    """
+    获取命盘，按(日期, 小时, 是否阴历)缓存
+
+    参数:
+        year: 年份
+        month: 月份
+        day: 日期
+        hour: 小时(0-23)
+        is_lunar: 是否为阴历日期
+
+    返回:
+        BirthChart对象(共享，不要修改)
+    """
+    return BirthChart(year, month, day, hour, is_lunar)
+
+def get_eight_characters_batch(years, months, days, hours=None, is_lunar=None):
+    """
+    批量获取八字(四柱)，逐条结果与get_eight_characters一致
+
+    参数:
+        years: 年份数组
+        months: 月份数组
+        days: 日期数组
+        hours: 小时数组(0-23)，默认为12
+        is_lunar: 是否为阴历日期的数组，默认为阳历
+
+    返回:
+        包含year、month、day、hour四柱字符串数组和valid有效标记数组的字典，
+        无效日期对应的四柱为空字符串
+    """
+    import numpy as np
+
+    tables = _numpy_tables()
+    years = np.asarray(years, dtype=np.int64)
+    months = np.asarray(months, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    count = len(years)
+    hours = np.full(count, 12, dtype=np.int64) if hours is None else np.asarray(hours, dtype=np.int64)
+    is_lunar = np.zeros(count, dtype=bool) if is_lunar is None else np.asarray(is_lunar, dtype=bool)
+    if not (years.ndim == 1 and months.shape == days.shape == hours.shape == is_lunar.shape == years.shape):
+        raise ValueError("批量参数长度不一致")
+
+    # 阴历日期：按月查表得到相对阴历1900年正月初一的天数
+    lunar_year_index = np.clip(years - LUNAR_MIN_YEAR, 0, LUNAR_MAX_YEAR - LUNAR_MIN_YEAR)
+    leap = tables['year_leap_month'][lunar_year_index]
+    month_index = tables['year_first_month'][lunar_year_index] + np.clip(months, 1, 12) - 1
+    month_index += (leap > 0) & (months > leap)
+    lunar_valid = ((years >= LUNAR_MIN_YEAR) & (years <= LUNAR_MAX_YEAR) &
+                   (months >= 1) & (months <= 12) &
+                   (days >= 1) & (days <= tables['month_days'][month_index]))
+    lunar_dates = tables['lunar_base_date'] + (
+        tables['month_start'][month_index] + days - 1).astype('timedelta64[D]')
+
+    # 阳历日期：校验后直接构造日期
+    is_leap_year = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    month_days = tables['solar_month_days'][np.clip(months, 1, 12)] + ((months == 2) & is_leap_year)
+    solar_valid = ((years >= 1) & (years <= 9999) & (months >= 1) & (months <= 12) &
+                   (days >= 1) & (days <= month_days))
+    solar_dates = ((np.clip(years, 1, 9999) - 1970).astype('datetime64[Y]').astype('datetime64[M]') +
+                   (np.clip(months, 1, 12) - 1).astype('timedelta64[M]')).astype('datetime64[D]')
+    solar_dates = solar_dates + (np.clip(days, 1, 31) - 1).astype('timedelta64[D]')
+
+    valid = np.where(is_lunar, lunar_valid, solar_valid)
+    dates = np.where(is_lunar, lunar_dates, solar_dates)
+    dates = np.where(valid, dates, tables['ganzhi_base_date'])
+
+    # 换算后的阳历年月日
+    solar_year = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    solar_month = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    solar_day = (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1
+
+    # 计算年柱
+    year_offset = -((solar_month == 1) | ((solar_month == 2) & (solar_day < 4))).astype(np.int64)
+    year_stem_index = (solar_year + year_offset - 4) % 10
+    year_branch_index = (solar_year + year_offset - 4) % 12
+
+    # 计算月柱
+    month_offset = -(solar_day < tables['month_boundaries'][solar_month]).astype(np.int64)
+    lunar_month_index = (solar_month + month_offset - 1) % 12
+    lunar_month_index[lunar_month_index <= 0] += 12
+    month_stem_index = ((year_stem_index % 5) * 2 + lunar_month_index + 1) % 10
+    month_branch_index = (lunar_month_index + 1) % 12
+
+    # 计算日柱
+    days_diff = (dates - tables['ganzhi_base_date']).astype(np.int64)
+    day_stem_index = (days_diff + 10) % 10
+    day_branch_index = (days_diff + 12) % 12
+
+    # 计算时柱
+    hour_branch_index = tables['hour_to_earthly_branch'][hours % 24]
+    hour_stem_index = (day_stem_index * 2 + hour_branch_index) % 10
+
+    empty = np.array('', dtype=tables['ganzhi'].dtype)
+    return {
+        'year': np.where(valid, tables['ganzhi'][year_stem_index, year_branch_index], empty),
+        'month': np.where(valid, tables['ganzhi'][month_stem_index, month_branch_index], empty),
+        'day': np.where(valid, tables['ganzhi'][day_stem_index, day_branch_index], empty),
+        'hour': np.where(valid, tables['ganzhi'][hour_stem_index, hour_branch_index], empty),
+        'valid': valid
+    }
 
 def is_valid_solar_date(year, month, day):
     """
@@ -272,11 +601,4 @@ def is_valid_lunar_date(year, month, day, is_leap_month=False):
     返回:
         布尔值，表示日期是否有效
     """
-    try:
-        lunar_date = Lunar(year, month, day, is_leap_month)
-        Converter.Lunar2Solar(lunar_date)
-        return True
-    except DateNotExist:
-        return False
-    except Exception:
-        return False
+    return _lunar_month_index(year, month, day, is_leap_month) >= 0
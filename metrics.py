@@ -0,0 +1,249 @@
+"""
+手串饰品预测软件 - 指标模块
+进程内的计数器、延迟直方图和分阶段计时，可输出Prometheus文本格式和Server-Timing响应头
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 默认的延迟直方图分桶(秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = []
+_local = threading.local()
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """只增不减的计数器，标签值按labels的顺序传入"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    """
+    延迟直方图
+
+    每个标签组合记录各分桶的计数、总和与次数，输出时再累加为Prometheus要求的累计分桶
+    """
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, *label_values):
+        """获取一个标签组合的(累计分桶计数, 总和, 次数)"""
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                return [0] * (len(self.buckets) + 1), 0.0, 0
+            counts, total, count = list(series[0]), series[1], series[2]
+        cumulative = []
+        running = 0
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        return cumulative, total, count
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            label_sets = sorted(self._series)
+        for label_values in label_sets:
+            cumulative, total, count = self.snapshot(*label_values)
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), cumulative):
+                labels = _format_labels(self.labels, label_values, ('le', _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Gauge:
+    """
+    输出时才取值的仪表
+
+    callback返回{标签值元组: 数值}，用于暴露缓存大小、熔断状态等已有的统计
+    """
+
+    def __init__(self, name, documentation, callback, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.callback = callback
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            values = sorted(self.callback().items())
+        except Exception:
+            values = []
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+# 各处理阶段的耗时
+STAGE_SECONDS = Histogram('app_stage_duration_seconds', '各处理阶段的耗时(秒)', labels=('stage',))
+
+# 请求的总耗时
+REQUEST_SECONDS = Histogram(
+    'app_request_duration_seconds', 'HTTP请求的总耗时(秒)', labels=('endpoint', 'method', 'status'))
+
+# 增强预测的结果：segment_hit使用离线生成的分群内容，cache_hit命中缓存，enhanced调用API成功，
+# fallback使用基本预测结果
+LLM_REQUESTS = Counter('llm_requests_total', '增强预测请求数，按结果分类', labels=('outcome',))
+
+# 使用基本预测结果的原因：breaker_open熔断中，http_error接口返回错误，exception请求或解析异常，
+# deadline超过请求截止时间
+LLM_FALLBACKS = Counter('llm_fallbacks_total', '增强预测回退到基本预测结果的次数，按原因分类', labels=('reason',))
+
+# DeepSeek API返回的token用量
+LLM_TOKENS = Counter('llm_tokens_total', 'DeepSeek API返回的token用量', labels=('type',))
+
+# 与进行中的相同请求合并的次数
+LLM_COALESCED = Counter('llm_coalesced_total', '与进行中的相同增强预测请求合并的次数')
+
+# 对冲请求：sent发出的对冲请求数，won对冲请求先于首个请求成功返回的次数
+LLM_HEDGED = Counter('llm_hedged_requests_total', 'DeepSeek API对冲请求数，按结果分类', labels=('outcome',))
+
+def record_llm_usage(usage):
+    """
+    记录一次DeepSeek API响应中的token用量
+
+    参数:
+        usage: 响应中的usage字段，可以为None
+    """
+    if not usage:
+        return
+    for token_type in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+        tokens = usage.get(token_type)
+        if tokens:
+            LLM_TOKENS.inc(token_type[:-len('_tokens')], amount=tokens)
+
+def record_llm_fallback(reason):
+    """记录一次回退到基本预测结果"""
+    LLM_REQUESTS.inc('fallback')
+    LLM_FALLBACKS.inc(reason)
+
+@contextmanager
+def stage(name, timings=None):
+    """
+    记录一个处理阶段的耗时
+
+    耗时计入阶段直方图；当前线程正在处理请求时，同时记入该请求的Server-Timing
+
+    参数:
+        name: 阶段名称
+        timings: 在其他线程(如共享事件循环)中执行时，由request_timings()取得的请求阶段耗时列表
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, name)
+        if timings is None:
+            timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.append((name, duration))
+
+def start_request():
+    """开始记录当前线程处理的请求的阶段耗时"""
+    _local.timings = []
+    _local.started_at = time.perf_counter()
+
+def request_timings():
+    """当前线程处理的请求的阶段耗时列表，传给在其他线程中执行的stage；未调用start_request时返回None"""
+    return getattr(_local, 'timings', None)
+
+def request_elapsed():
+    """当前线程处理的请求已经过的秒数，未调用start_request时返回0"""
+    if getattr(_local, 'timings', None) is None:
+        return 0.0
+    return time.perf_counter() - _local.started_at
+
+def finish_request():
+    """
+    结束记录当前请求
+
+    返回:
+        (阶段耗时列表, 请求总耗时)，未调用start_request时返回([], 0.0)
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return [], 0.0
+    _local.timings = None
+    return timings, time.perf_counter() - _local.started_at
+
+def format_server_timing(timings, total):
+    """
+    生成Server-Timing响应头，同名阶段的耗时合并
+
+    参数:
+        timings: (阶段名称, 耗时秒数)列表
+        total: 请求总耗时(秒)
+
+    返回:
+        Server-Timing响应头的值
+    """
+    merged = {}
+    for name, duration in timings:
+        merged[name] = merged.get(name, 0.0) + duration
+    merged['total'] = total
+    return ', '.join(f"{name};dur={duration * 1000:.2f}" for name, duration in merged.items())
+
+def render():
+    """输出所有指标的Prometheus文本格式"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,383 @@
+"""
+手串饰品预测软件 - 请求性能剖析模块
+按签名请求头或采样率对单个请求做cProfile剖析和tracemalloc内存分配快照，结果保存在存储目录中
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from storage import STORAGE_DIR
+
+# 剖析结果保存目录
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(STORAGE_DIR, "profiles"))
+
+# 请求被随机剖析的比例，0表示只剖析带签名请求头的请求
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+# 签名请求头的密钥，未配置时不接受请求头触发，也不开放剖析结果接口
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET", "")
+
+# 触发剖析的请求头，值为"<过期时间戳>.<HMAC-SHA256十六进制签名>"
+PROFILE_HEADER = "X-Profile-Token"
+
+# 签名请求头的最长有效期(秒)
+PROFILE_TOKEN_MAX_AGE = int(os.environ.get("PROFILE_TOKEN_MAX_AGE", 3600))
+
+# 最多保留的剖析结果数
+PROFILE_MAX_KEEP = int(os.environ.get("PROFILE_MAX_KEEP", 50))
+
+# tracemalloc记录的调用栈深度和元数据中保留的分配位置数
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", 10))
+PROFILE_TOP_ALLOCATIONS = 20
+
+# 不剖析的路径，避免剖析接口和指标接口剖析自己
+PROFILE_EXCLUDED_PATHS = ('/api/profiles', '/metrics')
+
+_PROFILE_ID_PATTERN = re.compile(r'^[0-9]{13}-[0-9a-f]{8}$')
+
+def sign_profile_token(secret, expire_time):
+    """
+    签发触发剖析的请求头
+
+    参数:
+        secret: 剖析密钥
+        expire_time: 过期时间戳
+
+    返回:
+        请求头的值
+    """
+    expire_time = int(expire_time)
+    return f"{expire_time}.{_signature(secret, expire_time)}"
+
+def verify_profile_token(secret, token, now=None):
+    """
+    验证触发剖析的请求头
+
+    参数:
+        secret: 剖析密钥，为空时总是验证失败
+        token: 请求头的值
+        now: 当前时间戳，默认取系统时间
+
+    返回:
+        布尔值，表示签名有效且未过期
+    """
+    if not secret or not token:
+        return False
+    expire_text, _, signature = token.partition('.')
+    try:
+        expire_time = int(expire_text)
+    except ValueError:
+        return False
+    now = time.time() if now is None else now
+    if not now <= expire_time <= now + PROFILE_TOKEN_MAX_AGE:
+        return False
+    return hmac.compare_digest(signature, _signature(secret, expire_time))
+
+def _signature(secret, expire_time):
+    return hmac.new(secret.encode('utf-8'), f"profile:{expire_time}".encode('ascii'), hashlib.sha256).hexdigest()
+
+class ProfileStore:
+    """
+    剖析结果目录
+
+    每个剖析结果有三个文件：<id>.pstats(cProfile统计)、<id>.tracemalloc(内存分配快照)
+    和<id>.json(请求信息和分配最多的位置)。id以毫秒时间戳开头，按文件名排序即按时间排序
+    """
+
+    def __init__(self, directory=PROFILE_DIR, max_keep=PROFILE_MAX_KEEP):
+        self.directory = directory
+        self.max_keep = max_keep
+
+    def save(self, profiler, snapshot, info):
+        """
+        保存一次剖析结果，并删除超出保留数量的旧结果
+
+        参数:
+            profiler: 已停止的cProfile.Profile对象
+            snapshot: tracemalloc快照，可以为None
+            info: 请求信息
+
+        返回:
+            剖析结果ID
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+
+        profiler.dump_stats(self._path(profile_id, 'pstats'))
+        info = dict(info, id=profile_id, created_at=time.time(), allocations=[])
+        if snapshot is not None:
+            snapshot.dump(self._path(profile_id, 'tracemalloc'))
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]:
+                frame = stat.traceback[0]
+                info['allocations'].append({
+                    'location': f"{frame.filename}:{frame.lineno}",
+                    'size': stat.size,
+                    'count': stat.count
+                })
+
+        # 元数据最后写入，列表中只出现完整的结果
+        temp_path = self._path(profile_id, 'json') + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+        os.replace(temp_path, self._path(profile_id, 'json'))
+
+        self._prune()
+        return profile_id
+
+    def list(self, limit=PROFILE_MAX_KEEP):
+        """
+        列出最近的剖析结果，最新的在前
+
+        返回:
+            剖析结果元数据列表(不含分配位置明细)
+        """
+        profiles = []
+        for profile_id in self._ids()[::-1][:limit]:
+            info = self.get(profile_id)
+            if info is not None:
+                info.pop('allocations', None)
+                profiles.append(info)
+        return profiles
+
+    def get(self, profile_id):
+        """获取剖析结果的元数据，不存在时返回None"""
+        if not _PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        try:
+            with open(self._path(profile_id, 'json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path(self, profile_id, kind):
+        """
+        获取剖析结果文件路径
+
+        参数:
+            profile_id: 剖析结果ID
+            kind: pstats或tracemalloc
+
+        返回:
+            文件路径，ID无效或文件不存在时返回None
+        """
+        if kind not in ('pstats', 'tracemalloc') or not _PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = self._path(profile_id, kind)
+        return path if os.path.exists(path) else None
+
+    def _path(self, profile_id, kind):
+        return os.path.join(self.directory, f"{profile_id}.{kind}")
+
+    def _ids(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len('.json')] for name in names if name.endswith('.json'))
+
+    def _prune(self):
+        for profile_id in self._ids()[:-self.max_keep or None]:
+            for kind in ('json', 'pstats', 'tracemalloc'):
+                try:
+                    os.remove(self._path(profile_id, kind))
+                except FileNotFoundError:
+                    pass
+
+def to_speedscope(pstats_path, name):
+    """
+    把cProfile统计转换为speedscope格式
+
+    cProfile只记录调用者与被调用者之间的耗时，不记录完整调用栈；
+    每个函数的自身耗时按调用者拆分，调用栈沿累计耗时最大的调用者近似还原
+
+    参数:
+        pstats_path: pstats文件路径
+        name: 剖析结果名称
+
+    返回:
+        speedscope格式的字典
+    """
+    stats = pstats.Stats(pstats_path).stats
+    frames = []
+    frame_ids = {}
+
+    def frame_id(function):
+        if function not in frame_ids:
+            filename, line, function_name = function
+            frame_ids[function] = len(frames)
+            frames.append({'name': function_name, 'file': filename, 'line': line})
+        return frame_ids[function]
+
+    stack_cache = {}
+
+    def caller_stack(function):
+        # 沿累计耗时最大的调用者向上还原调用栈，遇到环时停止
+        if function in stack_cache:
+            return stack_cache[function]
+        stack = []
+        seen = set()
+        current = function
+        while current is not None and current not in seen:
+            seen.add(current)
+            stack.append(frame_id(current))
+            callers = stats.get(current, (0, 0, 0, 0, {}))[4]
+            current = max(callers, key=lambda caller: callers[caller][3]) if callers else None
+        stack_cache[function] = stack[::-1]
+        return stack_cache[function]
+
+    samples = []
+    weights = []
+    for function, (_, _, total_time, _, callers) in stats.items():
+        if total_time <= 0:
+            continue
+        if not callers:
+            samples.append(caller_stack(function))
+            weights.append(total_time)
+            continue
+        for caller, caller_stats in callers.items():
+            if caller_stats[2] > 0:
+                samples.append(caller_stack(caller) + [frame_id(function)])
+                weights.append(caller_stats[2])
+
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'feng-shui-bracelet-app',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights
+        }]
+    }
+
+class ProfilingMiddleware:
+    """
+    请求剖析WSGI中间件
+
+    包装Flask的wsgi_app，app.run和gunicorn都经过这里；剖析一直持续到响应体迭代结束，
+    流式响应也完整计入。cProfile和tracemalloc都是进程级的，同一进程同时只剖析一个请求，
+    其他被选中的请求直接跳过；内存分配快照也会包含剖析期间其他线程的分配
+    """
+
+    def __init__(self, wsgi_app, store=None, sample_rate=PROFILE_SAMPLE_RATE, secret=PROFILE_SECRET):
+        self.wsgi_app = wsgi_app
+        self.store = store or ProfileStore()
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self._lock = threading.Lock()
+        self._stats = {
+            'profiled': 0,
+            'skipped_busy': 0,
+            'errors': 0
+        }
+
+    def __call__(self, environ, start_response):
+        trigger = self._trigger(environ)
+        if trigger is None:
+            return self.wsgi_app(environ, start_response)
+        if not self._lock.acquire(blocking=False):
+            self._stats['skipped_busy'] += 1
+            return self.wsgi_app(environ, start_response)
+        return self._profile(environ, start_response, trigger)
+
+    def authorized(self, token):
+        """判断请求头是否有权访问剖析结果"""
+        return verify_profile_token(self.secret, token)
+
+    def stats(self):
+        """获取剖析统计信息"""
+        stats = dict(self._stats)
+        stats['sample_rate'] = self.sample_rate
+        stats['header_enabled'] = bool(self.secret)
+        return stats
+
+    def _trigger(self, environ):
+        token = environ.get('HTTP_' + PROFILE_HEADER.upper().replace('-', '_'))
+        if token is None and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        if environ.get('PATH_INFO', '').startswith(PROFILE_EXCLUDED_PATHS):
+            return None
+        if token is not None:
+            return 'header' if verify_profile_token(self.secret, token) else None
+        return 'sample'
+
+    def _profile(self, environ, start_response, trigger):
+        response_status = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            response_status.append(status)
+            return start_response(status, headers, exc_info)
+
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        profiler = cProfile.Profile()
+        start_time = time.perf_counter()
+        profiler.enable()
+        try:
+            body = self.wsgi_app(environ, capture_start_response)
+        except BaseException:
+            profiler.disable()
+            self._finish(profiler, started_tracemalloc, None)
+            raise
+
+        def finish():
+            profiler.disable()
+            self._finish(profiler, started_tracemalloc, {
+                'trigger': trigger,
+                'method': environ.get('REQUEST_METHOD'),
+                'path': environ.get('PATH_INFO'),
+                'query': environ.get('QUERY_STRING', ''),
+                'status': response_status[0] if response_status else None,
+                'duration': time.perf_counter() - start_time,
+                'pid': os.getpid()
+            })
+
+        # 响应体在同一线程中迭代，剖析持续到服务器调用close()
+        return _ProfiledResponse(body, finish)
+
+    def _finish(self, profiler, started_tracemalloc, info):
+        try:
+            snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            if started_tracemalloc:
+                tracemalloc.stop()
+            if info is not None:
+                self.store.save(profiler, snapshot, info)
+                self._stats['profiled'] += 1
+        except Exception:
+            self._stats['errors'] += 1
+        finally:
+            self._lock.release()
+
+class _ProfiledResponse:
+    """包装响应体，close()时结束剖析；WSGI服务器在响应结束或客户端断开时都会调用close()"""
+
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        on_close, self.on_close = self.on_close, None
+        if on_close is None:
+            return
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            on_close()
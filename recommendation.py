@@ -0,0 +1,193 @@
+"""
+手串饰品预测软件 - 手串推荐模块
+按编译后的材质目录构建推荐索引，基本推荐结果按(五行、所求事项、宗教信仰、幸运颜色)缓存
+"""
+import functools
+from lunar_solar_converter import ELEMENT_LUCKY_COLORS
+
+# 五行顺序
+ALL_ELEMENTS = ['木', '火', '土', '金', '水']
+
+# 五行齐全时，按所求事项选择的五行
+PURPOSE_ELEMENTS = {
+    '财运': ['金', '木'],
+    '事业': ['火', '木'],
+    '健康': ['土', '金'],
+    '婚姻': ['火', '土'],
+    '学业': ['水', '木'],
+    '人际': ['火', '木'],
+    '破小人': ['金', '水']
+}
+DEFAULT_PURPOSE_ELEMENTS = ['土']
+
+# 推荐的材质和符号数
+MAX_RECOMMENDED = 3
+
+# 佩戴建议
+WEARING_ADVICE = (
+    "佩戴建议：\n"
+    "1. 手串通常佩戴在左手，因为左手靠近心脏，能更好地吸收能量。\n"
+    "2. 新购买的手串最好先净化，可以用清水冲洗或放在阳光下晒一晒。\n"
+    "3. 佩戴时保持心态平和，有助于增强手串的效果。\n"
+    "4. 定期清洁手串，保持其能量纯净。\n"
+)
+
+# 每个索引缓存的推荐结果数，所求事项和宗教信仰来自用户输入，需要限制
+RECOMMENDATION_CACHE_SIZE = 4096
+
+def element_mask(elements):
+    """将五行列表转为位掩码，按ALL_ELEMENTS的顺序对应各位"""
+    mask = 0
+    for i, element in enumerate(ALL_ELEMENTS):
+        if element in elements:
+            mask |= 1 << i
+    return mask
+
+def get_target_elements(present, purpose):
+    """
+    获取手串应补充的五行：缺失的五行，五行齐全时按所求事项选择
+
+    参数:
+        present: 八字中出现的五行的位掩码
+        purpose: 所求事项
+
+    返回:
+        五行列表
+    """
+    missing_elements = [element for i, element in enumerate(ALL_ELEMENTS) if not present & (1 << i)]
+    return missing_elements or PURPOSE_ELEMENTS.get(purpose, DEFAULT_PURPOSE_ELEMENTS)
+
+class RecommendationIndex:
+    """
+    手串推荐索引
+
+    使用编译后材质目录中的五行和颜色位掩码，
+    并为所有可能的五行组合、已知所求事项和宗教信仰预先生成推荐结果；
+    推荐结果在多个请求间共享，调用方不应修改
+    """
+
+    def __init__(self, catalog, prebuilt=None):
+        """
+        参数:
+            catalog: 编译后的材质目录(Catalog对象)
+            prebuilt: 启动快照中预先生成的推荐结果{键: 推荐结果}，可以为None
+        """
+        self.catalog = catalog
+        self.religious_symbols = {
+            religion: list(symbols[:MAX_RECOMMENDED]) for religion, symbols in catalog.religious_symbols.items()
+        }
+        self._recommend = functools.lru_cache(maxsize=RECOMMENDATION_CACHE_SIZE)(self._build_recommendation)
+        self._prebuilt = None
+        self.warm_up(prebuilt)
+
+    def warm_up_keys(self):
+        """所有五行组合(幸运颜色取对应五行的颜色)、已知所求事项和宗教信仰的缓存键"""
+        for present in range(1 << len(ALL_ELEMENTS)):
+            lucky_colors = [
+                color for i, element in enumerate(ALL_ELEMENTS) if present & (1 << i)
+                for color in ELEMENT_LUCKY_COLORS[element]
+            ]
+            lucky_mask = self.catalog.color_mask(lucky_colors)
+            for purpose in PURPOSE_ELEMENTS:
+                for religion in self.religious_symbols:
+                    yield present, purpose, religion, lucky_mask
+
+    def warm_up(self, prebuilt=None):
+        """
+        预先生成warm_up_keys中的推荐结果
+
+        参数:
+            prebuilt: 预先生成的推荐结果，有的直接放入缓存，不再重新生成
+        """
+        self._prebuilt = prebuilt
+        try:
+            for key in self.warm_up_keys():
+                self._recommend(*key)
+        finally:
+            self._prebuilt = None
+
+    def snapshot(self):
+        """导出warm_up_keys中的推荐结果，供启动快照使用"""
+        return {key: self._recommend(*key) for key in self.warm_up_keys()}
+
+    def recommend(self, five_elements, purpose, religion, lucky_colors):
+        """
+        获取基本推荐结果
+
+        参数:
+            five_elements: 八字中出现的五行
+            purpose: 所求事项
+            religion: 宗教信仰
+            lucky_colors: 幸运颜色
+
+        返回:
+            推荐结果(共享对象，不要修改)
+        """
+        key = (element_mask(five_elements), purpose, religion, self.catalog.color_mask(lucky_colors))
+        try:
+            return self._recommend(*key)
+        except TypeError:
+            # 所求事项或宗教信仰不可哈希时不缓存
+            return self._build_recommendation(*key)
+
+    def cache_info(self):
+        """获取推荐结果缓存的命中统计"""
+        return self._recommend.cache_info()
+
+    def _build_recommendation(self, present, purpose, religion, lucky_mask):
+        if self._prebuilt is not None:
+            recommendation = self._prebuilt.get((present, purpose, religion, lucky_mask))
+            if recommendation is not None:
+                return recommendation
+
+        # 缺失的五行；五行齐全时按所求事项选择
+        missing_elements = get_target_elements(present, purpose)
+        missing_mask = element_mask(missing_elements)
+
+        # 先按五行选择材质，再补充宗教特色材质，只保留前几个
+        materials = self.catalog.materials
+        selected = [(material, False) for material in materials if material.element_bits & missing_mask]
+        if len(selected) < MAX_RECOMMENDED:
+            selected_ids = {material.id for material, _ in selected}
+            for material_id in self.catalog.religious_materials.get(religion, ()):
+                if material_id not in selected_ids:
+                    selected.append((materials[material_id], True))
+                    selected_ids.add(material_id)
+
+        recommended_materials = []
+        for material, religious in selected[:MAX_RECOMMENDED]:
+            recommended = {
+                'name': material.name,
+                'element': material.element,
+                'colors': list(material.colors),
+                'effects': list(material.effects),
+                'suitable_for': list(material.suitable_for),
+                'has_lucky_color': bool(material.color_bits & lucky_mask)
+            }
+            if religious:
+                recommended['religious'] = True
+            recommended_materials.append(recommended)
+
+        religious_symbols = self.religious_symbols.get(religion, [])
+
+        # 生成推荐文本
+        parts = [f"根据您的五行属性和{purpose}需求，推荐以下手串材质组合：\n\n"]
+        for i, material in enumerate(recommended_materials):
+            parts.append(
+                f"{i+1}. {material['name']}（{material['element']}属性）\n"
+                f"   颜色：{', '.join(material['colors'])}\n"
+                f"   功效：{', '.join(material['effects'])}\n"
+                f"   适合：{', '.join(material['suitable_for'])}\n\n"
+            )
+        if religious_symbols:
+            parts.append(f"根据您的{religion}信仰，建议在手串上添加以下吉祥物或符号：\n")
+            parts.append(f"{', '.join(religious_symbols)}\n\n")
+        parts.append(WEARING_ADVICE)
+
+        return {
+            'source': 'basic',
+            'missing_elements': list(missing_elements),
+            'materials': recommended_materials,
+            'religious_symbols': religious_symbols,
+            'recommendation': ''.join(parts)
+        }
@@ -0,0 +1,173 @@
+"""
+手串饰品预测软件 - 存储记录格式模块
+预测结果的版本化编码：格式头 + 紧凑JSON，DeepSeek生成的长文本部分单独压缩
+
+格式(版本1):
+    格式头: 魔数b'FSBR'、格式版本、压缩方式、JSON部分的字节数
+    JSON部分: 去掉压缩部分后的记录，紧凑JSON(UTF-8)
+    压缩部分: {字段: 值}的紧凑JSON，按压缩方式压缩；不压缩时没有这一部分
+
+旧版记录(版本0)是缩进的JSON文本，没有格式头，读取时按旧格式解析。
+用orjson序列化和解析(未安装时使用标准库json)；zstd压缩需另行安装zstandard
+"""
+import json
+import os
+import struct
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 写入的记录格式版本：1为带格式头的紧凑格式，0为旧版缩进JSON(回滚到旧版本代码前使用)
+STORAGE_RECORD_VERSION = int(os.environ.get("STORAGE_RECORD_VERSION", 1))
+
+# 长文本部分的压缩方式：zlib、zstd(需安装zstandard)或none
+STORAGE_RECORD_COMPRESSION = os.environ.get("STORAGE_RECORD_COMPRESSION", "zlib")
+
+# 长文本部分序列化后不少于此字节数时才压缩，短内容压缩后反而更大
+STORAGE_RECORD_COMPRESS_MIN_BYTES = int(os.environ.get("STORAGE_RECORD_COMPRESS_MIN_BYTES", 256))
+
+# 单独压缩的字段：DeepSeek生成的增强预测内容，占记录的大部分字节
+COMPRESSED_SECTIONS = ('enhanced_prediction',)
+
+RECORD_MAGIC = b'FSBR'
+RECORD_VERSION = 1
+_HEADER = struct.Struct('<4sBBI')
+
+# 压缩方式在格式头中的编号
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODECS = {'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+
+# 压缩级别
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+def dumps(value):
+    """序列化为紧凑JSON(UTF-8字节)，orjson不支持的值(如超过64位的整数)改用标准库json"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def loads(data):
+    """解析JSON字节或文本"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def resolve_codec(compression):
+    """
+    获取压缩方式的编号
+
+    参数:
+        compression: zstd、zlib或none
+
+    返回:
+        格式头中的压缩方式编号
+
+    异常:
+        ValueError: 未知的压缩方式，或使用zstd但未安装zstandard
+    """
+    if compression not in CODECS:
+        raise ValueError(f"未知的压缩方式: {compression}")
+    codec = CODECS[compression]
+    if codec == CODEC_ZSTD and zstandard is None:
+        raise ValueError("压缩方式为zstd，需要安装zstandard")
+    return codec
+
+def compress(codec, data):
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL)
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+def decompress(codec, data):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("记录使用zstd压缩，需要安装zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_NONE:
+        return data
+    raise ValueError(f"未知的压缩方式编号: {codec}")
+
+# 启动时检查配置，配置有误时不会等到保存记录才出错
+resolve_codec(STORAGE_RECORD_COMPRESSION)
+
+def encode_record(record, version=None, compression=None, min_bytes=None):
+    """
+    编码一条记录
+
+    参数:
+        record: 记录(字典)
+        version: 格式版本，默认为STORAGE_RECORD_VERSION
+        compression: 压缩方式，默认为STORAGE_RECORD_COMPRESSION
+        min_bytes: 压缩的最小字节数，默认为STORAGE_RECORD_COMPRESS_MIN_BYTES
+
+    返回:
+        编码后的字节
+    """
+    version = STORAGE_RECORD_VERSION if version is None else version
+    if version == 0:
+        return json.dumps(record, ensure_ascii=False, indent=2).encode('utf-8')
+    if version != RECORD_VERSION:
+        raise ValueError(f"不支持的记录格式版本: {version}")
+
+    codec = resolve_codec(STORAGE_RECORD_COMPRESSION if compression is None else compression)
+    min_bytes = STORAGE_RECORD_COMPRESS_MIN_BYTES if min_bytes is None else min_bytes
+
+    compressed = b''
+    sections = {name: record[name] for name in COMPRESSED_SECTIONS if name in record}
+    if codec != CODEC_NONE and sections:
+        payload = dumps(sections)
+        if len(payload) >= min_bytes:
+            compressed = compress(codec, payload)
+            record = {name: value for name, value in record.items() if name not in sections}
+    if not compressed:
+        codec = CODEC_NONE
+
+    body = dumps(record)
+    return _HEADER.pack(RECORD_MAGIC, RECORD_VERSION, codec, len(body)) + body + compressed
+
+def decode_record(data):
+    """
+    解码一条记录，兼容旧版缩进JSON
+
+    参数:
+        data: 编码后的字节，或旧版记录的文本
+
+    返回:
+        记录(字典)
+
+    异常:
+        ValueError: 格式不符或数据不完整
+    """
+    if isinstance(data, str) or not data.startswith(RECORD_MAGIC):
+        return loads(data)
+    if len(data) < _HEADER.size:
+        raise ValueError("记录不完整")
+
+    _, version, codec, length = _HEADER.unpack_from(data, 0)
+    if version != RECORD_VERSION:
+        raise ValueError(f"不支持的记录格式版本: {version}")
+    end = _HEADER.size + length
+    if len(data) < end:
+        raise ValueError("记录不完整")
+
+    record = loads(data[_HEADER.size:end])
+    if codec != CODEC_NONE:
+        record.update(loads(decompress(codec, data[end:])))
+    return record
@@ -0,0 +1,215 @@
+"""
+手串饰品预测软件 - 响应缓存模块
+为DeepSeek API的增强预测结果提供内存LRU + 磁盘两级缓存
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class ResponseCache:
+    """
+    两级响应缓存
+
+    内存层为按最近使用顺序淘汰的LRU，磁盘层每个条目一个JSON文件，
+    两层都按TTL过期。命中时累计节省的请求耗时和token数。
+    """
+
+    def __init__(self, directory, ttl=86400, max_memory_entries=256, max_disk_entries=10000):
+        """
+        参数:
+            directory: 磁盘缓存目录
+            ttl: 缓存有效期(秒)，为0时禁用缓存
+            max_memory_entries: 内存层最多缓存的条目数
+            max_disk_entries: 磁盘层最多缓存的条目数
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_entries = None
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+            'expirations': 0,
+            'saved_seconds': 0.0,
+            'saved_tokens': 0
+        }
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    @staticmethod
+    def make_key(prompt, model, temperature):
+        """
+        根据提示信息、模型和温度生成缓存键
+
+        提示信息会去掉首尾空白并合并行内多余空白，使排版差异不影响命中
+        """
+        normalized_prompt = '\n'.join(' '.join(line.split()) for line in prompt.strip().splitlines())
+        payload = json.dumps([normalized_prompt, model, round(float(temperature), 4)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        获取缓存的值
+
+        返回:
+            缓存值的副本，未命中或已过期时返回None
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry['expire_time'] > now:
+                    self._memory.move_to_end(key)
+                    self._record_hit('memory_hits', entry)
+                    return copy.deepcopy(entry['value'])
+                del self._memory[key]
+                self._stats['expirations'] += 1
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if entry['expire_time'] <= now:
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                self._remove_disk(key)
+                return None
+
+            self._record_hit('disk_hits', entry)
+            self._put_memory(key, entry)
+        return copy.deepcopy(entry['value'])
+
+    def set(self, key, value, latency=0.0, tokens=0):
+        """
+        写入缓存
+
+        参数:
+            key: 缓存键
+            value: 可JSON序列化的值
+            latency: 生成该值所用的请求耗时(秒)
+            tokens: 生成该值消耗的token数
+        """
+        if not self.enabled:
+            return
+
+        entry = {
+            'expire_time': time.time() + self.ttl,
+            'latency': latency,
+            'tokens': tokens,
+            'value': copy.deepcopy(value)
+        }
+        with self._lock:
+            self._put_memory(key, entry)
+        self._write_disk(key, entry)
+
+    def stats(self):
+        """获取缓存命中、未命中和淘汰计数"""
+        if self._disk_entries is None:
+            self._disk_entries = self._count_disk_entries()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_entries'] = self._disk_entries
+        stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['saved_seconds'] = round(stats['saved_seconds'], 3)
+        return stats
+
+    def _record_hit(self, counter, entry):
+        self._stats[counter] += 1
+        self._stats['saved_seconds'] += entry.get('latency', 0.0)
+        self._stats['saved_tokens'] += entry.get('tokens', 0)
+
+    def _put_memory(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats['memory_evictions'] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def _write_disk(self, key, entry):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            is_new = not os.path.exists(path)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except Exception:
+            return
+
+        with self._lock:
+            if self._disk_entries is None:
+                self._disk_entries = self._count_disk_entries()
+            elif is_new:
+                self._disk_entries += 1
+            over_limit = self._disk_entries > self.max_disk_entries
+        if over_limit:
+            self._evict_disk()
+
+    def _count_disk_entries(self):
+        try:
+            return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+        except Exception:
+            return 0
+
+    def _remove_disk(self, key):
+        try:
+            os.remove(self._path(key))
+            if self._disk_entries:
+                self._disk_entries -= 1
+        except Exception:
+            pass
+
+    def _evict_disk(self):
+        """淘汰磁盘层最久未写入的条目，一次淘汰到上限的90%以减少目录扫描"""
+        try:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    path = os.path.join(self.directory, name)
+                    entries.append((os.path.getmtime(path), path))
+        except Exception:
+            return
+
+        entries.sort()
+        excess = len(entries) - int(self.max_disk_entries * 0.9)
+        removed = 0
+        for _, path in entries[:max(excess, 0)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except Exception:
+                pass
+
+        with self._lock:
+            self._disk_entries = len(entries) - removed
+            self._stats['disk_evictions'] += removed
@@ -0,0 +1,276 @@
+"""
+手串饰品预测软件 - 分群增强内容模块
+按(生肖、星座、五行组合、所求事项、宗教信仰)分群，读取离线预先生成的增强预测内容
+
+内容库由tools/precompute_segments.py生成，是一个只读文件，通过mmap按需读取：
+文件头、按键哈希排序的定长索引、逐条zlib压缩的JSON内容。查找时在索引中二分，
+多个工作进程共享操作系统的页缓存。文件不存在或格式不符时所有查找都未命中
+"""
+import datetime
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from recommendation import ALL_ELEMENTS, PURPOSE_ELEMENTS
+
+# 内容库文件路径，为空时不使用内容库
+SEGMENT_STORE_PATH = os.environ.get(
+    "SEGMENT_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "segment_content.bin"))
+
+# 检查内容库文件是否被替换的最短间隔(秒)
+SEGMENT_STORE_RELOAD_INTERVAL = float(os.environ.get("SEGMENT_STORE_RELOAD_INTERVAL", 10))
+
+# 分群涉及的宗教信仰，与首页表单的选项一致
+SEGMENT_RELIGIONS = ('无', '佛教', '道教', '基督教')
+
+# 文件格式：魔数、格式版本、条目数、生成时枚举的分群总数
+SEGMENT_STORE_MAGIC = b'FSBSEGS\x00'
+SEGMENT_STORE_VERSION = 1
+_HEADER = struct.Struct('<8sIII')
+
+# 索引条目：键哈希、内容偏移、内容长度
+_INDEX_ENTRY = struct.Struct('<QII')
+
+def segment_key(basic_prediction):
+    """
+    获取基本预测结果所属分群的键
+
+    参数:
+        basic_prediction: 基本预测结果
+
+    返回:
+        "生肖|星座|五行|所求事项|宗教信仰"，五行按ALL_ELEMENTS的顺序排列
+    """
+    five_elements = basic_prediction.get('five_elements', [])
+    return '|'.join((
+        basic_prediction.get('zodiac', ''),
+        basic_prediction.get('zodiac_sign', ''),
+        ''.join(element for element in ALL_ELEMENTS if element in five_elements),
+        basic_prediction.get('purpose', ''),
+        basic_prediction.get('religion', '')
+    ))
+
+def parse_segment_key(key):
+    """
+    解析分群的键
+
+    返回:
+        包含zodiac、zodiac_sign、five_elements、purpose、religion的字典
+    """
+    zodiac, zodiac_sign, elements, purpose, religion = key.split('|')
+    return {
+        'zodiac': zodiac,
+        'zodiac_sign': zodiac_sign,
+        'five_elements': list(elements),
+        'purpose': purpose,
+        'religion': religion
+    }
+
+def segment_hash(key):
+    """分群键的64位哈希，索引按此排序"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def enumerate_segments(start_year, end_year, purposes=tuple(PURPOSE_ELEMENTS), religions=SEGMENT_RELIGIONS):
+    """
+    枚举出生日期在[start_year, end_year]内实际出现的所有分群
+
+    生肖、星座和五行组合按每天每个时辰(包括23点对应的时辰)逐一计算命盘得到，不会出现的组合不枚举
+
+    参数:
+        start_year: 起始阳历年份
+        end_year: 结束阳历年份
+        purposes: 所求事项
+        religions: 宗教信仰
+
+    返回:
+        排序后的分群键列表
+    """
+    from lunar_solar_converter import BirthChart, HOUR_TO_EARTHLY_BRANCH
+
+    # 每个地支取一个代表小时，命盘只与小时所属的地支有关
+    hours = sorted({HOUR_TO_EARTHLY_BRANCH[hour]: hour for hour in range(23, -1, -1)}.values())
+
+    charts = set()
+    date = datetime.date(start_year, 1, 1)
+    end = datetime.date(end_year, 12, 31)
+    while date <= end:
+        for hour in hours:
+            chart = BirthChart(date.year, date.month, date.day, hour)
+            charts.add((chart.zodiac, chart.zodiac_sign,
+                        ''.join(element for element in ALL_ELEMENTS if element in chart.five_elements)))
+        date += datetime.timedelta(days=1)
+
+    return sorted(
+        '|'.join((zodiac, zodiac_sign, elements, purpose, religion))
+        for zodiac, zodiac_sign, elements in charts
+        for purpose in purposes
+        for religion in religions
+    )
+
+def write_segment_store(path, contents, total=None):
+    """
+    写入内容库，先写临时文件再替换，读取中的进程继续使用旧文件
+
+    参数:
+        path: 内容库文件路径
+        contents: {分群键: 增强内容}
+        total: 枚举的分群总数，用于计算覆盖率，默认为条目数
+
+    返回:
+        写入的字节数
+    """
+    records = sorted(
+        (segment_hash(key), zlib.compress(json.dumps([key, content], ensure_ascii=False).encode('utf-8'), 9))
+        for key, content in contents.items()
+    )
+    offset = _HEADER.size + _INDEX_ENTRY.size * len(records)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER.pack(SEGMENT_STORE_MAGIC, SEGMENT_STORE_VERSION, len(records),
+                             len(records) if total is None else total))
+        for key_hash, record in records:
+            f.write(_INDEX_ENTRY.pack(key_hash, offset, len(record)))
+            offset += len(record)
+        for _, record in records:
+            f.write(record)
+        size = f.tell()
+    os.replace(temp_path, path)
+    return size
+
+class SegmentStore:
+    """
+    只读的分群增强内容库
+
+    首次查找时才打开文件；之后至多每reload_interval秒检查一次文件的修改时间和大小，
+    文件被替换时重新映射
+    """
+
+    def __init__(self, path=SEGMENT_STORE_PATH, reload_interval=SEGMENT_STORE_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        # (映射, 条目数, 分群总数)，整体替换，读取时不会取到新旧混合的值
+        self._mapping = (None, 0, 0)
+        self._signature = None
+        self._checked_at = None
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'last_error': None
+        }
+
+    def lookup(self, basic_prediction):
+        """
+        获取基本预测结果所属分群的增强内容
+
+        返回:
+            增强内容(新的字典)，未命中时返回None
+        """
+        return self.get(segment_key(basic_prediction))
+
+    def get(self, key):
+        """
+        按分群键获取增强内容
+
+        返回:
+            增强内容(新的字典)，未命中时返回None
+        """
+        if not self.path:
+            return None
+
+        self._refresh()
+        mapped, count, _ = self._mapping
+        content = self._find(mapped, count, key)
+        with self._lock:
+            self._stats['hits' if content is not None else 'misses'] += 1
+        return content
+
+    def stats(self):
+        """
+        获取内容库统计信息
+
+        返回:
+            条目数、分群总数、覆盖率、命中数、未命中数和命中率
+        """
+        if self.path:
+            self._refresh()
+        with self._lock:
+            stats = dict(self._stats)
+        _, count, total = self._mapping
+        lookups = stats['hits'] + stats['misses']
+        stats['path'] = self.path
+        stats['entries'] = count
+        stats['segments'] = total
+        stats['coverage'] = count / total if total else 0.0
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _refresh(self):
+        """首次使用时打开文件，之后按间隔检查文件是否被替换"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+                signature = stat.st_mtime_ns, stat.st_size
+            except OSError:
+                signature = None
+            if signature != self._signature:
+                self._signature = signature
+                self._open()
+
+    def _open(self):
+        """映射内容库文件，文件不存在或格式不符时视为空"""
+        # 旧的映射不关闭，正在读取的线程仍可使用，由垃圾回收释放
+        if self._signature is None:
+            self._mapping = (None, 0, 0)
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count, total = _HEADER.unpack_from(mapped, 0)
+            if magic != SEGMENT_STORE_MAGIC or version != SEGMENT_STORE_VERSION:
+                raise ValueError(f"内容库格式不符: {self.path}")
+            if len(mapped) < _HEADER.size + _INDEX_ENTRY.size * count:
+                raise ValueError(f"内容库文件不完整: {self.path}")
+        except (OSError, ValueError, struct.error) as e:
+            self._mapping = (None, 0, 0)
+            self._stats['last_error'] = str(e)
+            return
+        self._mapping = (mapped, count, total)
+        self._stats['last_error'] = None
+
+    @staticmethod
+    def _find(mapped, count, key):
+        """在索引中二分查找键哈希，逐条核对键以排除哈希冲突"""
+        if mapped is None:
+            return None
+        key_hash = segment_hash(key)
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if _INDEX_ENTRY.unpack_from(mapped, _HEADER.size + _INDEX_ENTRY.size * middle)[0] < key_hash:
+                low = middle + 1
+            else:
+                high = middle
+        while low < count:
+            entry_hash, offset, length = _INDEX_ENTRY.unpack_from(mapped, _HEADER.size + _INDEX_ENTRY.size * low)
+            if entry_hash != key_hash:
+                break
+            record_key, content = json.loads(zlib.decompress(mapped[offset:offset + length]))
+            if record_key == key:
+                return content
+            low += 1
+        return None
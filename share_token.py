@@ -0,0 +1,90 @@
+"""
+手串饰品预测软件 - 分享令牌模块
+用HMAC签名的令牌自身记录预测结果ID和过期时间，创建和解析分享都不需要读写分享记录
+"""
+import base64
+import hashlib
+import hmac
+import struct
+import uuid
+
+# 令牌前缀，用于和旧的UUID分享ID区分
+TOKEN_PREFIX = "s1."
+
+# 签名截断长度(字节)
+SIGNATURE_SIZE = 16
+
+class ShareTokenSigner:
+    """
+    分享令牌签名器
+
+    令牌格式: s1.<base64url(预测结果ID的16字节UUID + 4字节过期时间)>.<base64url(HMAC-SHA256截断)>
+
+    用第一个密钥签名，用全部密钥验证；轮换密钥时把新密钥放在最前，
+    旧密钥保留到用它签发的令牌全部过期后再移除
+    """
+
+    def __init__(self, keys):
+        """
+        参数:
+            keys: 密钥列表，第一个用于签名
+        """
+        self.keys = [key.encode('utf-8') if isinstance(key, str) else key for key in keys if key]
+        if not self.keys:
+            raise ValueError("至少需要一个分享令牌密钥")
+
+    @staticmethod
+    def is_token(share_id):
+        """判断分享ID是否为签名令牌"""
+        return isinstance(share_id, str) and share_id.startswith(TOKEN_PREFIX)
+
+    def sign(self, prediction_id, expire_time):
+        """
+        签发分享令牌
+
+        参数:
+            prediction_id: 预测结果ID，必须是UUID
+            expire_time: 过期时间戳
+
+        返回:
+            分享令牌
+        """
+        payload = uuid.UUID(prediction_id).bytes + struct.pack('>I', int(expire_time))
+        return TOKEN_PREFIX + _encode(payload) + '.' + _encode(self._signature(self.keys[0], payload))
+
+    def verify(self, token):
+        """
+        验证分享令牌
+
+        参数:
+            token: 分享令牌
+
+        返回:
+            (预测结果ID, 过期时间戳)，格式错误或签名无效时返回None；不检查是否过期
+        """
+        if not self.is_token(token):
+            return None
+
+        try:
+            encoded_payload, encoded_signature = token[len(TOKEN_PREFIX):].split('.')
+            payload = _decode(encoded_payload)
+            signature = _decode(encoded_signature)
+        except ValueError:
+            return None
+        if len(payload) != 20:
+            return None
+
+        if not any(hmac.compare_digest(self._signature(key, payload), signature) for key in self.keys):
+            return None
+
+        return str(uuid.UUID(bytes=payload[:16])), struct.unpack('>I', payload[16:])[0]
+
+    @staticmethod
+    def _signature(key, payload):
+        return hmac.new(key, payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
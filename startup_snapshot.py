@@ -0,0 +1,85 @@
+"""
+手串饰品预测软件 - 启动快照模块
+读取预先计算的阴历查找表和手串推荐结果，冷启动时直接加载，不再重新计算
+
+快照由tools/build_startup_snapshot.py生成，每部分一个文件，用到时才读取；
+文件不存在、格式版本不符或生成快照时的模块源码与当前源码不一致时忽略快照，各模块照常计算
+"""
+import functools
+import hashlib
+import os
+import pickle
+
+# 快照文件目录
+STARTUP_SNAPSHOT_DIR = os.environ.get(
+    "STARTUP_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "startup_snapshot"))
+
+# 快照格式版本
+SNAPSHOT_VERSION = 1
+
+# 快照内容依赖的模块源码，任何一个变化都会使快照失效
+SNAPSHOT_SOURCES = ('lunar_solar_converter.py', 'recommendation.py', 'startup_snapshot.py')
+
+@functools.lru_cache(maxsize=None)
+def source_fingerprint():
+    """计算快照依赖的模块源码摘要"""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in SNAPSHOT_SOURCES:
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:32]
+
+def snapshot_path(name, directory=STARTUP_SNAPSHOT_DIR):
+    """快照中某一部分的文件路径"""
+    return os.path.join(directory, f"{name}.pickle")
+
+def get_snapshot_section(name, key=None):
+    """
+    读取快照的一部分
+
+    快照只从部署包内的文件读取，不接受外部输入
+
+    参数:
+        name: 部分名称，如calendar、recommendations
+        key: 该部分的内容还依赖的数据标识(如材质目录的etag)，与生成时不同则视为无效
+
+    返回:
+        快照内容，不存在或无效时返回None
+    """
+    try:
+        with open(snapshot_path(name), 'rb') as f:
+            section = pickle.load(f)
+        if (section.get('version') != SNAPSHOT_VERSION or section.get('sources') != source_fingerprint()
+                or section.get('key') != key):
+            return None
+        return section['data']
+    except Exception:
+        return None
+
+def write_snapshot_section(name, data, key=None, directory=STARTUP_SNAPSHOT_DIR):
+    """
+    写入快照的一部分
+
+    参数:
+        name: 部分名称
+        data: 内容
+        key: 内容依赖的数据标识
+        directory: 快照文件目录
+
+    返回:
+        文件路径
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(name, directory)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        pickle.dump({
+            'version': SNAPSHOT_VERSION,
+            'sources': source_fingerprint(),
+            'key': key,
+            'data': data
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+    return path
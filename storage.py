@@ -3,170 +3,1082 @@
 提供预测结果和分享链接的存储功能
 """
 import os
+import copy
+import hashlib
 import json
+import sqlite3
+import threading
 import time
 import uuid
 import datetime
+from collections import OrderedDict
+from metrics import stage
+from record_format import decode_record, encode_record
+from share_token import ShareTokenSigner
 
 # 存储目录
 STORAGE_DIR = "/tmp/feng_shui_bracelet_storage"
 
-# 确保存储目录存在
-def ensure_storage_dir():
-    """确保存储目录存在"""
-    os.makedirs(STORAGE_DIR, exist_ok=True)
-    os.makedirs(os.path.join(STORAGE_DIR, "predictions"), exist_ok=True)
-    os.makedirs(os.path.join(STORAGE_DIR, "shares"), exist_ok=True)
+# 存储后端：file(每条记录一个JSON文件)或sqlite
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "file")
+SQLITE_PATH = os.environ.get("STORAGE_SQLITE_PATH", os.path.join(STORAGE_DIR, "storage.db"))
+
+# 未被任何有效分享引用的预测结果保留天数
+PREDICTION_RETENTION_DAYS = float(os.environ.get("PREDICTION_RETENTION_DAYS", 30))
+
+# 过期索引按时间分桶的粒度(秒)
+EXPIRY_BUCKET_SECONDS = 3600
+
+# 文件存储按ID哈希前缀分级的子目录层数，每级256个子目录；100万条记录时每个目录约4000个文件。
+# 两级(65536个目录)时每个目录只有十几个文件，写入因目录分散反而明显变慢。
+# 修改后已按旧层数写入的文件将无法找到
+STORAGE_SHARD_LEVELS = 1
+
+# 旧版平铺文件迁移到分级子目录：每次最多移动的文件数和两次之间的间隔(秒)
+STORAGE_MIGRATE_BATCH_SIZE = int(os.environ.get("STORAGE_MIGRATE_BATCH_SIZE", 1000))
+STORAGE_MIGRATE_INTERVAL = float(os.environ.get("STORAGE_MIGRATE_INTERVAL", 1))
+
+# 后台清理的间隔(秒)和每次最多处理的记录数
+SWEEP_INTERVAL = float(os.environ.get("STORAGE_SWEEP_INTERVAL", 60))
+SWEEP_BATCH_SIZE = int(os.environ.get("STORAGE_SWEEP_BATCH_SIZE", 1000))
+
+# 分享令牌密钥，逗号分隔，第一个用于签名；设置后新建的分享为签名令牌，不写分享记录
+SHARE_TOKEN_KEYS = [key.strip() for key in os.environ.get("SHARE_TOKEN_KEYS", "").split(',') if key.strip()]
+
+# 进程内读缓存：有效期(秒，为0时禁用)、最多条目数和大致内存上限(字节)
+STORAGE_CACHE_TTL = float(os.environ.get("STORAGE_CACHE_TTL", 300))
+STORAGE_CACHE_MAX_ENTRIES = int(os.environ.get("STORAGE_CACHE_MAX_ENTRIES", 1024))
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get("STORAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+class StorageBackend:
+    """存储后端接口"""
+
+    def save_prediction(self, prediction):
+        """保存预测结果，返回预测结果ID"""
+        raise NotImplementedError
+
+    def get_prediction(self, prediction_id):
+        """获取预测结果，如果不存在则返回None"""
+        raise NotImplementedError
+
+    def save_share(self, prediction_id, expire_days=7):
+        """保存分享链接，返回分享ID"""
+        raise NotImplementedError
+
+    def get_share(self, share_id):
+        """获取分享信息(prediction_id、expire_time、created_time)，不检查是否过期，不存在则返回None"""
+        raise NotImplementedError
+
+    def get_prediction_by_share(self, share_id):
+        """获取分享的预测结果，如果不存在或已过期则返回None"""
+        share_info = self.get_share(share_id)
+        if share_info is None or time.time() > share_info.get('expire_time', 0):
+            return None
+
+        prediction_id = share_info.get('prediction_id')
+        if not prediction_id:
+            return None
+
+        return self.get_prediction(prediction_id)
+
+    def cleanup_expired_shares(self):
+        """清理过期的分享"""
+        while True:
+            removed = self.sweep(SWEEP_BATCH_SIZE)
+            if removed['processed'] < SWEEP_BATCH_SIZE:
+                break
+
+    def sweep(self, max_items):
+        """
+        增量清理过期的分享，以及不再被有效分享引用且超过保留期的预测结果
+
+        参数:
+            max_items: 本次最多处理的记录数
+
+        返回:
+            {'shares': 删除的分享数, 'predictions': 删除的预测结果数, 'processed': 处理的记录数}，
+            processed包括记录已不存在或不需删除的过期条目，小于max_items时表示没有积压
+        """
+        raise NotImplementedError
+
+    def migrate_layout(self, max_items):
+        """把旧版存储布局中的记录分批迁移到当前布局，返回本次处理的记录数，为0表示已完成"""
+        return 0
+
+class FileStorage(StorageBackend):
+    """
+    每条预测结果和分享各存为一个文件：预测结果按record_format编码(旧版的缩进JSON仍可读取)，分享为JSON
+
+    文件按ID哈希的前缀分级存放在子目录中(如predictions/3f/<ID>.json)，每个目录中的文件数保持较少；
+    写入先写同目录的临时文件再重命名，读取方不会读到写了一半的文件。
+    旧版平铺在predictions/、shares/、refs/下的文件仍可读取，由migrate_layout分批移入子目录
+
+    过期索引：expiry/<时间桶>/下为每个待过期的分享或预测结果放一个空标记文件，
+    时间桶按过期时间划分，清理时只需遍历已整体过期的桶，代价与过期记录数成正比；
+    refs/<预测结果ID>记录引用该预测结果的分享中最晚的过期时间
+    """
+
+    # 按ID分级存放的记录类型及文件后缀
+    RECORD_KINDS = {'predictions': '.json', 'shares': '.json', 'refs': ''}
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def ensure_storage_dir(self):
+        """确保存储目录存在"""
+        os.makedirs(self.directory, exist_ok=True)
+        os.makedirs(os.path.join(self.directory, "predictions"), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, "shares"), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, "expiry"), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, "refs"), exist_ok=True)
+
+    def record_path(self, kind, record_id):
+        """记录在分级子目录中的路径，每级为ID哈希的两个十六进制字符"""
+        digest = hashlib.blake2b(record_id.encode('utf-8'), digest_size=STORAGE_SHARD_LEVELS).hexdigest()
+        shards = [digest[level * 2:level * 2 + 2] for level in range(STORAGE_SHARD_LEVELS)]
+        return os.path.join(self.directory, kind, *shards, record_id + self.RECORD_KINDS[kind])
+
+    def legacy_path(self, kind, record_id):
+        """记录在旧版平铺布局中的路径"""
+        return os.path.join(self.directory, kind, record_id + self.RECORD_KINDS[kind])
+
+    def candidate_paths(self, kind, record_id):
+        """
+        读取记录时依次尝试的路径
+
+        先查分级子目录，再查旧版平铺路径；迁移可能恰好在两次检查之间移动了文件，所以最后再查一次子目录
+        """
+        path = self.record_path(kind, record_id)
+        return path, self.legacy_path(kind, record_id), path
+
+    def read_record(self, kind, record_id, binary=False):
+        """读取记录文件的内容(binary为True时为字节)，不存在时返回None"""
+        for path in self.candidate_paths(kind, record_id):
+            try:
+                with open(path, 'rb') if binary else open(path, 'r', encoding='utf-8') as f:
+                    return f.read()
+            except FileNotFoundError:
+                continue
+        return None
+
+    def find_record(self, kind, record_id):
+        """获取记录文件的路径，不存在时返回None"""
+        for path in self.candidate_paths(kind, record_id):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def write_record(self, kind, record_id, content):
+        """先写同目录的临时文件再重命名，替换已有的记录；content为文本或字节"""
+        path = self.record_path(kind, record_id)
+        directory, name = os.path.split(path)
+        # 临时文件以.开头，遍历和迁移时跳过
+        temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        mode, encoding = ('wb', None) if isinstance(content, bytes) else ('w', 'utf-8')
+        try:
+            f = open(temp_path, mode, encoding=encoding)
+        except FileNotFoundError:
+            os.makedirs(directory, exist_ok=True)
+            f = open(temp_path, mode, encoding=encoding)
+        try:
+            with f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove_file(temp_path)
+            raise
+
+    def remove_record(self, kind, record_id):
+        """删除记录(新旧两种布局中的文件)，返回是否删除了文件"""
+        removed = self._remove_file(self.record_path(kind, record_id))
+        return self._remove_file(self.legacy_path(kind, record_id)) or removed
+
+    def iter_records(self, kind):
+        """
+        遍历某类记录，包括旧版平铺的文件和分级子目录中的文件
+
+        返回:
+            生成器，产生(记录ID, os.DirEntry)
+        """
+        suffix = self.RECORD_KINDS[kind]
+
+        def walk(directory, level):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if level < STORAGE_SHARD_LEVELS:
+                            yield from walk(entry.path, level + 1)
+                    elif entry.name.endswith(suffix) and level in (0, STORAGE_SHARD_LEVELS):
+                        yield entry.name[:len(entry.name) - len(suffix)], entry
+
+        return walk(os.path.join(self.directory, kind), 0)
+
+    def migrate_layout(self, max_items):
+        """
+        把旧版平铺的文件分批移入分级子目录
+
+        先建硬链接再删除旧文件，移动过程中记录始终至少在一处可读；
+        子目录中已有同名文件时说明已按新布局重新写过，不覆盖，直接删除旧文件
+
+        参数:
+            max_items: 本次最多处理的文件数
+
+        返回:
+            本次处理的旧版文件数，为0表示迁移已完成
+        """
+        self.ensure_storage_dir()
+        migrated = 0
+        for kind, suffix in self.RECORD_KINDS.items():
+            names = []
+            with os.scandir(os.path.join(self.directory, kind)) as entries:
+                for entry in entries:
+                    if len(names) >= max_items - migrated:
+                        break
+                    if (not entry.name.startswith('.') and entry.name.endswith(suffix)
+                            and entry.is_file(follow_symlinks=False)):
+                        names.append(entry.name)
+
+            for name in names:
+                self._migrate_record(kind, name[:len(name) - len(suffix)])
+            migrated += len(names)
+            if migrated >= max_items:
+                break
+        return migrated
+
+    def _migrate_record(self, kind, record_id):
+        legacy = self.legacy_path(kind, record_id)
+        path = self.record_path(kind, record_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(legacy, path)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            return
+        except OSError:
+            # 不支持硬链接的文件系统直接重命名
+            if not os.path.exists(path):
+                os.replace(legacy, path)
+                return
+        self._remove_file(legacy)
+
+    def save_prediction(self, prediction):
+        self.ensure_storage_dir()
+
+        # 生成唯一ID
+        prediction_id = str(uuid.uuid4())
+
+        # 添加时间戳
+        prediction['timestamp'] = time.time()
+
+        # 保存预测结果
+        self.write_record('predictions', prediction_id, encode_record(prediction))
+
+        # 超过保留期且未被分享引用时清理
+        self.add_expiry_marker('prediction', prediction_id,
+                               prediction['timestamp'] + PREDICTION_RETENTION_DAYS * 24 * 60 * 60)
+
+        return prediction_id
+
+    def get_prediction(self, prediction_id):
+        self.ensure_storage_dir()
+
+        # 读取预测结果
+        try:
+            content = self.read_record('predictions', prediction_id, binary=True)
+            return None if content is None else decode_record(content)
+        except Exception:
+            return None
+
+    def save_share(self, prediction_id, expire_days=7):
+        self.ensure_storage_dir()
+
+        # 生成唯一ID
+        share_id = str(uuid.uuid4())
+
+        # 计算过期时间
+        expire_time = time.time() + expire_days * 24 * 60 * 60
+
+        # 保存分享信息
+        share_info = {
+            'prediction_id': prediction_id,
+            'expire_time': expire_time,
+            'created_time': time.time()
+        }
+
+        self.write_record('shares', share_id, json.dumps(share_info, ensure_ascii=False, indent=2))
+
+        # 分享过期时清理分享，并重新检查预测结果是否仍被引用
+        self.add_expiry_marker('share', share_id, expire_time)
+        self.extend_prediction_reference(prediction_id, expire_time)
+        self.add_expiry_marker('prediction', prediction_id, expire_time)
+
+        return share_id
+
+    def get_share(self, share_id):
+        self.ensure_storage_dir()
+
+        # 读取分享信息
+        try:
+            content = self.read_record('shares', share_id)
+            return None if content is None else json.loads(content)
+        except Exception:
+            return None
+
+    def add_expiry_marker(self, kind, record_id, expire_time):
+        """在过期时间对应的时间桶中登记一条记录"""
+        bucket = str(int(expire_time // EXPIRY_BUCKET_SECONDS))
+        bucket_dir = os.path.join(self.directory, "expiry", bucket)
+        os.makedirs(bucket_dir, exist_ok=True)
+        with open(os.path.join(bucket_dir, f"{kind}.{record_id}"), 'w'):
+            pass
+
+    def extend_prediction_reference(self, prediction_id, expire_time):
+        """记录引用该预测结果的分享中最晚的过期时间"""
+        if self.get_prediction_reference(prediction_id) < expire_time:
+            self.write_record('refs', prediction_id, repr(expire_time))
+
+    def get_prediction_reference(self, prediction_id):
+        """获取引用该预测结果的分享中最晚的过期时间，没有引用时返回0"""
+        try:
+            return float(self.read_record('refs', prediction_id))
+        except Exception:
+            return 0
+
+    def sweep(self, max_items):
+        self.ensure_storage_dir()
+        if not os.path.exists(os.path.join(self.directory, "expiry", ".indexed")):
+            self.rebuild_expiry_index()
+
+        removed = {'shares': 0, 'predictions': 0, 'processed': 0}
+        budget = max_items
+        now = time.time()
+        expiry_dir = os.path.join(self.directory, "expiry")
+
+        # 只处理整体已过期的时间桶
+        buckets = sorted(int(name) for name in os.listdir(expiry_dir) if name.isdigit())
+        for bucket in buckets:
+            if (bucket + 1) * EXPIRY_BUCKET_SECONDS > now or budget <= 0:
+                break
+
+            bucket_dir = os.path.join(expiry_dir, str(bucket))
+            with os.scandir(bucket_dir) as entries:
+                markers = [entry.name for entry in entries]
+            for marker in markers[:budget]:
+                kind, _, record_id = marker.partition('.')
+                if kind == 'share':
+                    if self.remove_record('shares', record_id):
+                        removed['shares'] += 1
+                elif kind == 'prediction':
+                    if self._remove_unreferenced_prediction(record_id, now):
+                        removed['predictions'] += 1
+                self._remove_file(os.path.join(bucket_dir, marker))
+            removed['processed'] += min(len(markers), budget)
+            budget -= min(len(markers), budget)
+
+            try:
+                os.rmdir(bucket_dir)
+            except OSError:
+                pass
+
+        return removed
+
+    def rebuild_expiry_index(self):
+        """为建立过期索引之前保存的分享和预测结果补登索引，只需执行一次"""
+        self.ensure_storage_dir()
+        retention = PREDICTION_RETENTION_DAYS * 24 * 60 * 60
+
+        for prediction_id, entry in self.iter_records('predictions'):
+            self.add_expiry_marker('prediction', prediction_id, entry.stat().st_mtime + retention)
+
+        for share_id, entry in self.iter_records('shares'):
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    share_info = json.load(f)
+                expire_time = share_info.get('expire_time', 0)
+                prediction_id = share_info.get('prediction_id')
+            except Exception:
+                expire_time, prediction_id = 0, None
+
+            self.add_expiry_marker('share', share_id, expire_time)
+            if prediction_id:
+                self.extend_prediction_reference(prediction_id, expire_time)
+                self.add_expiry_marker('prediction', prediction_id, expire_time)
+
+        with open(os.path.join(self.directory, "expiry", ".indexed"), 'w'):
+            pass
+
+    def _remove_unreferenced_prediction(self, prediction_id, now):
+        """预测结果仍被有效分享引用或未超过保留期时保留"""
+        if self.get_prediction_reference(prediction_id) >= now:
+            return False
+
+        prediction_file = self.find_record('predictions', prediction_id)
+        try:
+            created_time = os.path.getmtime(prediction_file)
+        except (OSError, TypeError):
+            return False
+        if created_time + PREDICTION_RETENTION_DAYS * 24 * 60 * 60 > now:
+            return False
+
+        self.remove_record('refs', prediction_id)
+        return self.remove_record('predictions', prediction_id)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+class SQLiteStorage(StorageBackend):
+    """
+    SQLite存储(WAL模式)
+
+    每个线程使用各自的连接，SQL语句固定并参数化，由sqlite3的语句缓存复用；
+    分享表按过期时间建索引，清理时无需全表扫描；预测结果按record_format编码存为BLOB，旧版的JSON文本仍可读取
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS predictions ("
+        " id TEXT PRIMARY KEY,"
+        " data TEXT NOT NULL,"
+        " timestamp REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS shares ("
+        " id TEXT PRIMARY KEY,"
+        " prediction_id TEXT NOT NULL,"
+        " expire_time REAL NOT NULL,"
+        " created_time REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_shares_expire_time ON shares (expire_time)",
+        "CREATE INDEX IF NOT EXISTS idx_shares_prediction_id ON shares (prediction_id)",
+        "CREATE INDEX IF NOT EXISTS idx_predictions_timestamp ON predictions (timestamp)"
+    )
+
+    INSERT_PREDICTION = "INSERT OR REPLACE INTO predictions (id, data, timestamp) VALUES (?, ?, ?)"
+    SELECT_PREDICTION = "SELECT data FROM predictions WHERE id = ?"
+    INSERT_SHARE = "INSERT OR REPLACE INTO shares (id, prediction_id, expire_time, created_time) VALUES (?, ?, ?, ?)"
+    SELECT_SHARE = "SELECT prediction_id, expire_time, created_time FROM shares WHERE id = ?"
+    SELECT_PREDICTION_BY_SHARE = (
+        "SELECT p.data FROM shares s JOIN predictions p ON p.id = s.prediction_id"
+        " WHERE s.id = ? AND s.expire_time >= ?"
+    )
+    DELETE_EXPIRED_SHARES = (
+        "DELETE FROM shares WHERE id IN"
+        " (SELECT id FROM shares WHERE expire_time < ? LIMIT ?)"
+    )
+    DELETE_UNREFERENCED_PREDICTIONS = (
+        "DELETE FROM predictions WHERE id IN"
+        " (SELECT p.id FROM predictions p WHERE p.timestamp < ? AND NOT EXISTS"
+        " (SELECT 1 FROM shares s WHERE s.prediction_id = p.id AND s.expire_time >= ?) LIMIT ?)"
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def connection(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for statement in self.SCHEMA:
+                        conn.execute(statement)
+                    self._schema_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def save_prediction(self, prediction):
+        prediction_id = str(uuid.uuid4())
+        prediction['timestamp'] = time.time()
+        self.connection().execute(
+            self.INSERT_PREDICTION,
+            (prediction_id, encode_record(prediction), prediction['timestamp'])
+        )
+        return prediction_id
+
+    def get_prediction(self, prediction_id):
+        row = self.connection().execute(self.SELECT_PREDICTION, (prediction_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            return decode_record(row[0])
+        except Exception:
+            return None
+
+    def save_share(self, prediction_id, expire_days=7):
+        share_id = str(uuid.uuid4())
+        created_time = time.time()
+        expire_time = created_time + expire_days * 24 * 60 * 60
+        self.connection().execute(self.INSERT_SHARE, (share_id, prediction_id, expire_time, created_time))
+        return share_id
+
+    def get_share(self, share_id):
+        row = self.connection().execute(self.SELECT_SHARE, (share_id,)).fetchone()
+        if row is None:
+            return None
+        return {'prediction_id': row[0], 'expire_time': row[1], 'created_time': row[2]}
+
+    def get_prediction_by_share(self, share_id):
+        row = self.connection().execute(self.SELECT_PREDICTION_BY_SHARE, (share_id, time.time())).fetchone()
+        if row is None:
+            return None
+        try:
+            return decode_record(row[0])
+        except Exception:
+            return None
+
+    def sweep(self, max_items):
+        conn = self.connection()
+        now = time.time()
+        shares = conn.execute(self.DELETE_EXPIRED_SHARES, (now, max_items)).rowcount
+        predictions = conn.execute(self.DELETE_UNREFERENCED_PREDICTIONS, (
+            now - PREDICTION_RETENTION_DAYS * 24 * 60 * 60, now, max(max_items - shares, 0)
+        )).rowcount
+        return {'shares': shares, 'predictions': predictions, 'processed': shares + predictions}
+
+    def import_records(self, predictions, shares):
+        """
+        批量导入记录，用于从其他存储迁移
+
+        参数:
+            predictions: (预测结果ID, 预测结果)的可迭代对象
+            shares: (分享ID, 分享信息)的可迭代对象
+        """
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(self.INSERT_PREDICTION, (
+                (prediction_id, encode_record(prediction), prediction.get('timestamp', 0))
+                for prediction_id, prediction in predictions
+            ))
+            conn.executemany(self.INSERT_SHARE, (
+                (share_id, info['prediction_id'], info.get('expire_time', 0), info.get('created_time', 0))
+                for share_id, info in shares
+            ))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+class ReadCache:
+    """
+    有TTL和容量上限的进程内LRU读缓存
+
+    同一个键并发未命中时只有一个线程执行加载，其他线程等待同一个结果；
+    None表示记录不存在，不缓存。内存占用按值序列化为JSON后的字节数估算
+    """
+
+    def __init__(self, ttl=STORAGE_CACHE_TTL, max_entries=STORAGE_CACHE_MAX_ENTRIES,
+                 max_bytes=STORAGE_CACHE_MAX_BYTES):
+        """
+        参数:
+            ttl: 缓存有效期(秒)，为0时禁用缓存
+            max_entries: 最多缓存的条目数
+            max_bytes: 缓存值的大致总字节数上限
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0
+        }
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get_or_load(self, key, loader, expire_time=None):
+        """
+        获取缓存的值，未命中时调用loader加载并缓存
+
+        参数:
+            key: 缓存键
+            loader: 无参数的加载函数，返回None表示不存在
+            expire_time: 根据加载结果计算额外过期时间的函数，缓存有效期取其与TTL中较早者
+
+        返回:
+            值的副本，不存在时返回None
+        """
+        if not self.enabled:
+            return loader()
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['expire_time'] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return copy.deepcopy(entry['value'])
+                self._remove_locked(key)
+                self._stats['expirations'] += 1
+
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = {'event': threading.Event(), 'value': None, 'error': None}
+                self._loading[key] = loading
+                self._stats['misses'] += 1
+                leader = True
+            else:
+                self._stats['coalesced'] += 1
+                leader = False
+
+        if not leader:
+            loading['event'].wait()
+            if loading['error'] is not None:
+                raise loading['error']
+            return copy.deepcopy(loading['value'])
+
+        try:
+            value = loader()
+            loading['value'] = value
+            if value is not None:
+                entry_expire_time = now + self.ttl
+                if expire_time is not None:
+                    entry_expire_time = min(entry_expire_time, expire_time(value))
+                if entry_expire_time > now:
+                    self._store(key, value, entry_expire_time, loading)
+            return copy.deepcopy(value)
+        except Exception as e:
+            loading['error'] = e
+            raise
+        finally:
+            with self._lock:
+                if self._loading.get(key) is loading:
+                    del self._loading[key]
+            loading['event'].set()
+
+    def invalidate(self, key):
+        """使一个键的缓存失效，正在进行的加载结果也不再写入缓存"""
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+            self._loading.pop(key, None)
+            self._stats['invalidations'] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._loading.clear()
+            self._bytes = 0
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        """
+        获取缓存统计信息
+
+        返回:
+            命中数、未命中数、合并的并发加载数、命中率、条目数和估算的内存占用
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+        stats['hit_rate'] = round((stats['hits'] + stats['coalesced']) / lookups, 4) if lookups else 0.0
+        stats['ttl'] = self.ttl
+        stats['max_entries'] = self.max_entries
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+    def _store(self, key, value, expire_time, loading):
+        size = len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            # 加载期间被失效的结果不写入
+            if self._loading.get(key) is not loading:
+                return
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = {'value': value, 'expire_time': expire_time, 'size': size}
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove_locked(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+
+class CachedStorage(StorageBackend):
+    """
+    为存储后端加上进程内读缓存
+
+    分享信息按分享的过期时间和TTL中较早者缓存，预测结果按TTL缓存；
+    本进程的写入和清理会使对应缓存失效。预测结果和分享写入后不会修改，
+    其他进程删除记录时本进程最多在TTL内仍能读到
+    """
+
+    def __init__(self, backend, ttl=STORAGE_CACHE_TTL, max_entries=STORAGE_CACHE_MAX_ENTRIES,
+                 max_bytes=STORAGE_CACHE_MAX_BYTES):
+        self.backend = backend
+        self.predictions = ReadCache(ttl, max_entries, max_bytes)
+        self.shares = ReadCache(ttl, max_entries, max_bytes)
+
+    def __getattr__(self, name):
+        # 其他方法(如import_records)直接交给后端
+        return getattr(self.backend, name)
+
+    def save_prediction(self, prediction):
+        prediction_id = self.backend.save_prediction(prediction)
+        self.predictions.invalidate(prediction_id)
+        return prediction_id
+
+    def get_prediction(self, prediction_id):
+        return self.predictions.get_or_load(prediction_id, lambda: self.backend.get_prediction(prediction_id))
+
+    def save_share(self, prediction_id, expire_days=7):
+        share_id = self.backend.save_share(prediction_id, expire_days)
+        self.shares.invalidate(share_id)
+        return share_id
+
+    def get_share(self, share_id):
+        return self.shares.get_or_load(
+            share_id, lambda: self.backend.get_share(share_id),
+            expire_time=lambda share_info: share_info.get('expire_time', 0)
+        )
+
+    def sweep(self, max_items):
+        removed = self.backend.sweep(max_items)
+        # 清理不返回具体ID，删除了预测结果时整体失效
+        if removed['predictions']:
+            self.predictions.clear()
+        return removed
+
+    def migrate_layout(self, max_items):
+        # 迁移只移动文件，记录内容不变，缓存无需失效
+        return self.backend.migrate_layout(max_items)
+
+    def stats(self):
+        """获取分享和预测结果读缓存的统计信息"""
+        return {
+            'shares': self.shares.stats(),
+            'predictions': self.predictions.stats()
+        }
+
+class ExpirySweeper:
+    """
+    后台定期清理过期记录
+
+    每次最多处理batch_size条记录，避免长时间占用磁盘和数据库；
+    记录每次清理的耗时和删除数量
+    """
+
+    def __init__(self, backend, interval=SWEEP_INTERVAL, batch_size=SWEEP_BATCH_SIZE):
+        self.backend = backend
+        self.interval = interval
+        self.batch_size = batch_size
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'ticks': 0,
+            'errors': 0,
+            'shares_removed': 0,
+            'predictions_removed': 0,
+            'last_tick': None
+        }
+
+    def start(self):
+        """启动后台清理线程，每个进程只启动一次"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name="storage-expiry-sweeper", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def tick(self):
+        """执行一次清理"""
+        start = time.perf_counter()
+        try:
+            removed = self.backend.sweep(self.batch_size)
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+                self._stats['last_error'] = str(e)
+            return None
+
+        tick = {
+            'time': time.time(),
+            'duration': round(time.perf_counter() - start, 6),
+            'shares_removed': removed['shares'],
+            'predictions_removed': removed['predictions'],
+            'processed': removed['processed']
+        }
+        with self._lock:
+            self._stats['ticks'] += 1
+            self._stats['shares_removed'] += removed['shares']
+            self._stats['predictions_removed'] += removed['predictions']
+            self._stats['last_tick'] = tick
+        return tick
+
+    def stats(self):
+        """获取清理统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['interval'] = self.interval
+        stats['batch_size'] = self.batch_size
+        stats['running'] = self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+        return stats
+
+    def _run(self):
+        while True:
+            tick = self.tick()
+            # 本次处理满额说明还有积压，立即继续；失效的过期标记也计入处理数
+            if tick is None or tick['processed'] < self.batch_size:
+                time.sleep(self.interval)
+
+class LayoutMigrator:
+    """
+    后台把旧版存储布局中的记录分批迁移到当前布局
+
+    每次最多处理batch_size条，两次之间间隔interval秒，避免与请求争用磁盘；
+    迁移完成后线程退出
+    """
+
+    def __init__(self, backend, interval=STORAGE_MIGRATE_INTERVAL, batch_size=STORAGE_MIGRATE_BATCH_SIZE):
+        self.backend = backend
+        self.interval = interval
+        self.batch_size = batch_size
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'ticks': 0,
+            'errors': 0,
+            'migrated': 0,
+            'completed': False,
+            'last_tick': None
+        }
+
+    def start(self):
+        """启动后台迁移线程，每个进程只启动一次"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name="storage-layout-migrator", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def tick(self):
+        """执行一次迁移，返回本次处理的记录数，出错时返回None"""
+        start = time.perf_counter()
+        try:
+            migrated = self.backend.migrate_layout(self.batch_size)
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+                self._stats['last_error'] = str(e)
+            return None
+
+        with self._lock:
+            self._stats['ticks'] += 1
+            self._stats['migrated'] += migrated
+            self._stats['completed'] = migrated == 0
+            self._stats['last_tick'] = {
+                'time': time.time(),
+                'duration': round(time.perf_counter() - start, 6),
+                'migrated': migrated
+            }
+        return migrated
+
+    def stats(self):
+        """获取迁移统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['interval'] = self.interval
+        stats['batch_size'] = self.batch_size
+        stats['running'] = self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+        return stats
+
+    def _run(self):
+        while self.tick() != 0:
+            time.sleep(self.interval)
+
+def create_storage(backend=STORAGE_BACKEND):
+    """
+    根据配置创建存储后端
+
+    参数:
+        backend: 存储后端名称，file或sqlite
+
+    返回:
+        StorageBackend对象
+    """
+    if backend == 'file':
+        return FileStorage(STORAGE_DIR)
+    if backend == 'sqlite':
+        return SQLiteStorage(SQLITE_PATH)
+    raise ValueError(f"不支持的存储后端: {backend}")
+
+# 当前使用的存储后端
+storage = CachedStorage(create_storage())
+
+# 分享令牌签名器，未配置密钥时为None
+share_signer = ShareTokenSigner(SHARE_TOKEN_KEYS) if SHARE_TOKEN_KEYS else None
+
+# 当前存储后端的过期清理器
+sweeper = ExpirySweeper(storage)
+
+# 当前存储后端的布局迁移器
+migrator = LayoutMigrator(storage)
 
 # 保存预测结果
 def save_prediction(prediction):
     """
     保存预测结果
-    
+
     参数:
         prediction: 预测结果
-        
+
     返回:
         预测结果ID
     """
-    ensure_storage_dir()
-    
-    # 生成唯一ID
-    prediction_id = str(uuid.uuid4())
-    
-    # 添加时间戳
-    prediction['timestamp'] = time.time()
-    
-    # 保存预测结果
-    prediction_file = os.path.join(STORAGE_DIR, "predictions", f"{prediction_id}.json")
-    with open(prediction_file, 'w', encoding='utf-8') as f:
-        json.dump(prediction, f, ensure_ascii=False, indent=2)
-    
-    return prediction_id
+    with stage('storage_save_prediction'):
+        return storage.save_prediction(prediction)
 
 # 获取预测结果
 def get_prediction(prediction_id):
     """
     获取预测结果
-    
+
     参数:
         prediction_id: 预测结果ID
-        
+
     返回:
         预测结果，如果不存在则返回None
     """
-    ensure_storage_dir()
-    
-    # 检查预测结果是否存在
-    prediction_file = os.path.join(STORAGE_DIR, "predictions", f"{prediction_id}.json")
-    if not os.path.exists(prediction_file):
-        return None
-    
-    # 读取预测结果
-    try:
-        with open(prediction_file, 'r', encoding='utf-8') as f:
-            prediction = json.load(f)
-        return prediction
-    except Exception:
-        return None
+    with stage('storage_get_prediction'):
+        return storage.get_prediction(prediction_id)
 
 # 保存分享链接
 def save_share(prediction_id, expire_days=7):
     """
     保存分享链接
-    
+
     参数:
         prediction_id: 预测结果ID
         expire_days: 过期天数
-        
+
     返回:
-        分享ID
-    """
-    ensure_storage_dir()
-    
-    # 生成唯一ID
-    share_id = str(uuid.uuid4())
-    
-    # 计算过期时间
-    expire_time = time.time() + expire_days * 24 * 60 * 60
-    
-    # 保存分享信息
-    share_info = {
-        'prediction_id': prediction_id,
-        'expire_time': expire_time,
-        'created_time': time.time()
-    }
-    
-    share_file = os.path.join(STORAGE_DIR, "shares", f"{share_id}.json")
-    with open(share_file, 'w', encoding='utf-8') as f:
-        json.dump(share_info, f, ensure_ascii=False, indent=2)
-    
-    return share_id
+        分享ID，配置了分享令牌密钥时为签名令牌
+    """
+    with stage('storage_save_share'):
+        return _save_share(prediction_id, expire_days)
+
+def _save_share(prediction_id, expire_days):
+    if share_signer is not None:
+        try:
+            uuid.UUID(prediction_id)
+        except (TypeError, ValueError, AttributeError):
+            return storage.save_share(prediction_id, expire_days)
+
+        expire_time = time.time() + expire_days * 24 * 60 * 60
+
+        # 令牌不登记到过期索引，有效期不超过预测结果的保留期，避免指向已清理的记录
+        prediction = storage.get_prediction(prediction_id)
+        if prediction is not None and 'timestamp' in prediction:
+            expire_time = min(expire_time, prediction['timestamp'] + PREDICTION_RETENTION_DAYS * 24 * 60 * 60)
+
+        return share_signer.sign(prediction_id, expire_time)
+
+    return storage.save_share(prediction_id, expire_days)
 
 # 获取分享的预测结果
 def get_prediction_by_share(share_id):
     """
     获取分享的预测结果
-    
+
     参数:
         share_id: 分享ID
-        
+
     返回:
         预测结果，如果不存在或已过期则返回None
     """
-    ensure_storage_dir()
-    
-    # 检查分享是否存在
-    share_file = os.path.join(STORAGE_DIR, "shares", f"{share_id}.json")
-    if not os.path.exists(share_file):
-        return None
-    
-    # 读取分享信息
-    try:
-        with open(share_file, 'r', encoding='utf-8') as f:
-            share_info = json.load(f)
-        
-        # 检查是否过期
-        if time.time() > share_info.get('expire_time', 0):
+    with stage('storage_get_share'):
+        return _get_prediction_by_share(share_id)
+
+def _get_prediction_by_share(share_id):
+    if ShareTokenSigner.is_token(share_id):
+        if share_signer is None:
             return None
-        
-        # 获取预测结果
-        prediction_id = share_info.get('prediction_id')
-        if not prediction_id:
+        verified = share_signer.verify(share_id)
+        if verified is None:
             return None
-        
-        return get_prediction(prediction_id)
-    except Exception:
-        return None
+        prediction_id, expire_time = verified
+        if time.time() > expire_time:
+            return None
+        return storage.get_prediction(prediction_id)
+
+    return storage.get_prediction_by_share(share_id)
 
 # 清理过期的分享
 def cleanup_expired_shares():
     """清理过期的分享"""
-    ensure_storage_dir()
-    
-    # 获取所有分享文件
-    shares_dir = os.path.join(STORAGE_DIR, "shares")
-    share_files = os.listdir(shares_dir)
-    
-    # 当前时间
-    current_time = time.time()
-    
-    # 检查每个分享是否过期
-    for share_file in share_files:
-        if not share_file.endswith('.json'):
-            continue
-        
-        share_path = os.path.join(shares_dir, share_file)
-        try:
-            with open(share_path, 'r', encoding='utf-8') as f:
-                share_info = json.load(f)
-            
-            # 如果过期，删除文件
-            if current_time > share_info.get('expire_time', 0):
-                os.remove(share_path)
-        except Exception:
-            # 如果读取出错，也删除文件
-            try:
-                os.remove(share_path)
-            except Exception:
-                pass
+    storage.cleanup_expired_shares()
+
+# 启动后台清理
+def start_expiry_sweeper():
+    """在当前进程启动后台过期清理"""
+    sweeper.start()
+
+# 启动后台布局迁移
+def start_layout_migrator():
+    """在当前进程启动后台布局迁移，旧版文件迁移完成后自动结束"""
+    migrator.start()
+
+# 获取迁移统计
+def get_migrator_stats():
+    """
+    获取后台布局迁移的统计信息
+
+    返回:
+        已迁移的记录数、是否已完成以及最近一次迁移的耗时和数量
+    """
+    return migrator.stats()
+
+# 获取清理统计
+def get_sweeper_stats():
+    """
+    获取后台过期清理的统计信息
+
+    返回:
+        清理次数、删除的记录数以及最近一次清理的耗时和删除数量
+    """
+    return sweeper.stats()
+
+# 获取读缓存统计
+def get_storage_cache_stats():
+    """
+    获取分享和预测结果读缓存的统计信息
+
+    返回:
+        分享和预测结果缓存各自的命中率、条目数和估算的内存占用
+    """
+    return storage.stats()
@@ -0,0 +1,128 @@
+"""
+手串饰品预测软件 - 命盘计算校验与基准测试
+随机生成出生信息，逐条比对BirthChart与原先逐项换算的结果，
+并比较每次生成基本预测所需命盘数据的CPU耗时(原实现、首次计算、缓存命中)
+
+用法:
+    python tools/bench_birth_chart.py [记录数]
+"""
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import get_catalog
+from lunar_solar_converter import (
+    BirthChart, get_birth_chart, solar_to_lunar, lunar_to_solar, get_zodiac_sign, get_hour_ganzhi,
+    is_valid_lunar_date, HEAVENLY_STEMS, EARTHLY_BRANCHES, MONTH_BOUNDARIES, GANZHI_BASE_DATE,
+    ELEMENT_LUCKY_COLORS, BIRTH_CHART_CACHE_SIZE
+)
+
+def legacy_eight_characters(year, month, day, hour=12, is_lunar=False):
+    """原get_eight_characters：阴历日期单独换算阳历，时柱重新计算日天干"""
+    if is_lunar:
+        solar_date = lunar_to_solar(year, month, day)['solar_date']
+    else:
+        solar_date = datetime.date(year, month, day)
+
+    year_offset = -1 if solar_date.month == 1 or (solar_date.month == 2 and solar_date.day < 4) else 0
+    year_stem_index = (solar_date.year + year_offset - 4) % 10
+    year_branch_index = (solar_date.year + year_offset - 4) % 12
+
+    month_offset = -1 if solar_date.day < MONTH_BOUNDARIES[solar_date.month] else 0
+    month_index = (solar_date.month + month_offset - 1) % 12
+    if month_index <= 0:
+        month_index += 12
+    month_stem_index = (year_stem_index % 5 * 2 + month_index + 1) % 10
+    month_branch_index = (month_index + 1) % 12
+
+    days_diff = (solar_date - GANZHI_BASE_DATE).days
+    day_stem_index = (days_diff + 10) % 10
+    day_branch_index = (days_diff + 12) % 12
+
+    return {
+        'year': HEAVENLY_STEMS[year_stem_index] + EARTHLY_BRANCHES[year_branch_index],
+        'month': HEAVENLY_STEMS[month_stem_index] + EARTHLY_BRANCHES[month_branch_index],
+        'day': HEAVENLY_STEMS[day_stem_index] + EARTHLY_BRANCHES[day_branch_index],
+        'hour': get_hour_ganzhi(solar_date.year, solar_date.month, solar_date.day, hour)
+    }
+
+def legacy_chart(year, month, day, hour, is_lunar):
+    """原build_basic_prediction中的命盘计算步骤"""
+    if is_lunar:
+        birth_date = lunar_to_solar(year, month, day)['solar_date']
+    else:
+        birth_date = datetime.date(year, month, day)
+
+    eight_characters = legacy_eight_characters(year, month, day, hour, is_lunar)
+    zodiac_sign = get_zodiac_sign(birth_date.month, birth_date.day)
+    zodiac = solar_to_lunar(birth_date.year, birth_date.month, birth_date.day)['zodiac']
+
+    char_elements = get_catalog().five_elements
+    five_elements = []
+    for pillar in eight_characters.values():
+        for char in pillar:
+            if char in char_elements:
+                element = char_elements[char]
+                if element not in five_elements:
+                    five_elements.append(element)
+
+    lucky_number1 = (birth_date.day + birth_date.month) % 9 + 1
+    lucky_number2 = (birth_date.year % 100) % 9 + 1
+    if lucky_number1 == lucky_number2:
+        lucky_number2 = (lucky_number2 % 9) + 1
+
+    lucky_colors = []
+    for element in five_elements:
+        lucky_colors.extend(ELEMENT_LUCKY_COLORS[element])
+
+    return (birth_date, zodiac, zodiac_sign, eight_characters, five_elements,
+            [lucky_number1, lucky_number2], lucky_colors)
+
+def chart_tuple(chart):
+    return (chart.solar_date, chart.zodiac, chart.zodiac_sign, chart.eight_characters(),
+            list(chart.five_elements), list(chart.lucky_numbers), list(chart.lucky_colors))
+
+def generate_records(count, seed=0):
+    """随机生成有效的出生信息，阳历和阴历各半"""
+    rnd = random.Random(seed)
+    records = []
+    while len(records) < count:
+        year, month, day = rnd.randint(1901, 2099), rnd.randint(1, 12), rnd.randint(1, 30)
+        is_lunar = rnd.random() < 0.5
+        if is_lunar and not is_valid_lunar_date(year, month, day):
+            continue
+        if not is_lunar:
+            day = min(day, 28)
+        records.append((year, month, day, rnd.randint(0, 23), is_lunar))
+    return records
+
+def cpu_time(function, records):
+    start = time.process_time()
+    for record in records:
+        function(*record)
+    return (time.process_time() - start) / len(records) * 1e6
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    records = generate_records(count)
+
+    for record in records:
+        assert chart_tuple(BirthChart(*record)) == legacy_chart(*record), record
+    print(f"命盘比对 {count} 条，全部一致")
+
+    before = cpu_time(legacy_chart, records)
+    cold = cpu_time(BirthChart, records)
+
+    # 缓存命中：取缓存容量以内的记录，先计算一遍
+    cached = records[:BIRTH_CHART_CACHE_SIZE // 2]
+    get_birth_chart.cache_clear()
+    cpu_time(get_birth_chart, cached)
+    warm = cpu_time(get_birth_chart, cached)
+    print(f"原逐项换算: {before:.2f}us/次")
+    print(f"BirthChart首次计算: {cold:.2f}us/次 ({before / cold:.1f}x)")
+    print(f"BirthChart缓存命中: {warm:.2f}us/次 ({before / warm:.1f}x)")
+    print(f"每次请求节省CPU {before - cold:.2f}us(未命中) / {before - warm:.2f}us(命中)")
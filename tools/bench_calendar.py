@@ -0,0 +1,94 @@
+"""
+手串饰品预测软件 - 阴阳历转换校验与基准测试
+将查表实现与lunarcalendar逐日比对，并比较单次转换耗时
+
+用法:
+    python tools/bench_calendar.py
+"""
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lunarcalendar import Converter, Solar, Lunar, DateNotExist
+from lunar_solar_converter import (
+    solar_to_lunar, lunar_to_solar, is_valid_lunar_date,
+    LUNAR_MIN_YEAR, LUNAR_MAX_YEAR, SOLAR_MIN_DATE, SOLAR_MAX_DATE
+)
+
+def verify_solar_to_lunar():
+    """逐日比对阳历转阴历，返回比对的天数"""
+    date = SOLAR_MIN_DATE
+    count = 0
+    while date <= SOLAR_MAX_DATE:
+        expected = Converter.Solar2Lunar(Solar(date.year, date.month, date.day))
+        actual = solar_to_lunar(date.year, date.month, date.day)
+        got = (actual['lunar_year'], actual['lunar_month'], actual['lunar_day'], actual['is_leap_month'])
+        want = (expected.year, expected.month, expected.day, expected.isleap)
+        assert got == want, f"{date}: {got} != {want}"
+        date += datetime.timedelta(days=1)
+        count += 1
+    return count
+
+def verify_lunar_to_solar():
+    """比对所有阴历年月日(含无效日期和闰月标记)，返回比对的组合数"""
+    count = 0
+    for year in range(LUNAR_MIN_YEAR, LUNAR_MAX_YEAR + 1):
+        for month in range(1, 13):
+            for is_leap in (False, True):
+                for day in range(1, 32):
+                    try:
+                        expected = Converter.Lunar2Solar(Lunar(year, month, day, is_leap))
+                        expected = datetime.date(expected.year, expected.month, expected.day)
+                    except DateNotExist:
+                        expected = None
+
+                    valid = is_valid_lunar_date(year, month, day, is_leap)
+                    assert valid == (expected is not None), f"{year}-{month}-{day} leap={is_leap}"
+                    if expected is not None:
+                        actual = lunar_to_solar(year, month, day, is_leap)['solar_date']
+                        assert actual == expected, f"{year}-{month}-{day} leap={is_leap}: {actual} != {expected}"
+                    count += 1
+    return count
+
+def _legacy_solar_to_lunar(year, month, day):
+    """原实现：每次构造Solar对象并调用Converter"""
+    lunar_date = Converter.Solar2Lunar(Solar(year, month, day))
+    return {
+        'lunar_year': lunar_date.year,
+        'lunar_month': lunar_date.month,
+        'lunar_day': lunar_date.day,
+        'is_leap_month': lunar_date.isleap,
+        'lunar_date': f"{lunar_date.year}年{'闰' if lunar_date.isleap else ''}{lunar_date.month}月{lunar_date.day}日",
+        'solar_date': datetime.date(year, month, day)
+    }
+
+def _legacy_lunar_to_solar(year, month, day, is_leap_month=False):
+    """原实现：每次构造Lunar对象(含往返校验)并调用Converter"""
+    solar_date = Converter.Lunar2Solar(Lunar(year, month, day, is_leap_month))
+    return {
+        'solar_year': solar_date.year,
+        'solar_month': solar_date.month,
+        'solar_day': solar_date.day,
+        'solar_date': datetime.date(solar_date.year, solar_date.month, solar_date.day),
+        'lunar_date': f"{year}年{'闰' if is_leap_month else ''}{month}月{day}日"
+    }
+
+def benchmark(number=20000):
+    """比较单次转换耗时(微秒)"""
+    cases = [
+        ('阳历转阴历', lambda: _legacy_solar_to_lunar(1990, 6, 15), lambda: solar_to_lunar(1990, 6, 15)),
+        ('阴历转阳历', lambda: _legacy_lunar_to_solar(1990, 5, 23, True), lambda: lunar_to_solar(1990, 5, 23, True)),
+        ('阴历日期校验', lambda: _legacy_lunar_to_solar(1990, 5, 23), lambda: is_valid_lunar_date(1990, 5, 23)),
+    ]
+    for name, legacy, table in cases:
+        legacy_us = timeit.timeit(legacy, number=number) / number * 1e6
+        table_us = timeit.timeit(table, number=number) / number * 1e6
+        print(f"{name}: lunarcalendar {legacy_us:.2f}us, 查表 {table_us:.2f}us, 加速 {legacy_us / table_us:.1f}x")
+
+if __name__ == '__main__':
+    print(f"阳历转阴历校验通过: {verify_solar_to_lunar()} 天")
+    print(f"阴历转阳历校验通过: {verify_lunar_to_solar()} 个组合")
+    benchmark()
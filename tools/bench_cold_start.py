@@ -0,0 +1,65 @@
+"""
+手串饰品预测软件 - 冷启动基准测试
+每次在新的Python进程中导入app并处理一个请求，按路由统计导入耗时和从导入开始到首个响应的耗时，
+分别在有启动快照和没有启动快照时测量
+
+用法:
+    python tools/bench_cold_start.py [每个路由的进程数]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (方法, 路径, 请求体)
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/share', None),
+    ('POST', '/api/convert/solar-to-lunar', {'year': 1990, 'month': 5, 'day': 3}),
+    ('POST', '/api/calculate/eight-characters', {'year': 1990, 'month': 5, 'day': 3, 'hour': 8}),
+    ('GET', '/api/catalog', None),
+    ('POST', '/api/recommend/products', {'birth_year': 1990, 'birth_month': 5, 'birth_day': 3, 'k': 10}),
+]
+
+# 在子进程中执行：导入app，处理一个请求，输出耗时(毫秒)
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+method, path, body = json.loads(sys.argv[1])
+response = app.app.test_client().open(path, method=method, json=body)
+response.get_data()
+done = time.perf_counter()
+assert response.status_code == 200, (path, response.status_code)
+print(json.dumps({'import': (imported - start) * 1000, 'first_response': (done - start) * 1000}))
+"""
+
+def measure(route, runs, env):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD, json.dumps(route)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return (statistics.median(result['import'] for result in results),
+            statistics.median(result['first_response'] for result in results))
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    with tempfile.TemporaryDirectory() as empty_dir:
+        envs = [
+            ('有快照', dict(os.environ)),
+            ('无快照', dict(os.environ, STARTUP_SNAPSHOT_DIR=empty_dir)),
+        ]
+        print(f"{'路由':<40} {'快照':<6} {'导入(ms)':>10} {'首个响应(ms)':>14}")
+        for route in ROUTES:
+            for name, env in envs:
+                imported, first_response = measure(route, runs, env)
+                print(f"{route[0] + ' ' + route[1]:<40} {name:<6} {imported:>10.1f} {first_response:>14.1f}")
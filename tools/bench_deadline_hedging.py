@@ -0,0 +1,136 @@
+"""
+手串饰品预测软件 - 请求截止时间与对冲请求基准测试
+启动本地模拟DeepSeek API服务器(响应延迟按指定分布随机)，分别测量不对冲、按p95对冲、
+设置请求截止时间三种情况下增强预测的耗时分位数和上游请求数
+
+延迟分布:
+    bimodal:快速延迟,慢速延迟,慢速比例   例如 bimodal:0.05,1.0,0.05
+    lognormal:中位数,sigma              例如 lognormal:0.1,0.8
+
+用法:
+    python tools/bench_deadline_hedging.py [请求数] [延迟分布] [截止时间(毫秒)]
+"""
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 每个请求的提示信息不同，并关闭结果缓存，保证每次都请求上游
+os.environ['DEEPSEEK_CACHE_TTL'] = '0'
+
+import deepseek_async
+
+# 同时发出增强预测的线程数
+CONCURRENCY = 8
+
+def parse_distribution(spec):
+    """
+    解析延迟分布
+
+    返回:
+        无参数函数，每次调用返回一个随机延迟(秒)
+    """
+    name, _, args = spec.partition(':')
+    values = [float(value) for value in args.split(',')]
+    if name == 'bimodal':
+        fast, slow, slow_ratio = values
+        return lambda: slow if random.random() < slow_ratio else fast
+    if name == 'lognormal':
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f'未知的延迟分布: {spec}')
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """模拟chat/completions接口，按延迟分布等待后返回固定的增强内容"""
+
+    protocol_version = 'HTTP/1.1'
+    latency = staticmethod(lambda: 0.0)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency())
+        content = json.dumps({
+            'yearly_fortune': '流年运势平稳',
+            'purpose_advice': '循序渐进',
+            'bracelet_recommendation': '黄水晶手串',
+            'usage_tips': '佩戴于左手'
+        }, ensure_ascii=False)
+        body = json.dumps({
+            'choices': [{'message': {'content': content}}],
+            'usage': {'prompt_tokens': 300, 'completion_tokens': 200, 'total_tokens': 500}
+        }).encode('utf-8')
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 对冲请求抢先返回后，另一个请求已被客户端取消
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def run(requests_count, deadline_ms=None):
+    """并发发出增强预测，返回每次的耗时(秒)和得到增强结果的次数"""
+    run_id = f'{time.time_ns()}'
+
+    def predict(index):
+        basic_prediction = {'name': f'用户{run_id}-{index}', 'purpose': '财运', 'five_elements': []}
+        start = time.monotonic()
+        deadline = None if deadline_ms is None else start + deadline_ms / 1000
+        result = deepseek_async.get_enhanced_prediction({}, basic_prediction, deadline)
+        return time.monotonic() - start, result.get('enhanced', False)
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        results = list(executor.map(predict, range(requests_count)))
+    return [latency for latency, _ in results], sum(1 for _, enhanced in results if enhanced)
+
+def report(name, latencies, enhanced, before, after):
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{name:<14} {quantiles[49] * 1000:>8.0f} {quantiles[94] * 1000:>8.0f} {quantiles[98] * 1000:>8.0f} "
+          f"{latencies[-1] * 1000:>8.0f} {enhanced / len(latencies):>8.1%} "
+          f"{after['upstream_calls'] - before['upstream_calls']:>8} {after['hedged'] - before['hedged']:>6} "
+          f"{after['hedge_wins'] - before['hedge_wins']:>6}")
+
+if __name__ == '__main__':
+    requests_count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    distribution = sys.argv[2] if len(sys.argv) > 2 else 'bimodal:0.05,1.0,0.05'
+    deadline_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 300
+
+    FakeChatHandler.latency = staticmethod(parse_distribution(distribution))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeChatHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    deepseek_async.DEEPSEEK_API_ENDPOINT = f'http://127.0.0.1:{server.server_port}/v1/chat/completions'
+
+    print(f"延迟分布 {distribution}，{requests_count} 次请求，{CONCURRENCY} 个并发")
+    print(f"{'场景':<14} {'p50(ms)':>8} {'p95(ms)':>8} {'p99(ms)':>8} {'最大(ms)':>8} {'增强比例':>8} "
+          f"{'上游请求':>8} {'对冲':>6} {'对冲胜':>6}")
+
+    scenarios = [
+        ('不对冲', 0, None),
+        ('p95对冲', 0.95, None),
+        (f'截止{deadline_ms:.0f}ms', 0, deadline_ms),
+        (f'截止+对冲', 0.95, deadline_ms),
+    ]
+    for name, quantile, deadline in scenarios:
+        deepseek_async.DEEPSEEK_HEDGE_QUANTILE = quantile
+        before = deepseek_async.get_async_stats()
+        latencies, enhanced = run(requests_count, deadline)
+        report(name, latencies, enhanced, before, deepseek_async.get_async_stats())
+        # 等待超过截止时间后在后台继续的上游请求结束
+        while deepseek_async.get_async_stats()['in_flight']:
+            time.sleep(0.05)
+
+    server.shutdown()
@@ -0,0 +1,62 @@
+"""
+手串饰品预测软件 - 批量八字计算校验与基准测试
+随机生成出生记录，逐条比对get_eight_characters_batch与get_eight_characters，
+并比较两者的吞吐量
+
+用法:
+    python tools/bench_eight_characters.py [记录数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from lunar_solar_converter import get_eight_characters, get_eight_characters_batch
+
+def generate_records(count, seed=0):
+    """生成随机出生记录(包含少量无效日期)"""
+    rng = np.random.default_rng(seed)
+    return {
+        'years': rng.integers(1899, 2102, count),
+        'months': rng.integers(0, 14, count),
+        'days': rng.integers(0, 33, count),
+        'hours': rng.integers(-2, 26, count),
+        'is_lunar': rng.random(count) < 0.5
+    }
+
+def scalar_results(records):
+    """逐条调用get_eight_characters，无效日期记为None"""
+    results = []
+    for year, month, day, hour, is_lunar in zip(records['years'].tolist(), records['months'].tolist(),
+                                                records['days'].tolist(), records['hours'].tolist(),
+                                                records['is_lunar'].tolist()):
+        try:
+            results.append(get_eight_characters(year, month, day, hour, is_lunar))
+        except ValueError:
+            results.append(None)
+    return results
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    records = generate_records(count)
+
+    start = time.perf_counter()
+    expected = scalar_results(records)
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = get_eight_characters_batch(**records)
+    batch_seconds = time.perf_counter() - start
+
+    for i, want in enumerate(expected):
+        if want is None:
+            assert not batch['valid'][i], f"记录{i}应为无效日期"
+        else:
+            got = {key: str(batch[key][i]) for key in ('year', 'month', 'day', 'hour')}
+            assert batch['valid'][i] and got == want, f"记录{i}: {got} != {want}"
+
+    print(f"校验通过: {count} 条记录，其中有效 {int(batch['valid'].sum())} 条")
+    print(f"逐条计算: {scalar_seconds * 1000:.1f}ms，批量计算: {batch_seconds * 1000:.1f}ms，"
+          f"加速 {scalar_seconds / batch_seconds:.1f}x")
@@ -0,0 +1,101 @@
+"""
+手串饰品预测软件 - 文件存储布局基准测试
+在临时目录中分别按旧版平铺布局和分级子目录布局写入大量记录，比较写入、按ID读取、
+读取不存在的ID、列出单个目录和遍历全部记录的耗时，并测量旧版文件的迁移速度
+
+用法:
+    python tools/bench_file_layout.py [记录数] [临时目录所在位置]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import STORAGE_MIGRATE_BATCH_SIZE, FileStorage
+
+# 读取测试的随机抽样数
+READ_SAMPLES = 20000
+
+# 记录内容，与分享记录大小相近
+RECORD = '{"prediction_id": "%s", "expire_time": 1900000000.0, "created_time": 1700000000.0}'
+
+def write_flat(storage, ids):
+    """按旧版平铺布局写入文件，同样先写临时文件再重命名，只比较布局的差异"""
+    for record_id in ids:
+        path = storage.legacy_path('shares', record_id)
+        temp_path = os.path.join(os.path.dirname(path), f".{record_id}.tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(RECORD % record_id)
+        os.replace(temp_path, path)
+
+def write_sharded(storage, ids):
+    for record_id in ids:
+        storage.write_record('shares', record_id, RECORD % record_id)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def read_all(storage, ids):
+    for record_id in ids:
+        assert storage.read_record('shares', record_id) is not None
+
+def read_missing(storage, ids):
+    for record_id in ids:
+        assert storage.read_record('shares', record_id) is None
+
+def walk_all(storage):
+    return sum(1 for _ in storage.iter_records('shares'))
+
+def list_one_directory(storage, record_id):
+    """列出某个记录所在的目录，平铺布局为整个shares目录"""
+    return len(os.listdir(os.path.dirname(storage.find_record('shares', record_id))))
+
+def migrate_all(storage):
+    batches = 0
+    while storage.migrate_layout(STORAGE_MIGRATE_BATCH_SIZE):
+        batches += 1
+    return batches
+
+def run(layout, count, base_dir):
+    directory = tempfile.mkdtemp(prefix=f'bench_{layout}_', dir=base_dir)
+    try:
+        storage = FileStorage(directory)
+        storage.ensure_storage_dir()
+        ids = [str(uuid.uuid4()) for _ in range(count)]
+
+        write_seconds, _ = timed(write_flat if layout == 'flat' else write_sharded, storage, ids)
+        samples = random.sample(ids, min(READ_SAMPLES, count))
+        missing = [str(uuid.uuid4()) for _ in range(len(samples))]
+        read_seconds, _ = timed(read_all, storage, samples)
+        miss_seconds, _ = timed(read_missing, storage, missing)
+        list_seconds, listed = timed(list_one_directory, storage, samples[0])
+        walk_seconds, walked = timed(walk_all, storage)
+        assert walked == count
+
+        print(f"{layout:<8} 写入 {count / write_seconds:>8.0f} 条/秒  "
+              f"读取 {read_seconds / len(samples) * 1e6:>6.1f}us  "
+              f"不存在 {miss_seconds / len(missing) * 1e6:>6.1f}us  "
+              f"列出目录({listed}项) {list_seconds * 1000:>8.1f}ms  "
+              f"遍历全部 {walk_seconds:>6.2f}s")
+
+        if layout == 'flat':
+            migrate_seconds, batches = timed(migrate_all, storage)
+            read_seconds, _ = timed(read_all, storage, samples)
+            print(f"{'迁移':<8} {count / migrate_seconds:>8.0f} 条/秒，{batches} 批  "
+                  f"迁移后读取 {read_seconds / len(samples) * 1e6:>6.1f}us")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    base_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f"{count} 条记录")
+    for layout in ('flat', 'sharded'):
+        run(layout, count, base_dir)
@@ -0,0 +1,93 @@
+"""
+手串饰品预测软件 - HTTP客户端基准测试
+启动本地HTTPS模拟服务器，比较每次新建连接的requests.post与共享连接池的单次请求耗时
+
+用法:
+    python tools/bench_http_client.py [请求次数] [模拟网络往返延迟(毫秒)]
+"""
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from http_client import get_session
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """模拟chat/completions接口，支持HTTP/1.1长连接"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    round_trip_delay = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({'choices': [{'message': {'content': '{}'}}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def setup(self):
+        # 每次握手前模拟一次网络往返
+        time.sleep(self.round_trip_delay)
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+def create_certificate(directory):
+    """使用openssl生成localhost自签名证书"""
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost',
+         '-keyout', key, '-out', cert],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+def start_server(cert, key):
+    server = ThreadingHTTPServer(('localhost', 0), FakeChatHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def measure(post, url, count, cert):
+    payload = json.dumps({'model': 'deepseek-chat', 'messages': []})
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = post(url, data=payload, headers={'Content-Type': 'application/json'}, timeout=10, verify=cert)
+        response.json()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return sum(latencies) / count * 1000, latencies[int(count * 0.95) - 1] * 1000
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    FakeChatHandler.round_trip_delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = create_certificate(directory)
+        server = start_server(cert, key)
+        url = f"https://localhost:{server.server_address[1]}/v1/chat/completions"
+
+        before = measure(requests.post, url, count, cert)
+        after = measure(get_session().post, url, count, cert)
+        server.shutdown()
+
+    print(f"每次新建连接(requests.post): 平均 {before[0]:.2f}ms, p95 {before[1]:.2f}ms")
+    print(f"共享连接池(get_session):     平均 {after[0]:.2f}ms, p95 {after[1]:.2f}ms")
+    print(f"单次请求节省 {before[0] - after[0]:.2f}ms ({before[0] / after[0]:.1f}x)")
@@ -0,0 +1,57 @@
+"""
+手串饰品预测软件 - 商品推荐基准测试
+随机生成指定数量的SKU，测量向量化打分、价格库存过滤和前k个选取的单次耗时
+
+用法:
+    python tools/bench_inventory.py [SKU数] [k]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import get_catalog
+from inventory import Inventory
+
+def generate_records(count, seed=0):
+    """按材质目录随机生成SKU记录"""
+    rnd = random.Random(seed)
+    materials = get_catalog().materials
+    records = []
+    for i in range(count):
+        material = rnd.choice(materials)
+        records.append({
+            'sku': f"SKU{i:07d}",
+            'material': material.name,
+            'color': rnd.choice(material.colors),
+            'bead_size_mm': rnd.choice((6, 8, 10, 12, 14)),
+            'price': float(rnd.randint(30, 3000)),
+            'stock': rnd.choice((0, 1, 5, 20, 100))
+        })
+    return records
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    start = time.perf_counter()
+    inventory = Inventory(generate_records(count), get_catalog())
+    print(f"编译 {count} 个SKU: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    basic_prediction = {
+        'five_elements': ['木', '火', '土'],
+        'lucky_colors': ['绿色', '青色', '红色', '紫色', '黄色', '棕色'],
+        'purpose': '财运',
+        'religion': '佛教'
+    }
+    for label, filters in (('无过滤', {}), ('价格100-800', {'min_price': 100, 'max_price': 800})):
+        latencies = []
+        for _ in range(200):
+            start = time.perf_counter()
+            top, scores, matched = inventory.rank(basic_prediction, k, **filters)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f"{label}: 符合条件 {matched} 个, 平均 {sum(latencies) / len(latencies) * 1000:.3f}ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.3f}ms, 最高得分 {scores[0]}")
@@ -0,0 +1,144 @@
+"""
+手串饰品预测软件 - 存储记录格式基准测试
+比较旧版缩进JSON与带格式头的紧凑格式(不压缩、zlib、zstd，标准库json或orjson)每条预测结果的
+编码字节数、按文件存储和SQLite存储实际占用的磁盘空间，以及编码和解码耗时
+
+记录默认按真实结构随机生成；指定文件存储目录时使用其中已保存的预测结果
+
+用法:
+    python tools/bench_record_format.py [记录数] [文件存储目录]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import record_format
+from record_format import decode_record, encode_record
+from storage import FileStorage
+
+# 生成增强内容所用的短语，按真实回答的长度随机拼接
+PHRASES = (
+    '流年运势平稳向上', '贵人相助', '宜稳健理财', '忌冲动投资', '上半年事业有新机遇', '下半年注意身体',
+    '五行缺水', '可多接触蓝色与黑色', '推荐佩戴黄水晶手串', '白水晶有助于净化磁场', '佩戴于左手',
+    '定期用清水净化', '避免与他人共用', '感情方面宜主动沟通', '财运随努力逐步提升', '注意休息与作息'
+)
+
+def random_text(length):
+    parts = []
+    while sum(len(part) for part in parts) < length:
+        parts.append(random.choice(PHRASES))
+    return '，'.join(parts) + '。'
+
+def sample_prediction(index):
+    """构造一条接近真实大小的预测结果，增强内容约600到2400字(DeepSeek回答上限为2000 token)"""
+    scale = random.uniform(0.7, 2.8)
+    return {
+        'basic_prediction': {
+            'name': f'用户{index}',
+            'birth_date': '1990-06-15',
+            'eight_characters': {'year': '庚午', 'month': '壬午', 'day': '辛丑', 'hour': '庚寅'},
+            'five_elements': ['金', '火', '水', '土'],
+            'lucky_colors': ['白色', '金色', '红色', '紫色'],
+            'purpose': '财运',
+            'religion': '无'
+        },
+        'enhanced_prediction': {
+            'enhanced': True,
+            'yearly_fortune': random_text(int(400 * scale)),
+            'purpose_advice': random_text(int(200 * scale)),
+            'bracelet_recommendation': random_text(int(150 * scale)),
+            'usage_tips': random_text(int(100 * scale))
+        },
+        'bracelet_recommendation': {'source': 'enhanced', 'recommendation': '黄水晶'},
+        'timestamp': time.time()
+    }
+
+def load_predictions(directory, count):
+    storage = FileStorage(directory)
+    records = []
+    for prediction_id, _ in storage.iter_records('predictions'):
+        prediction = storage.get_prediction(prediction_id)
+        if prediction is not None:
+            records.append(prediction)
+            if len(records) >= count:
+                break
+    return records
+
+def disk_usage(encoded):
+    """
+    分别按文件存储(每条一个文件)和SQLite存储写入临时目录，统计实际占用的磁盘空间
+
+    返回:
+        (文件存储的字节数, SQLite数据库的字节数)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        file_total = 0
+        for index, data in enumerate(encoded):
+            path = os.path.join(directory, f'{index}.json')
+            with open(path, 'wb') as f:
+                f.write(data)
+            file_total += os.stat(path).st_blocks * 512
+
+        path = os.path.join(directory, 'storage.db')
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.execute("CREATE TABLE predictions (id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+            conn.executemany("INSERT INTO predictions (data) VALUES (?)", ((data,) for data in encoded))
+        conn.close()
+        return file_total, os.path.getsize(path)
+
+def run(name, records, version, compression, use_orjson):
+    serializer = record_format.orjson
+    if not use_orjson:
+        record_format.orjson = None
+    try:
+        start = time.perf_counter()
+        encoded = [encode_record(record, version=version, compression=compression) for record in records]
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = [decode_record(data) for data in encoded]
+        decode_seconds = time.perf_counter() - start
+    finally:
+        record_format.orjson = serializer
+    assert decoded == records
+
+    count = len(records)
+    size = sum(len(data) for data in encoded)
+    file_size, sqlite_size = disk_usage(encoded)
+    print(f"{name:<18} {size / count:>8.0f} {file_size / count:>10.0f} {sqlite_size / count:>10.0f} "
+          f"{encode_seconds / count * 1e6:>10.1f} {decode_seconds / count * 1e6:>10.1f}")
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    if len(sys.argv) > 2:
+        records = load_predictions(sys.argv[2], count)
+        print(f"{sys.argv[2]} 中的 {len(records)} 条预测结果")
+    else:
+        records = [sample_prediction(index) for index in range(count)]
+        print(f"随机生成 {count} 条预测结果")
+    if not records:
+        sys.exit("没有可用的预测结果")
+
+    scenarios = [
+        ('旧版缩进JSON', 0, 'none', False),
+        ('紧凑 json', 1, 'none', False),
+        ('紧凑 orjson', 1, 'none', True),
+        ('zlib json', 1, 'zlib', False),
+        ('zlib orjson', 1, 'zlib', True),
+    ]
+    if record_format.zstandard is not None:
+        scenarios.append(('zstd orjson', 1, 'zstd', True))
+    else:
+        print("未安装zstandard，跳过zstd")
+    if record_format.orjson is None:
+        print("未安装orjson，orjson场景实际使用标准库json")
+
+    print(f"{'格式':<18} {'字节/条':>8} {'文件磁盘/条':>10} {'SQLite/条':>10} {'编码(us)':>10} {'解码(us)':>10}")
+    for name, version, compression, use_orjson in scenarios:
+        run(name, records, version, compression, use_orjson)
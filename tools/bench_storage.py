@@ -0,0 +1,76 @@
+"""
+手串饰品预测软件 - 存储后端基准测试
+在临时目录中比较文件存储与SQLite存储的写入和读取吞吐量
+
+用法:
+    python tools/bench_storage.py [记录数,记录数,...] [后端,后端,...]
+    默认记录数为 10000,100000,1000000，默认后端为 file,sqlite
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import FileStorage, SQLiteStorage
+
+# 读取测试的随机抽样数
+READ_SAMPLES = 10000
+
+def sample_prediction(index):
+    """构造一条接近真实大小的预测结果"""
+    return {
+        'basic_prediction': {
+            'name': f'用户{index}',
+            'birth_date': '1990-06-15',
+            'eight_characters': {'year': '庚午', 'month': '壬午', 'day': '辛丑', 'hour': '庚寅'},
+            'five_elements': ['金', '火', '水', '土'],
+            'lucky_colors': ['白色', '金色', '红色', '紫色'],
+            'purpose': '财运',
+            'religion': '无'
+        },
+        'enhanced_prediction': {
+            'enhanced': True,
+            'yearly_fortune': '流年运势平稳向上，' * 40,
+            'purpose_advice': '宜稳健理财，' * 30,
+            'bracelet_recommendation': '推荐佩戴黄水晶手串，' * 20,
+            'usage_tips': '佩戴于左手，' * 15
+        },
+        'bracelet_recommendation': {'source': 'enhanced', 'recommendation': '黄水晶'}
+    }
+
+def create_backend(name, directory):
+    if name == 'file':
+        return FileStorage(directory)
+    return SQLiteStorage(os.path.join(directory, 'storage.db'))
+
+def run(name, count):
+    with tempfile.TemporaryDirectory() as directory:
+        backend = create_backend(name, directory)
+
+        start = time.perf_counter()
+        ids = []
+        for i in range(count):
+            prediction_id = backend.save_prediction(sample_prediction(i))
+            ids.append(prediction_id)
+            if i % 10 == 0:
+                backend.save_share(prediction_id)
+        write_seconds = time.perf_counter() - start
+
+        samples = random.sample(ids, min(READ_SAMPLES, count))
+        start = time.perf_counter()
+        for prediction_id in samples:
+            assert backend.get_prediction(prediction_id) is not None
+        read_seconds = time.perf_counter() - start
+
+    print(f"{name:>6} {count:>8}: 写入 {count / write_seconds:>8.0f} 条/秒，"
+          f"读取 {len(samples) / read_seconds:>8.0f} 条/秒")
+
+if __name__ == '__main__':
+    counts = [int(c) for c in (sys.argv[1] if len(sys.argv) > 1 else '10000,100000,1000000').split(',')]
+    backends = (sys.argv[2] if len(sys.argv) > 2 else 'file,sqlite').split(',')
+    for count in counts:
+        for name in backends:
+            run(name, count)
@@ -0,0 +1,27 @@
+"""
+手串饰品预测软件 - 启动快照生成工具
+预先计算阴历查找表和当前材质目录的手串推荐结果，写入启动快照目录；
+部署前运行，修改阴历、推荐模块或材质目录后需要重新生成
+
+用法:
+    python tools/build_startup_snapshot.py [快照目录]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import CATALOG_PATH, load_catalog
+from lunar_solar_converter import _build_calendar_tables
+from startup_snapshot import STARTUP_SNAPSHOT_DIR, write_snapshot_section
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else STARTUP_SNAPSHOT_DIR
+
+    path = write_snapshot_section('calendar', _build_calendar_tables(), directory=directory)
+    print(f"已写入 {path}: 阴历查找表")
+
+    catalog = load_catalog(CATALOG_PATH)
+    recommendations = catalog.recommendation_index.snapshot()
+    path = write_snapshot_section('recommendations', recommendations, key=catalog.etag, directory=directory)
+    print(f"已写入 {path}: {len(recommendations)} 条推荐结果(材质目录 {catalog.etag})")
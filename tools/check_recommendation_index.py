@@ -0,0 +1,169 @@
+"""
+手串饰品预测软件 - 手串推荐索引校验与基准测试
+在整个输入域(五行组合 x 所求事项 x 宗教信仰 x 幸运颜色组合)上比对推荐索引与原逐项扫描实现，
+并比较单次推荐耗时
+
+用法:
+    python tools/check_recommendation_index.py
+"""
+import itertools
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import recommend_bracelet
+from catalog import get_catalog
+from lunar_solar_converter import ELEMENT_LUCKY_COLORS
+from recommendation import ALL_ELEMENTS, PURPOSE_ELEMENTS
+
+# 当前材质目录的原始数据
+BRACELET_MATERIALS = get_catalog().source['materials']
+RELIGIOUS_MATERIALS = get_catalog().source['religious_materials']
+RELIGIOUS_SYMBOLS = get_catalog().source['religious_symbols']
+
+def reference_recommend_bracelet(basic_prediction):
+    """原逐项扫描的基本推荐实现"""
+    five_elements = basic_prediction.get('five_elements', [])
+    lucky_colors = basic_prediction.get('lucky_colors', [])
+    purpose = basic_prediction.get('purpose', '财运')
+    religion = basic_prediction.get('religion', '无')
+
+    missing_elements = []
+    all_elements = ['木', '火', '土', '金', '水']
+    for element in all_elements:
+        if element not in five_elements:
+            missing_elements.append(element)
+
+    if not missing_elements:
+        if purpose == '财运':
+            missing_elements = ['金', '木']
+        elif purpose == '事业':
+            missing_elements = ['火', '木']
+        elif purpose == '健康':
+            missing_elements = ['土', '金']
+        elif purpose == '婚姻':
+            missing_elements = ['火', '土']
+        elif purpose == '学业':
+            missing_elements = ['水', '木']
+        elif purpose == '人际':
+            missing_elements = ['火', '木']
+        elif purpose == '破小人':
+            missing_elements = ['金', '水']
+        else:
+            missing_elements = ['土']
+
+    recommended_materials = []
+    for material, info in BRACELET_MATERIALS.items():
+        if info['五行'] in missing_elements:
+            has_lucky_color = False
+            for color in info['颜色']:
+                if color in lucky_colors:
+                    has_lucky_color = True
+                    break
+
+            recommended_materials.append({
+                'name': material,
+                'element': info['五行'],
+                'colors': info['颜色'],
+                'effects': info['功效'],
+                'suitable_for': info['适合人群'],
+                'has_lucky_color': has_lucky_color
+            })
+
+    religious_materials = RELIGIOUS_MATERIALS.get(religion, [])
+    for material in religious_materials:
+        if material in BRACELET_MATERIALS:
+            info = BRACELET_MATERIALS[material]
+            already_recommended = False
+            for rec in recommended_materials:
+                if rec['name'] == material:
+                    already_recommended = True
+                    break
+
+            if not already_recommended:
+                has_lucky_color = False
+                for color in info['颜色']:
+                    if color in lucky_colors:
+                        has_lucky_color = True
+                        break
+
+                recommended_materials.append({
+                    'name': material,
+                    'element': info['五行'],
+                    'colors': info['颜色'],
+                    'effects': info['功效'],
+                    'suitable_for': info['适合人群'],
+                    'has_lucky_color': has_lucky_color,
+                    'religious': True
+                })
+
+    religious_symbols = RELIGIOUS_SYMBOLS.get(religion, [])
+
+    recommendation_text = f"根据您的五行属性和{purpose}需求，推荐以下手串材质组合：\n\n"
+    for i, material in enumerate(recommended_materials[:3]):
+        recommendation_text += f"{i+1}. {material['name']}（{material['element']}属性）\n"
+        recommendation_text += f"   颜色：{', '.join(material['colors'])}\n"
+        recommendation_text += f"   功效：{', '.join(material['effects'])}\n"
+        recommendation_text += f"   适合：{', '.join(material['suitable_for'])}\n\n"
+
+    if religious_symbols:
+        recommendation_text += f"根据您的{religion}信仰，建议在手串上添加以下吉祥物或符号：\n"
+        recommendation_text += f"{', '.join(religious_symbols[:3])}\n\n"
+
+    recommendation_text += "佩戴建议：\n"
+    recommendation_text += "1. 手串通常佩戴在左手，因为左手靠近心脏，能更好地吸收能量。\n"
+    recommendation_text += "2. 新购买的手串最好先净化，可以用清水冲洗或放在阳光下晒一晒。\n"
+    recommendation_text += "3. 佩戴时保持心态平和，有助于增强手串的效果。\n"
+    recommendation_text += "4. 定期清洁手串，保持其能量纯净。\n"
+
+    return {
+        'source': 'basic',
+        'missing_elements': missing_elements,
+        'materials': recommended_materials[:3],
+        'religious_symbols': religious_symbols[:3],
+        'recommendation': recommendation_text
+    }
+
+def subsets(items):
+    for size in range(len(items) + 1):
+        yield from itertools.combinations(items, size)
+
+def verify():
+    """比对整个输入域，未知的所求事项和宗教信仰各取一个代表值，返回比对的组合数"""
+    purposes = list(PURPOSE_ELEMENTS) + ['其他']
+    religions = list(RELIGIOUS_SYMBOLS) + ['其他']
+    colors = sorted({color for colors in ELEMENT_LUCKY_COLORS.values() for color in colors})
+    color_sets = [list(colors) for colors in subsets(colors)]
+
+    count = 0
+    for five_elements in subsets(ALL_ELEMENTS):
+        for purpose in purposes:
+            for religion in religions:
+                for lucky_colors in color_sets:
+                    basic_prediction = {
+                        'five_elements': list(five_elements),
+                        'lucky_colors': lucky_colors,
+                        'purpose': purpose,
+                        'religion': religion
+                    }
+                    expected = reference_recommend_bracelet(basic_prediction)
+                    actual = recommend_bracelet(basic_prediction, {})
+                    assert actual == expected, f"{basic_prediction}: {actual} != {expected}"
+                    count += 1
+    return count
+
+if __name__ == '__main__':
+    print(f"推荐结果比对 {verify()} 组，全部一致")
+
+    basic_prediction = {
+        'five_elements': ['木', '火', '土'],
+        'lucky_colors': ['绿色', '青色', '红色', '紫色', '黄色', '棕色'],
+        'purpose': '财运',
+        'religion': '佛教'
+    }
+    number = 100000
+    before = timeit.timeit(lambda: reference_recommend_bracelet(basic_prediction), number=number) / number * 1e6
+    after = timeit.timeit(lambda: recommend_bracelet(basic_prediction, {}), number=number) / number * 1e6
+    print(f"逐项扫描: {before:.2f}us/次, 推荐索引: {after:.2f}us/次 ({before / after:.1f}x)")
@@ -0,0 +1,71 @@
+"""
+手串饰品预测软件 - 存储迁移工具
+把文件存储目录中的预测结果和分享导入SQLite存储
+
+用法:
+    python tools/migrate_storage.py [文件存储目录] [SQLite数据库路径]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from record_format import decode_record
+from storage import STORAGE_DIR, SQLITE_PATH, FileStorage, SQLiteStorage
+
+# 每个事务导入的记录数
+BATCH_SIZE = 1000
+
+def iter_records(storage, kind):
+    """逐个读取文件存储中的记录(包括旧版平铺布局和分级子目录)，跳过无法解析的文件"""
+    if not os.path.isdir(os.path.join(storage.directory, kind)):
+        return
+    for record_id, entry in storage.iter_records(kind):
+        try:
+            with open(entry.path, 'rb') as f:
+                yield record_id, decode_record(f.read())
+        except Exception:
+            print(f"跳过无法读取的文件: {entry.path}", file=sys.stderr)
+
+def iter_batches(records):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def migrate(source_dir, target):
+    """
+    迁移文件存储到SQLite存储
+
+    参数:
+        source_dir: 文件存储目录
+        target: SQLiteStorage对象
+
+    返回:
+        (导入的预测结果数, 导入的分享数)
+    """
+    source = FileStorage(source_dir)
+
+    prediction_count = 0
+    for batch in iter_batches(iter_records(source, "predictions")):
+        target.import_records(batch, [])
+        prediction_count += len(batch)
+
+    share_count = 0
+    shares = (record for record in iter_records(source, "shares")
+              if record[1].get('prediction_id'))
+    for batch in iter_batches(shares):
+        target.import_records([], batch)
+        share_count += len(batch)
+
+    return prediction_count, share_count
+
+if __name__ == '__main__':
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else STORAGE_DIR
+    target_path = sys.argv[2] if len(sys.argv) > 2 else SQLITE_PATH
+    predictions, shares = migrate(source_dir, SQLiteStorage(target_path))
+    print(f"迁移完成: 预测结果 {predictions} 条，分享 {shares} 条 -> {target_path}")
@@ -0,0 +1,138 @@
+"""
+手串饰品预测软件 - 分群增强内容预生成工具
+枚举(生肖、星座、五行组合、所求事项、宗教信仰)分群，分批并发请求OpenAI兼容的chat/completions接口
+生成增强内容。每批完成后追加写入检查点文件，中断后重新运行从检查点继续，失败的分群下次重试；
+最后把检查点中的全部内容写入内容库，并报告覆盖率
+
+接口通过环境变量配置:
+    SEGMENT_LLM_ENDPOINT  chat/completions接口地址，默认为DeepSeek API
+    SEGMENT_LLM_API_KEY   API密钥，默认为DEEPSEEK_API_KEY
+    SEGMENT_LLM_MODEL     模型名称，默认为DEEPSEEK_MODEL
+
+用法:
+    python tools/precompute_segments.py [内容库路径] [并发数] [本次最多生成的分群数]
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deepseek_api import (
+    DEEPSEEK_API_ENDPOINT, DEEPSEEK_API_KEY, DEEPSEEK_MODEL, ENHANCED_FIELDS,
+    build_prediction_request, create_segment_prompt, parse_enhanced_content
+)
+from http_client import get_session
+from lunar_solar_converter import LUNAR_MIN_YEAR, LUNAR_MAX_YEAR
+from segment_store import SEGMENT_STORE_PATH, enumerate_segments, parse_segment_key, write_segment_store
+
+SEGMENT_LLM_ENDPOINT = os.environ.get("SEGMENT_LLM_ENDPOINT", DEEPSEEK_API_ENDPOINT)
+SEGMENT_LLM_API_KEY = os.environ.get("SEGMENT_LLM_API_KEY", DEEPSEEK_API_KEY)
+SEGMENT_LLM_MODEL = os.environ.get("SEGMENT_LLM_MODEL", DEEPSEEK_MODEL)
+
+# 每批的分群数，每批完成后写入检查点
+BATCH_SIZE = 64
+
+# 单个分群生成内容的超时时间(秒)
+REQUEST_TIMEOUT = 120
+
+def checkpoint_path(store_path):
+    return f"{store_path}.checkpoint.jsonl"
+
+def load_checkpoint(path):
+    """读取检查点中已生成的内容，跳过中断时写了一半的行"""
+    contents = {}
+    if not os.path.exists(path):
+        return contents
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                key, content = json.loads(line)
+            except ValueError:
+                continue
+            contents[key] = content
+    return contents
+
+def generate_segment(key):
+    """
+    为一个分群生成增强内容
+
+    返回:
+        (增强内容, token用量)
+    """
+    prompt = create_segment_prompt(parse_segment_key(key))
+    headers, data = build_prediction_request(prompt)
+    headers["Authorization"] = f"Bearer {SEGMENT_LLM_API_KEY}"
+    data["model"] = SEGMENT_LLM_MODEL
+
+    response = get_session().post(SEGMENT_LLM_ENDPOINT, headers=headers, data=json.dumps(data), timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        raise ValueError(f"API请求失败: {response.status_code}")
+    result = response.json()
+    enhanced_content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+    enhanced_prediction = parse_enhanced_content(enhanced_content)
+    if 'raw_content' in enhanced_prediction:
+        raise ValueError("无法解析返回的内容")
+    content = {name: enhanced_prediction[name] for name in ENHANCED_FIELDS if name in enhanced_prediction}
+    return content, (result.get("usage") or {}).get("total_tokens", 0)
+
+def precompute(store_path, workers, limit=None):
+    """
+    生成尚未生成的分群内容并写入内容库
+
+    参数:
+        store_path: 内容库路径
+        workers: 并发请求数
+        limit: 本次最多生成的分群数，None表示全部
+    """
+    start = time.perf_counter()
+    segments = enumerate_segments(LUNAR_MIN_YEAR, LUNAR_MAX_YEAR)
+    print(f"枚举分群: {len(segments)} 个，耗时 {time.perf_counter() - start:.1f}s")
+
+    path = checkpoint_path(store_path)
+    contents = load_checkpoint(path)
+    pending = [key for key in segments if key not in contents]
+    print(f"检查点中已生成 {len(segments) - len(pending)} 个，待生成 {len(pending)} 个")
+    if limit is not None:
+        pending = pending[:limit]
+
+    generated = failed = tokens = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, open(path, 'a', encoding='utf-8') as checkpoint:
+            for batch_start in range(0, len(pending), BATCH_SIZE):
+                futures = {executor.submit(generate_segment, key): key for key in pending[batch_start:batch_start + BATCH_SIZE]}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        content, used_tokens = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"生成失败 {key}: {e}", file=sys.stderr)
+                        continue
+                    contents[key] = content
+                    generated += 1
+                    tokens += used_tokens
+                    checkpoint.write(json.dumps([key, content], ensure_ascii=False) + '\n')
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+                elapsed = time.perf_counter() - start
+                print(f"已生成 {generated}/{len(pending)}，失败 {failed}，{generated / elapsed:.1f} 个/秒，"
+                      f"token {tokens}")
+    except KeyboardInterrupt:
+        print("已中断，重新运行将从检查点继续", file=sys.stderr)
+
+    covered = {key: contents[key] for key in segments if key in contents}
+    size = write_segment_store(store_path, covered, total=len(segments))
+    print(f"已写入 {store_path}: {len(covered)}/{len(segments)} 个分群，覆盖率 {len(covered) / len(segments):.1%}，"
+          f"{size / 1024 / 1024:.1f}MB")
+
+if __name__ == '__main__':
+    store_path = sys.argv[1] if len(sys.argv) > 1 else SEGMENT_STORE_PATH
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    limit = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    precompute(store_path, workers, limit)
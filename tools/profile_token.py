@@ -0,0 +1,21 @@
+"""
+手串饰品预测软件 - 剖析请求头签发工具
+用PROFILE_SECRET签发X-Profile-Token请求头，带上该请求头的请求会被剖析，
+也用于访问/api/profiles接口
+
+用法:
+    PROFILE_SECRET=... python tools/profile_token.py [有效期秒数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiling import PROFILE_HEADER, PROFILE_SECRET, PROFILE_TOKEN_MAX_AGE, sign_profile_token
+
+if __name__ == '__main__':
+    if not PROFILE_SECRET:
+        sys.exit("未配置PROFILE_SECRET")
+    ttl = min(int(sys.argv[1]) if len(sys.argv) > 1 else 600, PROFILE_TOKEN_MAX_AGE)
+    print(f"{PROFILE_HEADER}: {sign_profile_token(PROFILE_SECRET, time.time() + ttl)}")